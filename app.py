@@ -1,23 +1,26 @@
 import streamlit as st
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import chromadb
-import pandas as pd
-from fastapi import FastAPI, HTTPException
-from indexer import handle_new_file, index_folder
+from query_cache import make_key
+from resources import (get_collection, get_embedding_function, get_facet_index, get_lexical_index, get_query_cache,
+                       get_metrics_server, get_value_index, load_index_snapshot)
+from search import (DEFAULT_CANDIDATES, DEFAULT_PAGE_SIZE, DEFAULT_TOP_K, cursor_key, hybrid_search, paginate,
+                    restrict_to_rows)
+from value_index import DEFAULT_LOOKUP_LIMIT, parse_value_query
+import logging
 import os
 from dotenv import load_dotenv
-from sheet_creator_tool import GoogleSheetsToolkit
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
-# Import the streamlit-chat package
-from streamlit_chat import message
+# indexer, sheet_creator_tool, langchain_openai và langgraph được import ở chỗ dùng đến,
+# để một lần chạy chỉ tìm kiếm không phải nạp các thư viện nặng đó
 
 # Load environment variables
 
 # Load .env file variables
 load_dotenv()
 
+# Mức log lấy từ LOG_LEVEL (mặc định INFO); nội dung ô chỉ được ghi ở mức DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
 # Set page to full width
 st.set_page_config(layout="wide")
 
@@ -28,55 +31,156 @@ st.title("Công cụ tìm kiếm Google Sheets")
 tab1, tab2, tab3 = st.tabs(["Tìm kiếm", "Index từ Google Drive", "Sheet Creator Tool"])
 
 
-# Khởi tạo Chroma với thư mục lưu trữ
-persist_directory = "./chroma_db"
-client = chromadb.PersistentClient(path=persist_directory)
+# Client Chroma, embedding function (kèm cache), BM25 và cache truy vấn được tạo một lần
+# cho mỗi process; các lần rerun của Streamlit chỉ lấy lại các instance đã có
+query_cache = get_query_cache()
+
+# Endpoint /metrics cho Prometheus, chỉ bật khi đặt METRICS_PORT
+get_metrics_server()
 
-from chromadb.utils import embedding_functions
-default_ef = embedding_functions.DefaultEmbeddingFunction()
+# Replica mới nạp index từ snapshot INDEX_SNAPSHOT (nếu có) thay vì index lại từ Google
+snapshot_result = load_index_snapshot()
+if snapshot_result and not snapshot_result["success"]:
+    st.warning(snapshot_result["message"])
 
-# Create collection with OpenAI embeddings
-collection = client.get_or_create_collection(name="spec_collection", embedding_function=default_ef)
+# Tên hiển thị của các stage trong bảng thời gian index
+STAGE_LABELS = {
+    "list": "Liệt kê file trên Drive",
+    "fetch": "Tải sheet (cộng dồn các worker)",
+    "split": "Chia document",
+    "embed": "Embed",
+    "write": "Ghi Chroma",
+    "lexical_write": "Ghi BM25, facet và value index",
+    "snapshot": "Lưu snapshot",
+    "snapshot_load": "Đọc snapshot",
+}
 
 
 with tab1:
 
     # Tạo ô nhập liệu cho truy vấn tìm kiếm
-    query = st.text_input("Nhập truy vấn tìm kiếm:")
+    query = st.text_input("Nhập truy vấn tìm kiếm:",
+                          help='Ô số, ngày tháng, boolean được tra theo cột: col:Giá > 100000, '
+                               'col:"Ngày tạo" >= 01/03/2024, col:C = 42 (kết hợp được với từ khóa)')
 
-    # Xử lý tìm kiếm khi người dùng nhập truy vấn
+    # Bộ lọc theo file, tab và cột; số document của từng lựa chọn đọc từ facet index
+    facet_index = get_facet_index()
+    filter_file, filter_tab, filter_col, filter_k = st.columns(4)
+    file_facets = facet_index.facets()["files"]
+    file_labels = {facet["value"]: f"{facet['label']} ({facet['count']})" for facet in file_facets}
+    selected_file = filter_file.selectbox("File:", [""] + list(file_labels),
+                                          format_func=lambda value: file_labels.get(value, "Tất cả"))
+    scoped_facets = facet_index.facets({"file_id": selected_file}) if selected_file else {"sheets": []}
+    tab_labels = {facet["value"]: f"{facet['label']} ({facet['count']})" for facet in scoped_facets["sheets"]}
+    selected_tab = filter_tab.selectbox("Tab:", [""] + list(tab_labels),
+                                        format_func=lambda value: tab_labels.get(value, "Tất cả"),
+                                        disabled=not selected_file)
+    column_facets = facet_index.facets({"file_id": selected_file, "sheet_id": selected_tab})["columns"] \
+        if selected_file else []
+    col_labels = {facet["value"]: f"{facet['label']} ({facet['count']})" for facet in column_facets}
+    selected_col = filter_col.selectbox("Cột:", [""] + list(col_labels),
+                                        format_func=lambda value: col_labels.get(value, "Tất cả"),
+                                        disabled=not selected_file)
+    top_k = filter_k.number_input("Số kết quả tối đa:", min_value=10, max_value=500, value=DEFAULT_TOP_K, step=10)
+    filters = {key: value for key, value in
+               (("file_id", selected_file), ("sheet_id", selected_tab), ("col", selected_col)) if value}
+
+    # Điều kiện col:<cột> <toán tử> <giá trị> được tra trong value index (các ô số/ngày/boolean
+    # không được embed), phần còn lại của truy vấn được tìm theo văn bản
+    value_conditions, text_query = [], query
     if query:
-        # Thực hiện tìm kiếm với Chroma
-        results = collection.query(
-            query_texts=[query],
+        try:
+            value_conditions, text_query = parse_value_query(query)
+        except ValueError as e:
+            st.error(str(e))
+            text_query = ""
+    value_rows = None
+    if value_conditions:
+        value_index = get_value_index()
+        matches = value_index.lookup(value_conditions, filters)
+        more = "+" if len(matches) >= DEFAULT_LOOKUP_LIMIT else ""
+        st.write(f"Tìm thấy {len(matches)}{more} ô thỏa điều kiện:" if matches else "Không có ô nào thỏa điều kiện")
+        if matches:
+            table = ["| File | Tab | Ô | Giá trị |", "| --- | --- | --- | --- |"]
+            for match in matches:
+                link = (f"https://docs.google.com/spreadsheets/d/{match['file_id']}/edit"
+                        f"#gid={match['sheet_id']}&range={match['range']}")
+                file_name, tab_name = (str(match[key]).replace("|", "\\|") for key in ("file_name", "tab_name"))
+                table.append(f"| {file_name} | {tab_name} | [{match['range']}]({link}) | {match['value']} |")
+            st.markdown("\n".join(table))
+        if text_query:
+            # Kết quả văn bản chỉ giữ các document nằm trên hàng thỏa điều kiện
+            value_rows = value_index.matching_rows(value_conditions, filters)
+            st.markdown("---")
+
+    # Xử lý tìm kiếm khi người dùng nhập truy vấn
+    if text_query:
+        collection = get_collection()
+        default_ef = get_embedding_function()
+        lexical_index = get_lexical_index()
+
+        # Tìm kiếm kết hợp BM25 + Chroma (mã định danh chỉ tra inverted index); truy vấn
+        # lặp lại được trả từ cache cho tới khi indexer ghi dữ liệu mới. Top-k được tính
+        # một lần, các trang chỉ cắt từ danh sách đã cache
+        hits = query_cache.get_or_compute(
+            make_key(text_query, filters, n_results=top_k),
+            lambda: hybrid_search(text_query, collection, lexical_index, n_results=top_k,
+                                  candidates=max(DEFAULT_CANDIDATES, top_k), filters=filters,
+                                  facet_index=facet_index, embedding_function=default_ef)
         )
-        
+        if value_rows is not None:
+            hits = restrict_to_rows(hits, value_rows)
+
+        # Cursor của các trang đã xem; đổi truy vấn hoặc bộ lọc thì quay về trang đầu
+        page_key = cursor_key(query, filters, top_k)
+        if st.session_state.get("search_page_key") != page_key:
+            st.session_state["search_page_key"] = page_key
+            st.session_state["search_cursors"] = [None]
+        cursors = st.session_state["search_cursors"]
+        page = paginate(hits, page_key, DEFAULT_PAGE_SIZE, cursors[-1])
+
         # Hiển thị số lượng kết quả tìm thấy
-        st.write(f"Tìm thấy {len(results)} kết quả:")
-        print('results:', results)
+        if page["total"]:
+            st.write(f"Tìm thấy {page['total']} kết quả, đang xem {page['offset'] + 1}-"
+                     f"{page['offset'] + len(page['hits'])}:")
+        else:
+            st.write("Không tìm thấy kết quả nào")
+        cache_stats = default_ef.stats()
+        query_stats = query_cache.stats()
+        st.caption(f"Embedding cache: {cache_stats['hit_rate']:.0%} trúng ({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}) · "
+                   f"Cache truy vấn: {query_stats['hit_rate']:.0%} trúng ({query_stats['entries']} truy vấn)")
+        logger.debug("Kết quả cho %r (%s): %s", query, filters, [hit["id"] for hit in page["hits"]])
         # Hiển thị kết quả
-        for index, doc in enumerate(results['documents'][0]):
+        for hit in page["hits"]:
             # Lấy thông tin từ kết quả
-
-            metaInfo = results['metadatas'][0][index]
+            doc = hit["document"]
+            metaInfo = hit["metadata"]
 
             # Tạo link trỏ tới vị trí cụ thể trong Google Sheets
-            # Format: https://docs.google.com/spreadsheets/d/{file_id}/edit#gid={sheet_id}&range={col}{row}
+            # Format: https://docs.google.com/spreadsheets/d/{file_id}/edit#gid={sheet_id}&range={range}
             file_id = metaInfo.get("file_id", "")
             sheet_id = metaInfo.get("sheet_id", "")
             col = metaInfo.get("col", "")
             row = metaInfo.get("row", "")
-            link = f"https://docs.google.com/spreadsheets/d/{file_id}/edit#gid={sheet_id}&range={col}{row}"
+            # Document theo hàng/nhóm hàng trỏ tới cả vùng ô; index cũ chỉ có col/row
+            cell_range = metaInfo.get("range") or f"{col}{row}"
+            link = f"https://docs.google.com/spreadsheets/d/{file_id}/edit#gid={sheet_id}&range={cell_range}"
             
             # Hiển thị thông tin trong một container
             with st.container():
                 st.markdown(f"**Nội dung:** {doc}")
-                st.markdown(f"**File:** {file_id}")
-                st.markdown(f"**Sheet:** {sheet_id}")
-                st.markdown(f"**Vị trí:** Cột {col}, Hàng {row}")
+                st.markdown(f"**File:** {metaInfo.get('file_name') or file_id}")
+                st.markdown(f"**Sheet:** {metaInfo.get('tab_name') or sheet_id}")
+                st.markdown(f"**Vị trí:** {cell_range}")
                 st.markdown(f"[Mở trong Google Sheets]({link})")
                 st.markdown("---")  # Đường kẻ phân cách giữa các kết quả 
 
+        # Chuyển trang bằng cursor: trang trước bỏ cursor cuối, trang sau thêm next_cursor
+        previous_page, next_page = st.columns(2)
+        previous_page.button("Trang trước", disabled=len(cursors) <= 1, on_click=cursors.pop)
+        next_page.button("Trang sau", disabled=page["next_cursor"] is None,
+                         on_click=cursors.append, args=(page["next_cursor"],))
+
 with tab2:
     st.header("Index Google Sheets từ Google Drive")
     
@@ -97,6 +201,30 @@ with tab2:
             f.write(uploaded_file.getbuffer())
         st.success("File credentials đã được tải lên thành công!")
     
+    # Số spreadsheet được tải song song
+    index_workers = st.number_input("Số file tải song song:", min_value=1, max_value=32, value=4,
+                                    help="Tổng số request vẫn được giới hạn theo quota đọc mỗi phút của Sheets API")
+
+    # Cách chia mỗi tab thành documents (xem indexer.iter_sheet_units)
+    granularity_labels = {
+        "cell": "Theo từng ô",
+        "row": "Theo hàng (kèm tiêu đề cột)",
+        "row_window": "Theo nhóm hàng",
+    }
+    granularity = st.selectbox("Đơn vị document:", list(granularity_labels),
+                               format_func=granularity_labels.get,
+                               help="Đổi đơn vị document sẽ index lại toàn bộ các file ở lần chạy sau")
+    row_window = 5
+    if granularity == "row_window":
+        row_window = st.number_input("Số hàng mỗi document:", min_value=2, max_value=50, value=5)
+
+    save_snapshot = st.checkbox("Lưu snapshot giá trị thô", value=True,
+                                help="Cho phép đổi cách chia document và index lại (python indexer.py rebuild) "
+                                     "mà không cần tải lại từ Google Sheets")
+    stream_fetch = st.checkbox("Đọc tab lớn theo từng phần", value=False, disabled=save_snapshot,
+                               help="Tab lớn được đọc theo cửa sổ khoảng 2000 hàng, bộ nhớ không tăng theo số hàng. "
+                                    "Chỉ dùng được khi không lưu snapshot")
+    
     # Button để bắt đầu indexing
     if st.button("Bắt đầu index"):
         if not folder_id:
@@ -104,27 +232,65 @@ with tab2:
         elif temp_credentials_path is None:
             st.error("Vui lòng tải lên file credentials.json")
         else:
-            # Thực hiện indexing
-            with st.spinner("Đang tiến hành index..."):
-                result = index_folder(folder_id, temp_credentials_path)
+            from indexer import index_folder
+
+            # Thực hiện indexing, hiển thị tiến độ trực tiếp từ các stage của pipeline
+            progress_bar = st.progress(0.0, text="Đang tiến hành index...")
+            progress_text = st.empty()
+
+            def show_progress(event):
+                total = event["files_total"] + event["files_skipped"]
+                done = event["files_done"] + event["files_skipped"]
+                progress_bar.progress(done / total if total else 1.0, text=f"Đã xử lý {done}/{total} files")
+                stages = event["stages"]
+                progress_text.markdown(
+                    f"Tải: {stages['fetch']['files']} files ({stages['fetch']['files_per_sec']:.1f}/s) · "
+                    f"Cells: {stages['chunk']['cells']} ({stages['chunk']['cells_per_sec']:.0f}/s) · "
+                    f"Embed: {stages['embed']['chunks']} chunks ({stages['embed']['chunks_per_sec']:.0f}/s) · "
+                    f"Ghi: {stages['write']['chunks']} chunks ({stages['write']['chunks_per_sec']:.0f}/s)"
+                )
+
+            result = index_folder(folder_id, temp_credentials_path, workers=int(index_workers),
+                                  on_progress=show_progress, granularity=granularity,
+                                  row_window=int(row_window), snapshot=save_snapshot,
+                                  stream=stream_fetch and not save_snapshot)
+            
+            if result["success"]:
+                st.success(result["message"])
                 
-                if result["success"]:
-                    st.success(result["message"])
-                    
-                    # Hiển thị chi tiết
-                    details = result.get("details", {})
-                    st.write(f"Tổng số files: {details.get('total', 0)}")
-                    st.write(f"Files đã xử lý thành công: {details.get('successful', 0)}")
-                    st.write(f"Files bị lỗi: {details.get('failed', 0)}")
-                    
-                    # Hiển thị các lỗi nếu có
-                    errors = details.get("errors", [])
-                    if errors:
-                        st.subheader("Chi tiết lỗi:")
-                        for error in errors:
-                            st.error(f"File: {error.get('file_name')} - Lỗi: {error.get('error')}")
-                else:
-                    st.error(result["message"])
+                # Hiển thị chi tiết
+                details = result.get("details", {})
+                st.write(f"Tổng số files: {details.get('total', 0)}")
+                st.write(f"Files đã xử lý thành công: {details.get('successful', 0)}")
+                st.write(f"Files bị lỗi: {details.get('failed', 0)}")
+                st.write(f"Files không thay đổi (bỏ qua): {details.get('skipped', 0)}")
+                cache_stats = details.get("embedding_cache")
+                if cache_stats:
+                    st.write(f"Embedding cache: {cache_stats['hit_rate']:.0%} trúng "
+                             f"({cache_stats['hits']} trúng, {cache_stats['misses']} phải embed)")
+                if details.get("timings"):
+                    st.session_state["last_index_timings"] = details["timings"]
+                
+                # Hiển thị các lỗi nếu có
+                errors = details.get("errors", [])
+                if errors:
+                    st.subheader("Chi tiết lỗi:")
+                    for error in errors:
+                        st.error(f"File: {error.get('file_name')} - Lỗi: {error.get('error')}")
+            else:
+                st.error(result["message"])
+
+    # Thời gian theo stage của lần index gần nhất trong session
+    timings = st.session_state.get("last_index_timings")
+    if timings:
+        with st.expander("Thời gian theo stage (lần index gần nhất)", expanded=True):
+            wall = timings["wall_seconds"]
+            rows = ["| Stage | Thời gian (s) | Số lần | % thời gian chạy |", "|---|---:|---:|---:|"]
+            for stage, entry in sorted(timings["stages"].items(), key=lambda item: item[1]["seconds"], reverse=True):
+                share = entry["seconds"] / wall if wall else 0.0
+                rows.append(f"| {STAGE_LABELS.get(stage, stage)} | {entry['seconds']:.2f} | {entry['count']} | {share:.0%} |")
+            st.markdown("\n".join(rows))
+            st.caption(f"Tổng thời gian chạy: {wall:.2f}s. Các stage chạy chồng lên nhau nên tổng có thể vượt 100%.")
 
 with tab3:
     st.header("Sheet Creator Tool")
@@ -158,8 +324,8 @@ with tab3:
                 
                 # Initialize toolkit
                 try:
-                    print('temp_credentials_path:', temp_credentials_path)
-                    print('cat temp_credentials_path', open(temp_credentials_path).read())
+                    from sheet_creator_tool import GoogleSheetsToolkit
+
                     toolkit = GoogleSheetsToolkit(credentials_path=temp_credentials_path)
                     
                     if spreadsheet_option == "Kết nối với Spreadsheet hiện có":
@@ -177,7 +343,7 @@ with tab3:
                         else:
                             st.error("Vui lòng nhập tiêu đề cho Spreadsheet mới")
                 except Exception as e:
-                    print('error:', e)
+                    logger.exception("Lỗi khi kết nối Google Sheets")
                     st.error(f"Lỗi khi kết nối: {str(e)}")
             else:
                 st.error("Vui lòng tải lên file credentials.json")
@@ -194,66 +360,68 @@ with tab3:
         
         # Check if toolkit is connected
         if "toolkit" in st.session_state:
+            toolkit = st.session_state["toolkit"]
+            # Graph, tools và model được tạo một lần cho mỗi toolkit đã kết nối; lịch sử hội
+            # thoại nằm trong checkpointer của graph nên agent nhớ các lượt trước
+            session = st.session_state.get("agent_session")
+            if session is None or session.toolkit is not toolkit:
+                try:
+                    from sheet_creator_tool import AgentSession
+
+                    session = st.session_state["agent_session"] = AgentSession(toolkit)
+                    st.session_state.messages = []
+                except Exception as e:
+                    logger.exception("Lỗi khi khởi tạo ReAct agent")
+                    st.error(f"Lỗi khi khởi tạo agent: {str(e)}")
+                    session = None
+
             # Chat input area
             user_input = st.text_input("Nhập yêu cầu của bạn:", key="user_input")
-            
-            if st.button("Gửi", key="send_button"):
-                if user_input:
+            send_col, reset_col = st.columns([1, 4])
+            send = send_col.button("Gửi", key="send_button")
+            if reset_col.button("Cuộc hội thoại mới", key="reset_chat") and session is not None:
+                session.reset()
+                st.session_state.messages = []
+
+            # Hiển thị tin nhắn chat sử dụng st.chat_message
+            with chat_container:
+                for msg in st.session_state.messages:
+                    with st.chat_message(msg["role"]):
+                        st.write(msg["content"])
+
+                if send and user_input and session is not None:
                     # Add user message to chat history
                     st.session_state.messages.append({"role": "user", "content": user_input})
-                    
-                    with st.spinner("Đang xử lý yêu cầu..."):
+                    with st.chat_message("user"):
+                        st.write(user_input)
+
+                    with st.chat_message("assistant"):
+                        placeholder = st.empty()
+                        full_response = ""
                         try:
-                            # Get tools from toolkit
-                            tools = st.session_state["toolkit"].get_tools()
-                            
-                            # Initialize language model
-                            model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-                            
-                            # Create ReAct agent
-                            graph = create_react_agent(model, tools=tools)
-                            
-                            # Process request
-                            inputs = {"messages": [("user", user_input)]}
-                            full_response = ""
-                            
-                            # Collect stream results
-                            for s in graph.stream(inputs, stream_mode="values"):
-                                response_message = s["messages"][-1]
-                                if not isinstance(response_message, tuple):  # Only show assistant messages
-                                    current_response = response_message.content
-                                    full_response += current_response + "\n"
-                            
-                            # Add assistant response to chat history
-                            st.session_state.messages.append({"role": "assistant", "content": full_response.strip()})
-                            
+                            # Câu trả lời hiện ra từng token, từng lần gọi tool ngay khi agent tạo ra
+                            for event in session.stream(user_input):
+                                if event["type"] == "token":
+                                    full_response += event["content"]
+                                elif event["type"] == "tool_call":
+                                    full_response += f"\n\n_Đang gọi `{event['name']}`..._\n\n"
+                                elif event["type"] == "error":
+                                    full_response += f"\n\n**{event['content']}**\n\n"
+                                else:
+                                    full_response += f"_`{event['name']}` xong._\n\n"
+                                placeholder.markdown(full_response + "▌")
+                            full_response = full_response.strip()
+                            placeholder.markdown(full_response)
+                            st.session_state.messages.append({"role": "assistant", "content": full_response})
                         except Exception as e:
+                            logger.exception("Lỗi khi chạy ReAct agent")
+                            # Vẫn gửi các ô đã ghi trước khi lỗi; nếu gửi lỗi thì giữ lại cho lượt sau
+                            try:
+                                toolkit.flush()
+                            except Exception:
+                                logger.exception("Lỗi khi ghi dữ liệu vào Google Sheets")
                             error_message = f"Lỗi khi thực thi: {str(e)}"
+                            st.error(error_message)
                             st.session_state.messages.append({"role": "assistant", "content": error_message})
-            
-            # Hiển thị tin nhắn chat sử dụng st.chat_message
-            with chat_container:
-                # Tạo container với chiều cao cố định
-                chat_area = st.container()
-                
-                if st.session_state.messages:
-                    for msg in st.session_state.messages:
-                        if msg["role"] == "user":
-                            with st.chat_message("user"):
-                                st.write(msg["content"])
-                        else:
-                            with st.chat_message("assistant"):
-                                st.write(msg["content"])
-                
-                st.markdown('</div>', unsafe_allow_html=True)
         else:
             st.info("Vui lòng kết nối với Google Sheets trước khi sử dụng chat")
-
-# app = FastAPI()
-
-# @app.post("/index-file")
-# async def index_new_file(file_info: dict):
-#     result = handle_new_file(file_info)
-#     if not result["success"]:
-#         raise HTTPException(status_code=500, detail=result["message"])
-#     return result
\ No newline at end of file
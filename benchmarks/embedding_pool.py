@@ -0,0 +1,93 @@
+"""Đo thông lượng embed của EmbeddingPool theo số process
+
+Chạy từ thư mục gốc của repo:
+
+    python benchmarks/embedding_pool.py                          # model ONNX mặc định, 1/2/4/8 process
+    python benchmarks/embedding_pool.py --workers 1,4,16,32 --texts 20000 --output result.json
+
+Văn bản là các hàng sinh ngẫu nhiên như trong benchmark index. Mỗi cấu hình được đo sau
+khi pool đã khởi động (model đã nạp xong ở mọi process) và gửi các lô `--batch-size` văn
+bản với `workers` lô chạy song song, giống stage embed của IndexingPipeline. Cấu hình
+"inline" là embed ngay trong process này, như khi EMBED_WORKERS=0. Tăng tốc gần tuyến
+tính chỉ đạt được khi máy có đủ core trống cho số process.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def sample_texts(count: int, seed: int) -> List[str]:
+    from benchmarks.synthetic import VOCABULARY
+
+    rng = random.Random(seed)
+    return [
+        " | ".join(f"Cột {col}: " + " ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(2, 8)))
+                   for col in "ABCDEF")
+        for _ in range(count)
+    ]
+
+
+def measure(embed, texts: List[str], batch_size: int, concurrency: int) -> float:
+    """Số văn bản/giây khi gửi các lô với `concurrency` lô song song"""
+    batches = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for vectors in executor.map(embed, batches):
+            assert len(vectors)
+    return len(texts) / (time.perf_counter() - started)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4,8", help="Các số process cần đo, phân tách bằng dấu phẩy")
+    parser.add_argument("--texts", type=int, default=4000)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--embedding", default=os.getenv("EMBEDDING_FUNCTION", ""),
+                        help='Embedding function dạng "module:tên", mặc định model ONNX của Chroma')
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    from embedding_pool import EmbeddingPool
+    from resources import load_embedding_function
+
+    texts = sample_texts(args.texts, args.seed)
+    inline = load_embedding_function(args.embedding)
+    inline(texts[:8])
+    results: Dict[str, Dict] = {"inline": {"texts_per_sec": round(measure(inline, texts, args.batch_size, 1), 1)}}
+    print(f"inline: {results['inline']['texts_per_sec']} văn bản/giây", flush=True)
+
+    base = None
+    for workers in [int(value) for value in args.workers.split(",")]:
+        pool = EmbeddingPool(args.embedding, workers, min_batch=args.batch_size)
+        try:
+            # Khởi động đủ process (mỗi process nạp model một lần) trước khi đo
+            measure(pool, texts[:workers * args.batch_size], args.batch_size, workers)
+            rate = measure(pool, texts, args.batch_size, workers)
+        finally:
+            pool.close()
+        base = base or rate / workers
+        results[str(workers)] = {
+            "texts_per_sec": round(rate, 1),
+            "speedup": round(rate / results["inline"]["texts_per_sec"], 2),
+            "scaling_efficiency": round(rate / (base * workers), 2),
+        }
+        print(f"{workers} process: {results[str(workers)]}", flush=True)
+
+    print(json.dumps({"cpus": os.cpu_count(), "results": results}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "cpus": os.cpu_count(), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
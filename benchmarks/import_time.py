@@ -0,0 +1,93 @@
+"""Đo thời gian import các module bằng `python -X importtime` và so với ngân sách
+
+Chạy từ thư mục gốc của repo:
+
+    python benchmarks/import_time.py            # so với benchmarks/import_budget.json
+    python benchmarks/import_time.py --json     # in kết quả dạng JSON
+
+Trả về mã lỗi 1 nếu một module vượt ngân sách thời gian hoặc kéo theo module bị cấm
+(ví dụ import app.py mà nạp cả langgraph).
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "import_budget.json")
+
+
+def measure_import(module: str) -> Tuple[float, List[str]]:
+    """Import module trong process mới, trả về (thời gian tích lũy tính bằng ms, các module đã nạp)"""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=REPO_ROOT, capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Không import được {module}:\n{completed.stderr[-2000:]}")
+
+    cumulative_us = None
+    imported = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        name = name.rstrip()
+        package = name.strip()
+        imported.append(package)
+        # Module gốc nằm ở mức thụt lề đầu tiên
+        if package == module and len(name) - len(name.lstrip()) <= 1:
+            cumulative_us = int(cumulative.strip())
+    if cumulative_us is None:
+        raise RuntimeError(f"Không tìm thấy {module} trong output của -X importtime")
+    return cumulative_us / 1000.0, imported
+
+
+def check(budget: Dict, repeat: int = 3) -> Dict:
+    results = {}
+    for module, limits in budget["modules"].items():
+        # Lấy lần nhanh nhất để giảm nhiễu
+        runs = [measure_import(module) for _ in range(repeat)]
+        elapsed = min(ms for ms, _ in runs)
+        imported = set(runs[0][1])
+        forbidden = sorted(
+            name for name in imported
+            for banned in limits.get("forbidden", [])
+            if name == banned or name.startswith(banned + ".")
+        )
+        results[module] = {
+            "ms": round(elapsed, 1),
+            "max_ms": limits["max_ms"],
+            "forbidden_imported": forbidden,
+            "ok": elapsed <= limits["max_ms"] and not forbidden,
+        }
+    return results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", default=BUDGET_PATH)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="In kết quả dạng JSON")
+    args = parser.parse_args()
+
+    with open(args.budget) as f:
+        budget = json.load(f)
+    results = check(budget, repeat=args.repeat)
+
+    if args.json:
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    else:
+        for module, result in results.items():
+            status = "OK" if result["ok"] else "VƯỢT"
+            line = f"{status:5} {module:24} {result['ms']:8.1f} ms (ngân sách {result['max_ms']} ms)"
+            if result["forbidden_imported"]:
+                line += f" - nạp module bị cấm: {', '.join(result['forbidden_imported'][:5])}"
+            print(line)
+    return 0 if all(result["ok"] for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
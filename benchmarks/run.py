@@ -0,0 +1,249 @@
+"""Benchmark index và truy vấn trên dữ liệu giả lập, không cần credentials Google
+
+Chạy từ thư mục gốc của repo:
+
+    python benchmarks/run.py                          # in kết quả, so với benchmarks/baseline.json
+    python benchmarks/run.py --output result.json     # lưu kết quả dạng JSON
+    python benchmarks/run.py --save-baseline          # ghi kết quả làm baseline mới
+    python benchmarks/run.py --files 50 --rows 1000 --granularity cell
+
+Các kịch bản:
+    index    index_folder lần đầu trên folder giả lập (cells/s, chunks/s)
+    reindex  index lại sau khi sửa một phần file (chỉ các ô đổi được embed), trung vị nhiều lượt
+    query    độ trễ collection.query và hybrid_search (p50/p95/p99)
+    memory   peak RSS của process sau các kịch bản trên
+    rebuild  chia lại toàn bộ từ snapshot với granularity khác (không gọi mạng); chạy sau
+             cùng để không ảnh hưởng tới memory và độ trễ truy vấn
+
+Mặc định dùng embedding giả lập theo hash (benchmarks.synthetic.HashEmbeddingFunction) để
+đo phần indexer/Chroma; thêm --real-embeddings để đo cả model ONNX. Mọi dữ liệu được ghi
+vào một thư mục tạm, không đụng tới index thật. Trả về mã lỗi 1 nếu có chỉ số kém hơn
+baseline quá --tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+HASH_EMBEDDING_FUNCTION = "benchmarks.synthetic:HashEmbeddingFunction"
+# reindex chỉ mất vài chục ms nên đo nhiều lượt và lấy trung vị cho đỡ nhiễu
+REINDEX_ROUNDS = 5
+WARMUP_QUERIES = 5
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Percentile theo nearest-rank"""
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    rank = max(1, min(len(ordered), int(round(q / 100.0 * len(ordered) + 0.5))))
+    return ordered[rank - 1]
+
+
+def latency_summary(samples: List[float]) -> Dict:
+    """p50/p95/p99 (ms) của các mẫu thời gian tính bằng giây"""
+    return {f"p{q}_ms": round(percentile(samples, q) * 1000, 3) for q in (50, 95, 99)}
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux trả về KB, macOS trả về byte
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def run(args) -> Dict:
+    from benchmarks.synthetic import folder_stats, populate_client, sample_queries, touch_files
+    from fake_gspread import FakeClient
+    from indexer import index_folder, rebuild_from_snapshots
+    from resources import get_collection, get_lexical_index
+    from search import hybrid_search
+
+    folder_id = "bench-folder"
+    client = FakeClient(latency=args.latency, seed=args.seed)
+    file_ids = populate_client(client, folder_id, files=args.files, tabs=args.tabs, rows=args.rows,
+                               cols=args.cols, cell_length=args.cell_length,
+                               empty_ratio=args.empty_ratio, seed=args.seed)
+    stats = folder_stats(client, folder_id)
+    metrics: Dict = {}
+
+    # Index lần đầu
+    started = time.perf_counter()
+    result = index_folder(folder_id, None, client=client, workers=args.workers,
+                          reads_per_minute=1e9, granularity=args.granularity, snapshot=True)
+    elapsed = time.perf_counter() - started
+    if not result["success"]:
+        raise RuntimeError(result["message"])
+    details = result["details"]
+    metrics["index"] = {
+        "seconds": round(elapsed, 3),
+        "cells": stats["cells"],
+        "chunks": details["documents"],
+        "cells_per_sec": round(stats["cells"] / elapsed, 1),
+        "chunks_per_sec": round(details["documents"] / elapsed, 1),
+    }
+    # Thời gian cộng dồn của từng stage, để biết chỗ tốn thời gian khi throughput giảm
+    metrics["index_stages"] = {
+        f"{stage}_seconds": round(entry["seconds"], 3)
+        for stage, entry in details["timings"]["stages"].items()
+    }
+
+    # Index lại sau khi sửa 10% số file, lặp REINDEX_ROUNDS lượt với nội dung sửa khác nhau
+    touched = file_ids[:max(1, len(file_ids) // 10)]
+    reindex_times = []
+    for round_ in range(REINDEX_ROUNDS):
+        touch_files(client, touched, seed=args.seed + 1 + round_)
+        started = time.perf_counter()
+        result = index_folder(folder_id, None, client=client, workers=args.workers,
+                              reads_per_minute=1e9, granularity=args.granularity, snapshot=True)
+        reindex_times.append(time.perf_counter() - started)
+    metrics["reindex"] = {
+        "seconds": round(percentile(reindex_times, 50), 3),
+        "files_changed": len(touched),
+        "chunks": result["details"]["documents"],
+    }
+
+    # Độ trễ truy vấn, mỗi lần một truy vấn như khi người dùng tìm kiếm
+    collection = get_collection()
+    lexical_index = get_lexical_index()
+    queries = sample_queries(args.queries, seed=args.seed + 2)
+    n_results = min(10, collection.count())
+    # Vài truy vấn khởi động (không tính giờ): lần đầu sau khi ghi phải nạp lại HNSW index
+    for query in queries[:WARMUP_QUERIES]:
+        collection.query(query_texts=[query], n_results=n_results)
+        hybrid_search(query, collection, lexical_index, n_results=10)
+    query_times, hybrid_times = [], []
+    for query in queries:
+        started = time.perf_counter()
+        collection.query(query_texts=[query], n_results=n_results)
+        query_times.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        hybrid_search(query, collection, lexical_index, n_results=10)
+        hybrid_times.append(time.perf_counter() - started)
+    metrics["query"] = {"queries": len(queries), **latency_summary(query_times)}
+    metrics["hybrid_search"] = {"queries": len(queries), **latency_summary(hybrid_times)}
+
+    # Đo trước rebuild: rebuild theo ô tạo nhiều chunk hơn hẳn và làm tăng peak RSS
+    metrics["memory"] = {"peak_rss_mb": peak_rss_mb()}
+
+    # Rebuild toàn bộ từ snapshot với cách chia khác, không được gọi tới client
+    requests_before = client.requests
+    rebuild_granularity = "cell" if args.granularity != "cell" else "row"
+    started = time.perf_counter()
+    result = rebuild_from_snapshots(folder_id, granularity=rebuild_granularity)
+    elapsed = time.perf_counter() - started
+    if not result["success"]:
+        raise RuntimeError(result["message"])
+    metrics["rebuild"] = {
+        "seconds": round(elapsed, 3),
+        "granularity": rebuild_granularity,
+        "chunks": result["details"]["documents"],
+        "chunks_per_sec": round(result["details"]["documents"] / elapsed, 1),
+        "network_requests": client.requests - requests_before,
+    }
+    return metrics
+
+
+def higher_is_better(name: str) -> Optional[bool]:
+    """Hướng tốt của một chỉ số; None nếu chỉ để tham khảo (số ô, số chunk...)"""
+    if name.endswith("_per_sec"):
+        return True
+    if name.endswith("_ms") or name.endswith("_mb") or name == "seconds":
+        return False
+    return None
+
+
+def compare(results: Dict, baseline: Dict, tolerance: float) -> List[Dict]:
+    """So sánh với baseline, trả về danh sách chỉ số kèm cờ regression"""
+    rows = []
+    for scenario, values in results["metrics"].items():
+        for name, value in values.items():
+            better = higher_is_better(name)
+            base = baseline["metrics"].get(scenario, {}).get(name)
+            if better is None or not base:
+                continue
+            change = (value - base) / base
+            regression = change < -tolerance if better else change > tolerance
+            rows.append({"metric": f"{scenario}.{name}", "baseline": base, "value": value,
+                         "change": change, "regression": regression})
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=10)
+    parser.add_argument("--tabs", type=int, default=3)
+    parser.add_argument("--rows", type=int, default=200)
+    parser.add_argument("--cols", type=int, default=8)
+    parser.add_argument("--cell-length", default="lognormal:1.5,0.8",
+                        help='Số từ mỗi ô: "fixed:N", "uniform:A,B" hoặc "lognormal:MU,SIGMA"')
+    parser.add_argument("--empty-ratio", type=float, default=0.1)
+    parser.add_argument("--granularity", default="row", choices=["cell", "row", "row_window"])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.0, help="Độ trễ giả lập (giây) cho mỗi request")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--real-embeddings", action="store_true", help="Dùng model embedding thật của Chroma")
+    parser.add_argument("--workdir", help="Thư mục chứa index tạm (mặc định tạo thư mục mới)")
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true", help="Ghi kết quả làm baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Mức kém hơn baseline (tỉ lệ) được chấp nhận")
+    args = parser.parse_args()
+
+    # Phải đặt trước khi import resources
+    if not args.real_embeddings:
+        os.environ["EMBEDDING_FUNCTION"] = HASH_EMBEDDING_FUNCTION
+    sys.path.insert(0, REPO_ROOT)
+    args.output = os.path.abspath(args.output) if args.output else None
+    args.baseline = os.path.abspath(args.baseline)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="spec-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    config = {key: value for key, value in vars(args).items()
+              if key not in ("workdir", "output", "baseline", "save_baseline", "tolerance")}
+    results = {
+        "config": config,
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "metrics": run(args),
+    }
+
+    print(json.dumps(results["metrics"], indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+            f.write("\n")
+        print(f"Đã lưu baseline vào {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print("Cấu hình khác baseline, bỏ qua so sánh")
+        return 0
+
+    rows = compare(results, baseline, args.tolerance)
+    print()
+    for row in rows:
+        status = "KÉM" if row["regression"] else "OK"
+        print(f"{status:4} {row['metric']:30} {row['baseline']:>12} -> {row['value']:>12} ({row['change']:+.1%})")
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+"""Đo bộ nhớ đỉnh khi tải và chia một tab lớn, có và không đọc theo cửa sổ hàng
+
+Chạy từ thư mục gốc của repo:
+
+    python benchmarks/streaming_fetch.py                               # 5k/20k/80k hàng x 12 cột
+    python benchmarks/streaming_fetch.py --rows 50000,200000,800000 --output result.json
+
+Mỗi cấu hình tạo một spreadsheet một tab trong FakeClient, rồi chạy fetch_spreadsheet và
+iter_spreadsheet_ops như stage fetch và chunk của indexer (không embed, không ghi). Bộ nhớ
+đỉnh được đo bằng tracemalloc từ sau khi dữ liệu giả lập đã được tạo, nên chỉ gồm response
+của API, các hàng đang xử lý và document đang chia. Trạng thái manifest (một hash cho mỗi
+document) không được giữ lại vì nó tăng theo số document ở cả hai chế độ.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from typing import Dict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class _Discard(dict):
+    """`current` của iter_spreadsheet_ops không lưu lại gì"""
+
+    def __setitem__(self, key, value) -> None:
+        pass
+
+
+def measure(rows: int, cols: int, stream: bool, granularity: str, seed: int) -> Dict:
+    from benchmarks.synthetic import generate_tab, parse_distribution
+    from fake_gspread import FakeClient
+    from indexer import fetch_spreadsheet, iter_spreadsheet_ops, make_text_splitter
+
+    client = FakeClient()
+    values = generate_tab(random.Random(seed), rows, cols, parse_distribution("fixed:3"), 0.1, id_prefix="B")
+    client.add_spreadsheet("bench", "Bench", {"Export": values})
+    text_splitter = make_text_splitter()
+    file_info = {"id": "bench", "name": "Bench"}
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    sheets_values = fetch_spreadsheet(file_info, client, stream=stream)
+    documents = 0
+    for op in iter_spreadsheet_ops(file_info, sheets_values, text_splitter, {}, _Discard(), granularity):
+        documents += op[0] == "add"
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"peak_mb": round(peak / 2 ** 20, 1), "seconds": round(elapsed, 2), "documents": documents,
+            "requests": client.requests}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", default="5000,20000,80000", help="Các số hàng cần đo, phân tách bằng dấu phẩy")
+    parser.add_argument("--cols", type=int, default=12)
+    parser.add_argument("--granularity", default="row")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file")
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    results: Dict[str, Dict] = {}
+    for rows in [int(value) for value in args.rows.split(",")]:
+        results[str(rows)] = {
+            mode: measure(rows, args.cols, mode == "stream", args.granularity, args.seed)
+            for mode in ("full", "stream")
+        }
+        print(f"{rows} hàng: {results[str(rows)]}", flush=True)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": vars(args), "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""Sinh dữ liệu spreadsheet giả lập cho benchmark
+
+Dữ liệu được nạp vào fake_gspread.FakeClient nên indexer chạy y như với Google Sheets
+thật, chỉ khác là không cần credentials và không có độ trễ mạng (trừ khi cấu hình).
+"""
+import hashlib
+import random
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from fake_gspread import FakeClient
+
+# Từ vựng để sinh nội dung ô, gần với nội dung spec thực tế
+VOCABULARY = (
+    "màn hình tìm kiếm sản phẩm người dùng đăng nhập đăng ký mật khẩu email số điện thoại "
+    "địa chỉ giỏ hàng thanh toán đơn hàng hóa đơn giá số lượng trạng thái ngày tạo cập nhật "
+    "xóa thêm mới chỉnh sửa hiển thị danh sách chi tiết nút bấm lỗi thông báo xác nhận hủy "
+    "bắt buộc tối đa ký tự định dạng kiểm tra quyền admin báo cáo xuất file import api "
+    "request response timeout phân trang sắp xếp lọc mặc định"
+).split()
+
+
+def parse_distribution(spec: str) -> Callable[[random.Random], int]:
+    """Phân phối độ dài ô (số từ): "fixed:N", "uniform:A,B" hoặc "lognormal:MU,SIGMA" """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed" and len(values) == 1:
+        return lambda rng: max(1, int(values[0]))
+    if kind == "uniform" and len(values) == 2:
+        return lambda rng: rng.randint(int(values[0]), int(values[1]))
+    if kind == "lognormal" and len(values) == 2:
+        return lambda rng: max(1, int(rng.lognormvariate(values[0], values[1])))
+    raise ValueError(f"Phân phối không hợp lệ: {spec}")
+
+
+def generate_tab(rng: random.Random, rows: int, cols: int, cell_words: Callable[[random.Random], int],
+                 empty_ratio: float = 0.1, id_prefix: str = "SCR") -> List[List[str]]:
+    """Sinh một tab: hàng tiêu đề rồi `rows` hàng dữ liệu, cột đầu là mã định danh"""
+    header = ["Mã"] + [f"{rng.choice(VOCABULARY).capitalize()} {col}" for col in range(1, cols)]
+    values = [header]
+    for row in range(rows):
+        values.append([f"{id_prefix}-{row:05d}"] + [
+            "" if rng.random() < empty_ratio
+            else " ".join(rng.choice(VOCABULARY) for _ in range(cell_words(rng)))
+            for _ in range(1, cols)
+        ])
+    return values
+
+
+def populate_client(client: FakeClient, folder_id: str = "bench-folder", files: int = 20, tabs: int = 3,
+                    rows: int = 200, cols: int = 8, cell_length: str = "lognormal:1.5,0.8",
+                    empty_ratio: float = 0.1, seed: int = 0) -> List[str]:
+    """Thêm `files` spreadsheet vào client, trả về danh sách file id. Cùng seed sinh cùng dữ liệu"""
+    rng = random.Random(seed)
+    cell_words = parse_distribution(cell_length)
+    file_ids = []
+    for index in range(files):
+        file_id = f"bench-{seed}-{index:04d}"
+        sheets = {
+            f"Tab {tab}": generate_tab(rng, rows, cols, cell_words, empty_ratio, id_prefix=f"F{index}T{tab}")
+            for tab in range(tabs)
+        }
+        client.add_spreadsheet(file_id, f"Spec {index}", sheets, folder_id=folder_id,
+                               modified_time="2024-01-01T00:00:00.000Z")
+        file_ids.append(file_id)
+    return file_ids
+
+
+def touch_files(client: FakeClient, file_ids: List[str], cells_per_file: int = 5, seed: int = 1) -> None:
+    """Sửa một số ô và đổi modifiedTime của các file, giả lập người dùng chỉnh spec"""
+    rng = random.Random(seed)
+    for file_id in file_ids:
+        for _ in range(cells_per_file):
+            sheet = rng.choice(client.spreadsheets[file_id]._worksheets)
+            row = rng.choice(sheet.values[1:]) if len(sheet.values) > 1 else sheet.values[0]
+            row[rng.randrange(len(row))] = " ".join(rng.choice(VOCABULARY) for _ in range(4))
+        # Phút lấy theo seed để các lượt sửa liên tiếp luôn có modifiedTime khác nhau
+        client.touch_spreadsheet(file_id, f"2024-01-02T00:{seed % 60:02d}:{rng.randrange(60):02d}.000Z")
+
+
+def sample_queries(count: int = 200, seed: int = 2) -> List[str]:
+    """Truy vấn ngẫu nhiên: phần lớn là cụm từ, một phần là mã định danh"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        if rng.random() < 0.2:
+            queries.append(f"F{rng.randrange(10)}T0-{rng.randrange(100):05d}")
+        else:
+            queries.append(" ".join(rng.choice(VOCABULARY) for _ in range(rng.randint(2, 5))))
+    return queries
+
+
+class HashEmbeddingFunction:
+    """Embedding giả lập xác định theo hash nội dung, cùng số chiều với all-MiniLM-L6-v2
+
+    Dùng để đo phần indexer/Chroma mà không phụ thuộc tốc độ (và việc tải) model ONNX.
+    Chọn bằng EMBEDDING_FUNCTION=benchmarks.synthetic:HashEmbeddingFunction.
+    """
+
+    MODEL_NAME = "hash-384"
+    DIMENSIONS = 384
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "little")
+            vector = np.random.default_rng(seed).standard_normal(self.DIMENSIONS)
+            vectors.append((vector / np.linalg.norm(vector)).tolist())
+        return vectors
+
+
+def folder_stats(client: FakeClient, folder_id: str) -> Dict:
+    """Số file, tab và ô không rỗng của một folder giả lập"""
+    files = [info["id"] for info in client.files.values() if info["folder_id"] == folder_id]
+    sheets = [sheet for file_id in files for sheet in client.spreadsheets[file_id]._worksheets]
+    return {
+        "files": len(files),
+        "tabs": len(sheets),
+        "cells": sum(1 for sheet in sheets for row in sheet.values for value in row if value),
+    }
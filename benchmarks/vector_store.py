@@ -0,0 +1,182 @@
+"""So sánh recall@10, độ trễ và bộ nhớ của các backend vector với Chroma
+
+Chạy từ thư mục gốc của repo:
+
+    python benchmarks/vector_store.py                      # 20000 vector 384 chiều, 200 truy vấn
+    python benchmarks/vector_store.py --vectors 100000 --output result.json
+
+Dữ liệu là các vector ngẫu nhiên gom cụm (gần với embedding thật hơn vector đều), truy vấn
+là vector có sẵn cộng nhiễu. Kết quả đúng được tính bằng brute force float32. Mỗi backend
+được build trong một process, rồi được mở lại và truy vấn trong một process mới để đo
+thời gian mở nguội và lượng RSS tăng thêm (chỉ phần của index, không tính dữ liệu test).
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (tên, cấu hình CompactVectorStore); "chroma" là baseline
+BACKENDS = {
+    "chroma": None,
+    "compact-float16": {"dtype": "float16", "rerank": False},
+    "compact-int8": {"dtype": "int8", "rerank": False},
+    "compact-int8-rerank": {"dtype": "int8", "rerank": True},
+}
+
+
+def generate(path: str, vectors: int, queries: int, dim: int, clusters: int, seed: int) -> None:
+    """Sinh dữ liệu, truy vấn và kết quả đúng (top-10 theo cosine) vào `path`"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)).astype(np.float32)
+    data = centers[rng.integers(0, clusters, size=vectors)] + 0.6 * rng.normal(size=(vectors, dim)).astype(np.float32)
+    data /= np.linalg.norm(data, axis=1, keepdims=True)
+    picked = data[rng.integers(0, vectors, size=queries)]
+    query = picked + 0.3 * rng.normal(size=picked.shape).astype(np.float32) / np.sqrt(dim)
+    query /= np.linalg.norm(query, axis=1, keepdims=True)
+    truth = np.argsort(-(query @ data.T), axis=1)[:, :10]
+    np.save(os.path.join(path, "data.npy"), data)
+    np.save(os.path.join(path, "queries.npy"), query)
+    np.save(os.path.join(path, "truth.npy"), truth)
+
+
+def open_store(backend: str, path: str):
+    if BACKENDS[backend] is None:
+        import chromadb
+
+        client = chromadb.PersistentClient(path=os.path.join(path, backend))
+        # Không gắn embedding function: benchmark chỉ dùng embedding có sẵn
+        return client.get_or_create_collection(name="bench", embedding_function=None)
+    from vector_store import CompactVectorStore
+
+    return CompactVectorStore(os.path.join(path, backend), **BACKENDS[backend])
+
+
+def rss_mb() -> float:
+    """RSS hiện tại (MB) đọc từ /proc, fallback về peak RSS"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def build(backend: str, path: str, batch_size: int) -> Dict:
+    data = np.load(os.path.join(path, "data.npy"))
+    store = open_store(backend, path)
+    started = time.perf_counter()
+    for start in range(0, len(data), batch_size):
+        ids = [f"v{index}" for index in range(start, min(start + batch_size, len(data)))]
+        store.upsert(ids=ids, documents=ids, metadatas=[{"n": index} for index in range(start, start + len(ids))],
+                     embeddings=data[start:start + len(ids)].tolist())
+    return {"build_seconds": round(time.perf_counter() - started, 3)}
+
+
+def query(backend: str, path: str) -> Dict:
+    queries = np.load(os.path.join(path, "queries.npy")).tolist()
+    before = rss_mb()
+    started = time.perf_counter()
+    store = open_store(backend, path)
+    # Truy vấn đầu tiên gồm cả việc nạp index (Chroma đọc HNSW vào RAM ở lần dùng đầu)
+    store.query(query_embeddings=queries[:1], n_results=10)
+    cold_open = time.perf_counter() - started
+    latencies, found = [], []
+    for vector in queries:
+        started = time.perf_counter()
+        result = store.query(query_embeddings=[vector], n_results=10)
+        latencies.append(time.perf_counter() - started)
+        found.append([int(doc_id[1:]) for doc_id in result["ids"][0]])
+    latencies.sort()
+    return {
+        "cold_open_seconds": round(cold_open, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+        "rss_delta_mb": round(rss_mb() - before, 1),
+        "found": found,
+    }
+
+
+def disk_mb(path: str) -> float:
+    total = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+    return round(total / (1024 * 1024), 1)
+
+
+def recall(found: List[List[int]], expected: np.ndarray) -> float:
+    hits = sum(len(set(row) & set(truth.tolist())) for row, truth in zip(found, expected))
+    return round(hits / expected.size, 4)
+
+
+def child(args) -> None:
+    sys.path.insert(0, REPO_ROOT)
+    result = build(args.backend, args.workdir, args.batch_size) if args.mode == "build" \
+        else query(args.backend, args.workdir)
+    print(json.dumps(result))
+
+
+def run_child(mode: str, backend: str, args) -> Dict:
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", mode, "--backend", backend,
+         "--workdir", args.workdir, "--batch-size", str(args.batch_size)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="Danh sách backend, phân tách bằng dấu phẩy")
+    parser.add_argument("--workdir", help="Thư mục chứa dữ liệu và index tạm (mặc định tạo thư mục mới)")
+    parser.add_argument("--output", help="Ghi kết quả JSON vào file")
+    parser.add_argument("--child", choices=["build", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        args.mode = args.child
+        child(args)
+        return 0
+
+    args.workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="spec-vector-bench-"))
+    os.makedirs(args.workdir, exist_ok=True)
+    generate(args.workdir, args.vectors, args.queries, args.dim, args.clusters, args.seed)
+    truth = np.load(os.path.join(args.workdir, "truth.npy"))
+
+    results, found = {}, {}
+    for backend in args.backends.split(","):
+        metrics = run_child("build", backend, args)
+        metrics.update(run_child("query", backend, args))
+        found[backend] = metrics.pop("found")
+        metrics["recall_at_10"] = recall(found[backend], truth)
+        metrics["disk_mb"] = disk_mb(os.path.join(args.workdir, backend))
+        results[backend] = metrics
+    if "chroma" in found:
+        # Mức trùng với kết quả của Chroma, baseline hiện tại của app
+        chroma = np.array(found["chroma"])
+        for backend in results:
+            results[backend]["overlap_with_chroma"] = recall(found[backend], chroma)
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"config": {key: value for key, value in vars(args).items()
+                                  if key not in ("child", "backend", "mode", "output", "workdir")},
+                       "metrics": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
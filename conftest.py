@@ -0,0 +1,24 @@
+"""Fixture dùng chung cho các test: index tạm trong thư mục riêng, embedding giả lập theo hash"""
+import os
+
+# Phải đặt trước khi import resources: test không tải model ONNX của Chroma
+os.environ.setdefault("EMBEDDING_FUNCTION", "benchmarks.synthetic:HashEmbeddingFunction")
+
+import pytest
+
+
+def _clear_resources() -> None:
+    import resources
+
+    for value in vars(resources).values():
+        if callable(getattr(value, "cache_clear", None)):
+            value.cache_clear()
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """Chạy test trong thư mục tạm: chroma_db, manifest, lexical/facet/value index đều mới"""
+    monkeypatch.chdir(tmp_path)
+    _clear_resources()
+    yield tmp_path
+    _clear_resources()
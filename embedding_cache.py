@@ -0,0 +1,146 @@
+import hashlib
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from typing import Dict, List, Optional
+
+# Cache nằm cạnh thư mục ./chroma_db, dùng chung giữa indexer và app
+EMBEDDING_CACHE_PATH = "./embedding_cache.sqlite3"
+
+# Số embedding tối đa được giữ lại, vượt quá thì xóa các entry lâu không dùng nhất
+DEFAULT_MAX_ENTRIES = 500_000
+
+
+def normalize_text(text: str) -> str:
+    """Chuẩn hóa nội dung chunk trước khi tính khóa cache (NFC, gộp khoảng trắng)"""
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+def cache_key(text: str, model_id: str) -> str:
+    return hashlib.sha256(f"{model_id}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Cache embedding trên đĩa theo hash nội dung, có giới hạn kích thước và loại bỏ theo LRU"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+        """)
+        self._conn.commit()
+        self._clock = self._conn.execute("SELECT COALESCE(MAX(last_used), 0) FROM embeddings").fetchone()[0]
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def _tick(self) -> int:
+        # Bộ đếm tăng dần thay cho timestamp để thứ tự LRU không phụ thuộc đồng hồ
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Lấy các embedding có trong cache và đánh dấu chúng vừa được dùng"""
+        found: Dict[str, List[float]] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock, self._conn:
+            # Giới hạn số tham số của một câu SQL
+            for start in range(0, len(unique_keys), 500):
+                batch = unique_keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+            if found:
+                tick = self._tick()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(tick, key) for key in found]
+                )
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Lưu embedding mới rồi loại bỏ các entry cũ nếu vượt quá max_entries"""
+        if not items:
+            return
+        with self._lock, self._conn:
+            tick = self._tick()
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), tick) for key, vector in items.items()]
+            )
+            self._size += self._conn.total_changes - before
+            if self._size > self.max_entries:
+                # Xóa dư ra 10% để không phải evict ở mỗi lần ghi
+                excess = self._size - int(self.max_entries * 0.9)
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+                )
+                self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class CachedEmbeddingFunction:
+    """Embedding function cho Chroma, tra cache trước khi gọi model
+
+    Các chunk trùng nội dung (kể cả trong cùng một lô) chỉ được embed một lần.
+    """
+
+    def __init__(self, embedding_function, cache: Optional[EmbeddingCache] = None, model_id: Optional[str] = None):
+        self.embedding_function = embedding_function
+        self.cache = cache if cache is not None else EmbeddingCache()
+        self.model_id = model_id or getattr(embedding_function, "MODEL_NAME", type(embedding_function).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        keys = [cache_key(text, self.model_id) for text in texts]
+        found = self.cache.get_many(keys)
+
+        # Embed mỗi nội dung còn thiếu đúng một lần
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = normalize_text(text)
+        if missing:
+            vectors = self.embedding_function(list(missing.values()))
+            # Vector có thể là list hoặc mảng numpy (EmbeddingPool); tolist() chuyển cả mảng một lần
+            computed = {
+                key: vector.tolist() if hasattr(vector, "tolist") else [float(x) for x in vector]
+                for key, vector in zip(missing, vectors)
+            }
+            self.cache.put_many(computed)
+            found.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [found[key] for key in keys]
+
+    def stats(self) -> Dict:
+        """Số lần trúng/trượt cache kể từ khi khởi tạo"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.cache),
+            }
@@ -0,0 +1,129 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+from typing import List, Optional
+
+import numpy as np
+
+from resources import load_embedding_function
+
+# Mỗi process nhận lô ít nhất chừng này văn bản, chia nhỏ hơn thì chi phí IPC lấn át
+MIN_WORKER_BATCH = 64
+
+# Biến môi trường giới hạn số thread của onnxruntime (bản build OpenMP) và tokenizers (Rayon);
+# được đặt trong process worker trước khi model và các thư viện này được import
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "RAYON_NUM_THREADS")
+
+# Model (và tokenizer) của process worker, nạp một lần trong initializer
+_worker_function = None
+
+
+def _limit_onnx_threads(function, threads: int) -> None:
+    """Tạo lại session ONNX của model mặc định của Chroma với `threads` thread intra-op
+
+    Bản build mặc định của onnxruntime không đọc OMP_NUM_THREADS, nên số thread phải đặt qua
+    SessionOptions. Model được nạp qua các thuộc tính public của ONNXMiniLM_L6_V2; nếu Chroma
+    đổi cách nạp model thì báo lỗi ngay thay vì để các worker âm thầm tranh core.
+    """
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    if not isinstance(function, ONNXMiniLM_L6_V2):
+        # Embedding function khác tự quản lý thread, chỉ chịu giới hạn của THREAD_ENV_VARS
+        return
+    model_path = os.path.join(function.DOWNLOAD_PATH, function.EXTRACTED_FOLDER_NAME, "model.onnx")
+    if not isinstance(function.model, function.ort.InferenceSession) or not os.path.exists(model_path):
+        raise RuntimeError(f"Không giới hạn được số thread ONNX: không thấy session của {model_path}")
+    options = function.ort.SessionOptions()
+    options.intra_op_num_threads = threads
+    options.inter_op_num_threads = 1
+    function.model = function.ort.InferenceSession(model_path, options, providers=function.model.get_providers())
+
+
+def _init_worker(spec: str, threads: int) -> None:
+    global _worker_function
+    # Process spawn chưa import onnxruntime/tokenizers: chúng đọc các biến này khi được nạp
+    for name in THREAD_ENV_VARS:
+        os.environ[name] = str(threads)
+    _worker_function = load_embedding_function(spec)
+    # Embed thử một lần để model được tải và nạp ngay khi pool khởi động
+    _worker_function(["khởi động"])
+    _limit_onnx_threads(_worker_function, threads)
+
+
+def _dimension() -> int:
+    return len(_worker_function(["khởi động"])[0])
+
+
+def _embed_into(name: str, rows: int, dimension: int, offset: int, texts: List[str]) -> int:
+    """Embed `texts` và ghi vào các hàng [offset, offset + len(texts)) của vùng shared memory `name`"""
+    vectors = np.asarray(_worker_function(texts), dtype=np.float32)
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        output = np.ndarray((rows, dimension), dtype=np.float32, buffer=block.buf)
+        output[offset:offset + len(texts)] = vectors
+        del output
+    finally:
+        block.close()
+    return len(texts)
+
+
+class EmbeddingPool:
+    """Embedding function chạy trên nhiều process, mỗi process nạp model một lần
+
+    Một lần gọi được chia thành các lô (ít nhất `min_batch` văn bản) cho các process;
+    vector được ghi thẳng vào một vùng shared memory do process cha cấp, không pickle
+    list float. Trả về mảng numpy float32 (số văn bản x số chiều). Gọi được từ nhiều
+    thread cùng lúc, nên IndexingPipeline có thể giữ nhiều lô embed chạy song song.
+
+    Args:
+        spec: Embedding function dạng "module:tên" như EMBEDDING_FUNCTION, rỗng là model mặc định
+        workers: Số process
+        threads_per_worker: Số thread ONNX của mỗi process
+    """
+
+    def __init__(self, spec: str = "", workers: int = 2, threads_per_worker: int = 1,
+                 min_batch: int = MIN_WORKER_BATCH):
+        self.workers = max(1, workers)
+        self.min_batch = min_batch
+        # spawn thay cho fork: process cha có thể đang chạy nhiều thread (Streamlit, pipeline)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker, initargs=(spec, threads_per_worker))
+        self._dimension: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @property
+    def dimension(self) -> int:
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = self._executor.submit(_dimension).result()
+            return self._dimension
+
+    def __call__(self, texts: List[str]) -> np.ndarray:
+        texts = list(texts)
+        dimension = self.dimension
+        if not texts:
+            return np.zeros((0, dimension), dtype=np.float32)
+        size = max(self.min_batch, -(-len(texts) // self.workers))
+        block = shared_memory.SharedMemory(create=True, size=len(texts) * dimension * 4)
+        try:
+            futures = [
+                self._executor.submit(_embed_into, block.name, len(texts), dimension, start, texts[start:start + size])
+                for start in range(0, len(texts), size)
+            ]
+            # Đợi mọi lô xong (kể cả khi có lô lỗi) trước khi giải phóng vùng nhớ
+            wait(futures)
+            for future in futures:
+                future.result()
+            output = np.ndarray((len(texts), dimension), dtype=np.float32, buffer=block.buf)
+            vectors = output.copy()
+            del output
+            return vectors
+        finally:
+            block.close()
+            block.unlink()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,235 @@
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+# Facet index nằm cạnh thư mục ./chroma_db
+FACET_INDEX_PATH = "./facet_index.sqlite3"
+
+# Các filter được hỗ trợ: file, tab và cột
+FILTER_KEYS = ("file_id", "sheet_id", "col")
+
+
+def column_flag(col: str) -> str:
+    """Khóa metadata đánh dấu document có dữ liệu ở cột `col` (where {column_flag("B"): 1})"""
+    return f"has_col_{col}"
+
+
+def build_where(filters: Optional[Dict]) -> Optional[Dict]:
+    """Chuyển filters {file_id, sheet_id, col} thành mệnh đề where của collection"""
+    clauses = []
+    for key in FILTER_KEYS:
+        value = (filters or {}).get(key)
+        if not value:
+            continue
+        clauses.append({column_flag(value): 1} if key == "col" else {key: str(value)})
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def filters_from_where(where: Optional[Dict]) -> Dict:
+    """Ngược lại của build_where: lấy {file_id, sheet_id, col} từ mệnh đề where (bỏ qua điều kiện khác)"""
+    filters: Dict = {}
+    for clause in (where or {}).get("$and", [where or {}]):
+        for key, value in clause.items():
+            if isinstance(value, dict):
+                value = value.get("$eq")
+            if key in ("file_id", "sheet_id"):
+                filters[key] = str(value)
+            elif key.startswith(column_flag("")) and value == 1:
+                filters["col"] = key[len(column_flag("")):]
+    return filters
+
+
+class FacetIndex:
+    """Số document theo file, tab và cột, cùng tên file/tab, đồng bộ với spec_collection
+
+    Được ChromaBatchWriter cập nhật như một sink (giống LexicalIndex) nên số đếm facet
+    chỉ là một truy vấn trên bảng tổng hợp nhỏ, không phải quét collection.
+    """
+
+    def __init__(self, path: str = FACET_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                cols TEXT NOT NULL
+            ) WITHOUT ROWID;
+            -- Số document của mỗi cột trong mỗi tab; col = '' là số document của cả tab
+            CREATE TABLE IF NOT EXISTS counts (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                col TEXT NOT NULL,
+                docs INTEGER NOT NULL,
+                PRIMARY KEY (file_id, sheet_id, col)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS names (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                file_name TEXT,
+                tab_name TEXT,
+                PRIMARY KEY (file_id, sheet_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS docs_scope ON docs (file_id, sheet_id);
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def _columns(cols: str) -> List[str]:
+        return [col for col in cols.split(",") if col]
+
+    def _change_counts(self, rows: List[tuple], sign: int) -> None:
+        deltas: Dict[tuple, int] = {}
+        for file_id, sheet_id, cols in rows:
+            for col in [""] + self._columns(cols):
+                key = (file_id, sheet_id, col)
+                deltas[key] = deltas.get(key, 0) + sign
+        self._conn.executemany(
+            "INSERT INTO counts (file_id, sheet_id, col, docs) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(file_id, sheet_id, col) DO UPDATE SET docs = docs + excluded.docs",
+            [(*key, delta) for key, delta in deltas.items()]
+        )
+
+    def _delete_locked(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT file_id, sheet_id, cols FROM docs WHERE id IN ({placeholders})", batch).fetchall()
+            if not rows:
+                continue
+            self._change_counts(rows, -1)
+            self._conn.execute(f"DELETE FROM docs WHERE id IN ({placeholders})", batch)
+        self._conn.execute("DELETE FROM counts WHERE docs <= 0")
+        self._conn.execute(
+            "DELETE FROM names WHERE NOT EXISTS (SELECT 1 FROM counts c "
+            "WHERE c.file_id = names.file_id AND c.sheet_id = names.sheet_id)")
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict]) -> None:
+        """Thêm hoặc ghi đè các document (cùng id với spec_collection)"""
+        rows = [
+            (doc_id, str(metadata.get("file_id", "")), str(metadata.get("sheet_id", "")),
+             str(metadata.get("cols") or metadata.get("col") or ""))
+            for doc_id, metadata in zip(ids, metadatas)
+        ]
+        names = {
+            (str(metadata.get("file_id", "")), str(metadata.get("sheet_id", ""))):
+                (metadata.get("file_name"), metadata.get("tab_name"))
+            for metadata in metadatas
+        }
+        with self._lock, self._conn:
+            self._delete_locked(list(ids))
+            self._conn.executemany("INSERT INTO docs (id, file_id, sheet_id, cols) VALUES (?, ?, ?, ?)", rows)
+            self._change_counts([row[1:] for row in rows], 1)
+            self._conn.executemany(
+                "INSERT INTO names (file_id, sheet_id, file_name, tab_name) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(file_id, sheet_id) DO UPDATE SET "
+                "file_name = COALESCE(excluded.file_name, names.file_name), "
+                "tab_name = COALESCE(excluded.tab_name, names.tab_name)",
+                [(*key, *value) for key, value in names.items()]
+            )
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock, self._conn:
+            self._delete_locked(list(ids))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def facets(self, filters: Optional[Dict] = None) -> Dict:
+        """Số document theo file, theo tab (trong file đã chọn) và theo cột (trong file/tab đã chọn)
+
+        Mỗi facet là list {value, label, count} theo count giảm dần; tab và cột chỉ có khi
+        đã chọn file.
+        """
+        filters = filters or {}
+        file_id, sheet_id = filters.get("file_id"), filters.get("sheet_id")
+        result = {"files": [], "sheets": [], "columns": []}
+        with self._lock:
+            for value, label, count in self._conn.execute(
+                    "SELECT c.file_id, MAX(n.file_name), SUM(c.docs) FROM counts c "
+                    "LEFT JOIN names n ON n.file_id = c.file_id AND n.sheet_id = c.sheet_id "
+                    "WHERE c.col = '' GROUP BY c.file_id ORDER BY SUM(c.docs) DESC"):
+                result["files"].append({"value": value, "label": label or value, "count": count})
+            if not file_id:
+                return result
+            for value, label, count in self._conn.execute(
+                    "SELECT c.sheet_id, n.tab_name, c.docs FROM counts c "
+                    "LEFT JOIN names n ON n.file_id = c.file_id AND n.sheet_id = c.sheet_id "
+                    "WHERE c.file_id = ? AND c.col = '' ORDER BY c.docs DESC", (file_id,)):
+                result["sheets"].append({"value": value, "label": label or value, "count": count})
+            query = "SELECT col, SUM(docs) FROM counts WHERE file_id = ? AND col != ''"
+            params = [file_id]
+            if sheet_id:
+                query += " AND sheet_id = ?"
+                params.append(sheet_id)
+            rows = self._conn.execute(query + " GROUP BY col", params).fetchall()
+        # Sắp xếp cột theo thứ tự trong sheet (A, B, ..., Z, AA)
+        for col, count in sorted(rows, key=lambda row: (len(row[0]), row[0])):
+            result["columns"].append({"value": col, "label": col, "count": count})
+        return result
+
+    def scope_size(self, filters: Optional[Dict] = None) -> int:
+        """Số document thỏa filters {file_id, sheet_id, col}, đọc từ bảng tổng hợp"""
+        filters = filters or {}
+        conditions, params = ["col = ?"], [filters.get("col") or ""]
+        for key in ("file_id", "sheet_id"):
+            if filters.get(key):
+                conditions.append(f"{key} = ?")
+                params.append(str(filters[key]))
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT COALESCE(SUM(docs), 0) FROM counts WHERE {' AND '.join(conditions)}", params).fetchone()[0]
+
+    def scope_ids(self, filters: Optional[Dict] = None) -> List[str]:
+        """Id của các document thỏa filters"""
+        filters = filters or {}
+        conditions, params = ["1"], []
+        for key in ("file_id", "sheet_id"):
+            if filters.get(key):
+                conditions.append(f"{key} = ?")
+                params.append(str(filters[key]))
+        if filters.get("col"):
+            conditions.append("instr(',' || cols || ',', ?) > 0")
+            params.append(f",{filters['col']},")
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT id FROM docs WHERE {' AND '.join(conditions)}", params)]
+
+    def scope_files(self, filters: Optional[Dict] = None) -> List[str]:
+        """Các file có ít nhất một document thỏa filters"""
+        filters = filters or {}
+        conditions, params = ["col = ?", "docs > 0"], [filters.get("col") or ""]
+        for key in ("file_id", "sheet_id"):
+            if filters.get(key):
+                conditions.append(f"{key} = ?")
+                params.append(str(filters[key]))
+        with self._lock:
+            return [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT file_id FROM counts WHERE {' AND '.join(conditions)}", params)]
+
+    def sync_with(self, collection, page_size: int = 1000) -> bool:
+        """Dựng lại index từ collection nếu số document lệch nhau (ví dụ index được tạo trước facet)"""
+        if self.count() == collection.count():
+            return False
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("DELETE FROM counts")
+            self._conn.execute("DELETE FROM names")
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["metadatas"])
+            if not page["ids"]:
+                break
+            self.upsert(page["ids"], [""] * len(page["ids"]), page["metadatas"])
+            offset += len(page["ids"])
+        return True
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,81 @@
+"""Model chat giả lập chạy cục bộ, dùng để thử ReAct agent của Sheet Creator không cần OpenAI
+
+Chọn bằng CHAT_MODEL=fake_chat_model:FakeChatModel. Model trả lời theo `responses` cho
+trước (chuỗi là câu trả lời, dict {"name", "args"} là một lần gọi tool); hết kịch bản thì
+nhắc lại tin nhắn cuối. Tin nhắn người dùng dạng `/tool tên_tool {"arg": ...}` sinh ra một
+lần gọi tool, để thử các tool từ giao diện chat. Câu trả lời được stream từng từ, mỗi từ
+cách nhau `token_delay` giây.
+"""
+import json
+import time
+import uuid
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Tiền tố của tin nhắn yêu cầu model giả lập gọi tool
+TOOL_COMMAND = "/tool"
+
+
+class FakeChatModel(BaseChatModel):
+    responses: List[Union[str, Dict[str, Any]]] = []
+    token_delay: float = 0.0
+    # Vị trí trong `responses`, dùng dict để sửa được trên model pydantic
+    state: Dict[str, int] = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs) -> "FakeChatModel":
+        # Model giả lập không cần schema của tool
+        return self
+
+    def _next_response(self, messages: List[BaseMessage]) -> Union[str, Dict[str, Any]]:
+        position = self.state.get("position", 0)
+        if position < len(self.responses):
+            self.state["position"] = position + 1
+            return self.responses[position]
+        last = messages[-1]
+        content = last.content if isinstance(last.content, str) else ""
+        if last.type == "tool":
+            return f"Kết quả của {last.name}: {content}"
+        if content.startswith(TOOL_COMMAND):
+            name, _, args = content[len(TOOL_COMMAND):].strip().partition(" ")
+            return {"name": name, "args": json.loads(args) if args.strip() else {}}
+        return f"Đã nhận: {content}"
+
+    @staticmethod
+    def _tool_call(response: Dict[str, Any]) -> Dict[str, Any]:
+        return {"name": response["name"], "args": response.get("args", {}), "id": f"call_{uuid.uuid4().hex[:12]}"}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs) -> ChatResult:
+        response = self._next_response(messages)
+        if isinstance(response, dict):
+            message = AIMessage(content="", tool_calls=[self._tool_call(response)])
+        else:
+            message = AIMessage(content=response)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        response = self._next_response(messages)
+        if isinstance(response, dict):
+            tool_call = self._tool_call(response)
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[{
+                "name": tool_call["name"], "args": json.dumps(tool_call["args"], ensure_ascii=False),
+                "id": tool_call["id"], "index": 0,
+            }]))
+            return
+        words = response.split(" ")
+        for index, word in enumerate(words):
+            if self.token_delay:
+                time.sleep(self.token_delay)
+            token = word if index == len(words) - 1 else word + " "
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
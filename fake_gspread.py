@@ -0,0 +1,271 @@
+"""Client gspread giả lập chạy hoàn toàn trong bộ nhớ, dùng để thử indexer không cần Google
+
+Hỗ trợ giả lập độ trễ mạng và lỗi 429 (ngẫu nhiên hoặc khi vượt quota mỗi phút), và
+change feed của Drive (changes.getStartPageToken, changes.list) qua FakeClient.request.
+"""
+import random
+import threading
+import time
+from typing import Dict, List, Optional
+
+from gspread.exceptions import APIError, SpreadsheetNotFound, WorksheetNotFound
+
+
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+
+
+class FakeResponse:
+    """Response tối thiểu để khởi tạo gspread.exceptions.APIError hoặc trả JSON từ FakeClient.request"""
+
+    def __init__(self, status_code: int, message: str, payload: Optional[Dict] = None):
+        self.status_code = status_code
+        self.text = message
+        self._payload = payload if payload is not None else {
+            "error": {"code": status_code, "message": message, "status": "RESOURCE_EXHAUSTED"}}
+
+    def json(self):
+        return self._payload
+
+
+class FakeCell:
+    def __init__(self, value: Optional[str]):
+        self.value = value
+
+
+def _range_box(range_name: str):
+    """(hàng đầu, cột đầu, hàng cuối, cột cuối) tính từ 0 của range A1; hàng/cột cuối None nếu mở"""
+    from sheet_creator_tool import a1_bounds
+
+    row1, col1, row2, col2 = a1_bounds(range_name)
+    return (int(row1) - 1, int(col1) - 1,
+            None if row2 == float("inf") else int(row2) - 1,
+            None if col2 == float("inf") else int(col2) - 1)
+
+
+class FakeWorksheet:
+    def __init__(self, client: "FakeClient", title: str, sheet_id: int, values: List[List[str]]):
+        self.client = client
+        self.title = title
+        self.id = sheet_id
+        self.values = values
+
+    @property
+    def row_count(self) -> int:
+        return len(self.values)
+
+    @property
+    def col_count(self) -> int:
+        return max((len(row) for row in self.values), default=0)
+
+    def get_all_values(self) -> List[List[str]]:
+        self.client._request("get_all_values")
+        return [list(row) for row in self.values]
+
+    def _read(self, range_name: str) -> List[List[str]]:
+        row1, col1, row2, col2 = _range_box(range_name)
+        rows = self.values[row1:None if row2 is None else row2 + 1]
+        result = [list(row[col1:None if col2 is None else col2 + 1]) for row in rows]
+        # Như Sheets API: bỏ ô rỗng cuối hàng và hàng rỗng cuối vùng
+        for row in result:
+            while row and row[-1] == "":
+                row.pop()
+        while result and not result[-1]:
+            result.pop()
+        return result
+
+    def _write(self, range_name: str, values: List[List[str]]) -> None:
+        row1, col1, _, _ = _range_box(range_name)
+        for row_offset, row_values in enumerate(values):
+            while len(self.values) <= row1 + row_offset:
+                self.values.append([])
+            row = self.values[row1 + row_offset]
+            for col_offset, value in enumerate(row_values):
+                while len(row) <= col1 + col_offset:
+                    row.append("")
+                row[col1 + col_offset] = "" if value is None else str(value)
+
+    def acell(self, label: str) -> FakeCell:
+        self.client._request("acell")
+        values = self._read(label)
+        return FakeCell(values[0][0] if values and values[0] else None)
+
+    def get(self, range_name: str) -> List[List[str]]:
+        self.client._request("get")
+        return self._read(range_name)
+
+    def update_acell(self, label: str, value: str) -> None:
+        self.client._request("update_acell")
+        self._write(label, [[value]])
+
+    def update(self, range_name: str, values: List[List[str]]) -> None:
+        self.client._request("update")
+        self._write(range_name, values)
+
+
+class FakeSpreadsheet:
+    def __init__(self, client: "FakeClient", file_id: str, name: str, worksheets: List[FakeWorksheet]):
+        self.client = client
+        self.id = file_id
+        self.title = name
+        self._worksheets = worksheets
+
+    def worksheets(self) -> List[FakeWorksheet]:
+        self.client._request("worksheets")
+        return list(self._worksheets)
+
+    def values_batch_get(self, ranges: List[str], params: Optional[Dict] = None) -> Dict:
+        """Giống Spreadsheet.values_batch_get, hỗ trợ range là tên tab ('Tên tab') hoặc 'Tên tab'!A1:F2000"""
+        self.client._request("values_batch_get")
+        by_title = {sheet.title: sheet for sheet in self._worksheets}
+        value_ranges = []
+        for range_name in ranges:
+            title, _, cells = range_name.rpartition("!") if "!" in range_name else (range_name, "", "")
+            if title.startswith("'") and title.endswith("'"):
+                title = title[1:-1].replace("''", "'")
+            if title not in by_title:
+                raise WorksheetNotFound(title)
+            sheet = by_title[title]
+            values = sheet._read(cells) if cells else [list(row) for row in sheet.values]
+            value_ranges.append({"range": range_name, "majorDimension": "ROWS", "values": values})
+        return {"spreadsheetId": self.id, "valueRanges": value_ranges}
+
+    def values_batch_update(self, body: Dict) -> Dict:
+        """Giống Spreadsheet.values_batch_update: ghi nhiều vùng ('Tên tab'!A1:B2) trong một request"""
+        self.client._request("values_batch_update")
+        by_title = {sheet.title: sheet for sheet in self._worksheets}
+        for item in body["data"]:
+            title, _, range_name = item["range"].rpartition("!")
+            if title.startswith("'") and title.endswith("'"):
+                title = title[1:-1].replace("''", "'")
+            if title not in by_title:
+                raise WorksheetNotFound(title)
+            by_title[title]._write(range_name, item["values"])
+        return {"spreadsheetId": self.id, "totalUpdatedRanges": len(body["data"])}
+
+    def worksheet(self, title: str) -> FakeWorksheet:
+        self.client._request("worksheet")
+        for sheet in self._worksheets:
+            if sheet.title == title:
+                return sheet
+        raise WorksheetNotFound(title)
+
+
+class FakeClient:
+    """Thay thế gspread.Client cho các hàm trong indexer.py
+
+    Args:
+        latency: Số giây chờ cho mỗi request
+        error_rate: Xác suất một request bị trả về 429
+        quota_per_minute: Nếu có, trả về 429 khi số request trong 60 giây vượt quá giá trị này
+        seed: Seed cho việc sinh lỗi ngẫu nhiên
+    """
+
+    def __init__(self, latency: float = 0.0, error_rate: float = 0.0,
+                 quota_per_minute: Optional[int] = None, seed: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.files: Dict[str, Dict] = {}
+        self.spreadsheets: Dict[str, FakeSpreadsheet] = {}
+        # Change feed của Drive; page token là vị trí trong danh sách này
+        self.changes: List[Dict] = []
+        self.requests = 0
+        self.rate_limited = 0
+        self._random = random.Random(seed)
+        self._recent: List[float] = []
+        self._lock = threading.Lock()
+
+    def add_spreadsheet(self, file_id: str, name: str, sheets: Dict[str, List[List[str]]],
+                        folder_id: Optional[str] = None, modified_time: str = "2024-01-01T00:00:00.000Z") -> FakeSpreadsheet:
+        """Thêm một spreadsheet với các tab {tên tab: values}"""
+        worksheets = [
+            FakeWorksheet(self, title, sheet_id, values)
+            for sheet_id, (title, values) in enumerate(sheets.items())
+        ]
+        spreadsheet = FakeSpreadsheet(self, file_id, name, worksheets)
+        self.spreadsheets[file_id] = spreadsheet
+        self.files[file_id] = {
+            "id": file_id,
+            "name": name,
+            "modifiedTime": modified_time,
+            "folder_id": folder_id,
+        }
+        self._record_change(file_id)
+        return spreadsheet
+
+    def _record_change(self, file_id: str, removed: bool = False) -> None:
+        info = self.files.get(file_id)
+        self.changes.append({
+            "fileId": file_id,
+            "removed": removed,
+            "time": info["modifiedTime"] if info else None,
+            "file": None if removed else {
+                "id": file_id,
+                "name": info["name"],
+                "mimeType": SPREADSHEET_MIME_TYPE,
+                "modifiedTime": info["modifiedTime"],
+                "parents": [info["folder_id"]] if info["folder_id"] else [],
+                "trashed": False,
+            },
+        })
+
+    def touch_spreadsheet(self, file_id: str, modified_time: str) -> None:
+        """Đổi modifiedTime của một file (sau khi sửa ô) và ghi một thay đổi vào change feed"""
+        self.files[file_id]["modifiedTime"] = modified_time
+        self._record_change(file_id)
+
+    def remove_spreadsheet(self, file_id: str) -> None:
+        """Xóa hẳn một file và ghi thay đổi removed vào change feed"""
+        self.files.pop(file_id, None)
+        self.spreadsheets.pop(file_id, None)
+        self._record_change(file_id, removed=True)
+
+    def request(self, method: str, endpoint: str, params: Optional[Dict] = None, **kwargs) -> FakeResponse:
+        """Giống gspread.Client.request, chỉ hỗ trợ change feed của Drive API v3"""
+        self._request("request")
+        params = params or {}
+        if endpoint.endswith("/changes/startPageToken"):
+            return FakeResponse(200, "", {"startPageToken": str(len(self.changes))})
+        if endpoint.endswith("/changes"):
+            start = int(params["pageToken"])
+            end = start + int(params.get("pageSize", 100))
+            payload = {"changes": self.changes[start:end]}
+            if end < len(self.changes):
+                payload["nextPageToken"] = str(end)
+            else:
+                payload["newStartPageToken"] = str(len(self.changes))
+            return FakeResponse(200, "", payload)
+        raise NotImplementedError(endpoint)
+
+    def _request(self, name: str) -> None:
+        with self._lock:
+            self.requests += 1
+            now = time.monotonic()
+            rejected = self._random.random() < self.error_rate
+            if self.quota_per_minute is not None:
+                self._recent = [t for t in self._recent if now - t < 60]
+                if len(self._recent) >= self.quota_per_minute:
+                    rejected = True
+                else:
+                    self._recent.append(now)
+            if rejected:
+                self.rate_limited += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if rejected:
+            raise APIError(FakeResponse(429, f"Quota exceeded ({name})"))
+
+    def open_by_key(self, key: str) -> FakeSpreadsheet:
+        self._request("open_by_key")
+        if key not in self.spreadsheets:
+            raise SpreadsheetNotFound(key)
+        return self.spreadsheets[key]
+
+    def list_spreadsheet_files(self, title: Optional[str] = None, folder_id: Optional[str] = None) -> List[Dict]:
+        self._request("list_spreadsheet_files")
+        return [
+            {key: value for key, value in info.items() if key != "folder_id"}
+            for info in self.files.values()
+            if (folder_id is None or info["folder_id"] == folder_id)
+            and (title is None or info["name"] == title)
+        ]
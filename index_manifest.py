@@ -0,0 +1,161 @@
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Manifest nằm cạnh thư mục ./chroma_db
+MANIFEST_PATH = "./index_manifest.sqlite3"
+
+# (sheet_id, vùng ô) -> (hash nội dung, số chunk đã ghi vào Chroma); vùng ô là một ô ("B5"),
+# một hàng ("A5:F5") hoặc một nhóm hàng ("A5:F9") tùy chế độ chia document
+CellEntries = Dict[Tuple[str, str], Tuple[str, int]]
+
+
+def content_hash(value: str) -> str:
+    """Hash nội dung của một ô để so sánh giữa các lần index"""
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()
+
+
+def chunk_id(file_id: str, sheet_id, cell: str, index: int) -> str:
+    """Id của một chunk trong spec_collection"""
+    return f"{file_id}_{sheet_id}_{cell}_{index}"
+
+
+def is_full_rewrite(previous: CellEntries) -> bool:
+    """Mọi vùng ô của file sẽ được ghi lại: file chưa có trong manifest (hoặc không dùng manifest)
+    hoặc được index với cấu hình khác"""
+    return not any(cell_hash for cell_hash, _ in previous.values())
+
+
+class IndexManifest:
+    """Lưu trạng thái index: modifiedTime của từng file và hash của từng ô
+
+    `config` là chữ ký cấu hình index (chế độ chia document, tham số chunk...). File được
+    index với cấu hình khác sẽ được index lại toàn bộ, kể cả khi modifiedTime không đổi.
+    """
+
+    def __init__(self, path: str = MANIFEST_PATH, config: Optional[str] = None):
+        self.path = path
+        self.config = config
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                folder_id TEXT,
+                file_name TEXT,
+                modified_time TEXT
+            );
+            CREATE TABLE IF NOT EXISTS cells (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                cell TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                chunks INTEGER NOT NULL,
+                PRIMARY KEY (file_id, sheet_id, cell)
+            );
+            CREATE INDEX IF NOT EXISTS files_folder ON files (folder_id);
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(files)")]
+        if "config" not in columns:
+            # Manifest tạo trước khi có chữ ký cấu hình
+            self._conn.execute("ALTER TABLE files ADD COLUMN config TEXT")
+        self._conn.commit()
+
+    def _config_matches(self, stored: Optional[str]) -> bool:
+        return self.config is None or stored == self.config
+
+    def is_unchanged(self, file_info: Dict) -> bool:
+        """File không đổi nếu modifiedTime trên Drive và cấu hình index trùng với lần index trước"""
+        modified_time = file_info.get("modifiedTime")
+        if not modified_time:
+            return False
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT modified_time, config FROM files WHERE file_id = ?", (file_info["id"],)
+            ).fetchone()
+        return row is not None and row[0] == modified_time and self._config_matches(row[1])
+
+    def files_in_folder(self, folder_id: str) -> List[str]:
+        """Danh sách file_id đã index từ một folder"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT file_id FROM files WHERE folder_id = ?", (folder_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def cell_entries(self, file_id: str) -> CellEntries:
+        """Hash và số chunk của tất cả các ô đã index trong một file
+
+        Nếu file được index với cấu hình khác thì hash bị bỏ trống: mọi vùng ô đều được
+        index lại, còn số chunk vẫn được giữ để xóa các id cũ.
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT config FROM files WHERE file_id = ?", (file_id,)).fetchone()
+            rows = self._conn.execute(
+                "SELECT sheet_id, cell, hash, chunks FROM cells WHERE file_id = ?", (file_id,)
+            ).fetchall()
+        stale = row is not None and not self._config_matches(row[0])
+        return {(sheet_id, cell): ("" if stale else hash_, chunks) for sheet_id, cell, hash_, chunks in rows}
+
+    def chunk_ids(self, file_id: str) -> List[str]:
+        """Tất cả id trong spec_collection thuộc về một file"""
+        return [
+            chunk_id(file_id, sheet_id, cell, i)
+            for (sheet_id, cell), (_, chunks) in self.cell_entries(file_id).items()
+            for i in range(chunks)
+        ]
+
+    def chunk_count(self, file_id: str) -> int:
+        """Số chunk của một file ở lần index trước (0 nếu chưa index), dùng để ước lượng kích thước"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(chunks), 0) FROM cells WHERE file_id = ?", (file_id,)).fetchone()[0]
+
+    def update_file(self, file_info: Dict, folder_id: Optional[str], cells: CellEntries) -> None:
+        """Ghi lại trạng thái mới của một file sau khi đã flush vào Chroma"""
+        file_id = file_info["id"]
+        with self._lock, self._conn:
+            # Giữ folder_id cũ khi file được index lẻ (không biết folder)
+            self._conn.execute(
+                "INSERT INTO files (file_id, folder_id, file_name, modified_time, config) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(file_id) DO UPDATE SET folder_id = COALESCE(excluded.folder_id, files.folder_id), "
+                "file_name = excluded.file_name, modified_time = excluded.modified_time, config = excluded.config",
+                (file_id, folder_id, file_info.get("name"), file_info.get("modifiedTime"), self.config)
+            )
+            self._conn.execute("DELETE FROM cells WHERE file_id = ?", (file_id,))
+            self._conn.executemany(
+                "INSERT INTO cells (file_id, sheet_id, cell, hash, chunks) VALUES (?, ?, ?, ?, ?)",
+                [(file_id, sheet_id, cell, hash_, chunks) for (sheet_id, cell), (hash_, chunks) in cells.items()]
+            )
+
+    def dump(self) -> Dict[str, List[list]]:
+        """Toàn bộ manifest (các file kèm revision và cấu hình, các ô), dùng cho index_snapshot"""
+        with self._lock:
+            return {
+                "files": [list(row) for row in self._conn.execute(
+                    "SELECT file_id, folder_id, file_name, modified_time, config FROM files ORDER BY file_id")],
+                "cells": [list(row) for row in self._conn.execute(
+                    "SELECT file_id, sheet_id, cell, hash, chunks FROM cells ORDER BY file_id")],
+            }
+
+    def restore(self, dump: Dict[str, List[list]]) -> None:
+        """Ghi các file trong `dump` (kết quả của dump()) vào manifest, thay trạng thái cũ của chúng"""
+        file_ids = [(row[0],) for row in dump["files"]]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM cells WHERE file_id = ?", file_ids)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO files (file_id, folder_id, file_name, modified_time, config) "
+                "VALUES (?, ?, ?, ?, ?)", dump["files"])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cells (file_id, sheet_id, cell, hash, chunks) VALUES (?, ?, ?, ?, ?)",
+                dump["cells"])
+
+    def remove_file(self, file_id: str) -> None:
+        """Xóa một file khỏi manifest"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM cells WHERE file_id = ?", (file_id,))
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,299 @@
+"""Xuất và nạp toàn bộ index dưới dạng một file snapshot có phiên bản
+
+Dùng để một replica mới có index ngay mà không index lại từ Google và không embed lại:
+
+    python indexer.py export spec_index.idx
+    python indexer.py import spec_index.idx
+
+Cấu trúc file:
+
+    [0:8]    MAGIC
+    [8:16]   vị trí header (uint64 little-endian)
+    [16:24]  độ dài header
+    [64:...] embeddings float32 liền nhau (count x dim), đọc qua mmap không cần copy
+    ...      documents: zlib của JSON lines {"id", "document", "metadata"}, cùng thứ tự embeddings
+    ...      manifest: zlib của JSON (IndexManifest.dump, gồm revision của các file nguồn)
+    ...      values: zlib của JSON (ValueIndex.dump, các ô số/ngày/boolean không nằm trong collection)
+    ...      header: JSON gồm phiên bản định dạng, count, dim, chữ ký model, vị trí/độ dài và
+             sha256 của từng phần
+
+Chữ ký model gồm checksum của model_id và số chiều, cùng embedding của vài câu mẫu; snapshot
+tạo bằng model embedding khác với model của process nạp bị từ chối.
+"""
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterator, Optional
+
+import numpy as np
+
+from index_manifest import IndexManifest
+from indexer import ChromaBatchWriter
+from query_cache import bump_generation
+from resources import (VECTOR_STORE, get_collection, get_embedding_function, get_facet_index, get_lexical_index,
+                       get_value_index)
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"SGSIDX\x00\x01"
+# 2: thêm phần values
+FORMAT_VERSION = 2
+
+# Embeddings bắt đầu ở vị trí này, căn theo cache line
+DATA_OFFSET = 64
+
+# Số document mỗi lần đọc từ collection khi xuất và mỗi lô ghi khi nạp
+EXPORT_PAGE_SIZE = 1000
+IMPORT_BATCH_SIZE = 2048
+
+# Đọc/ghi các phần nén theo khối cỡ này
+STREAM_BLOCK_BYTES = 1 << 20
+
+COMPRESSION_LEVEL = 6
+
+# Các câu mẫu dùng để nhận diện model embedding, và sai lệch cho phép giữa hai máy
+PROBE_TEXTS = (
+    "Mã màn hình SCR-001: đăng nhập bằng email và mật khẩu",
+    "Total amount | Tổng tiền thanh toán của đơn hàng",
+)
+PROBE_TOLERANCE = 1e-3
+
+
+def model_signature(embedding_function=None) -> Dict:
+    """Checksum của model_id và số chiều, cùng embedding của PROBE_TEXTS"""
+    embedding_function = embedding_function or get_embedding_function()
+    # Gọi thẳng model, không qua cache (cache theo model_id nên không phân biệt được model cùng tên)
+    model = getattr(embedding_function, "embedding_function", embedding_function)
+    probe = np.asarray(model(list(PROBE_TEXTS)), dtype=np.float64)
+    model_id = str(getattr(embedding_function, "model_id", type(model).__name__))
+    checksum = hashlib.sha256(f"{model_id}\x00{probe.shape[1]}".encode("utf-8")).hexdigest()
+    return {"model_id": model_id, "checksum": checksum, "probe": np.round(probe, 6).tolist()}
+
+
+def same_model(expected: Dict, actual: Dict) -> bool:
+    """Hai chữ ký là của cùng một model (embedding mẫu chỉ được lệch do sai số dấu phẩy động)"""
+    return (expected["checksum"] == actual["checksum"]
+            and np.allclose(expected["probe"], actual["probe"], atol=PROBE_TOLERANCE))
+
+
+class _SectionWriter:
+    """Ghi một phần nén vào file, tính độ dài và sha256 của phần đã ghi"""
+
+    def __init__(self, f):
+        self.f = f
+        self.offset = f.tell()
+        self.digest = hashlib.sha256()
+        self._compressor = zlib.compressobj(COMPRESSION_LEVEL)
+
+    def _emit(self, data: bytes) -> None:
+        if data:
+            self.f.write(data)
+            self.digest.update(data)
+
+    def write(self, data: bytes) -> None:
+        self._emit(self._compressor.compress(data))
+
+    def close(self) -> Dict:
+        self._emit(self._compressor.flush())
+        return {"offset": self.offset, "length": self.f.tell() - self.offset, "sha256": self.digest.hexdigest()}
+
+
+def export_index(path: str, collection=None, page_size: int = EXPORT_PAGE_SIZE) -> Dict:
+    """Ghi collection hiện tại và manifest vào file snapshot `path` (ghi file tạm rồi đổi tên)"""
+    started = time.perf_counter()
+    try:
+        collection = collection if collection is not None else get_collection()
+        total = collection.count()
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * DATA_OFFSET)
+            embeddings_digest = hashlib.sha256()
+            # Documents được nén vào file tạm thứ hai vì phải nằm sau toàn bộ embeddings
+            documents_path = f"{tmp_path}.documents"
+            with open(documents_path, "wb") as documents_file:
+                documents = _SectionWriter(documents_file)
+                count, dim, offset = 0, None, 0
+                while offset < total:
+                    page = collection.get(limit=page_size, offset=offset,
+                                          include=["embeddings", "documents", "metadatas"])
+                    if not page["ids"]:
+                        break
+                    vectors = np.asarray(page["embeddings"], dtype="<f4")
+                    dim = dim or vectors.shape[1]
+                    if vectors.shape[1] != dim:
+                        raise ValueError("Các embedding trong collection có số chiều khác nhau")
+                    block = vectors.tobytes()
+                    f.write(block)
+                    embeddings_digest.update(block)
+                    lines = [
+                        json.dumps({"id": doc_id, "document": document, "metadata": metadata},
+                                   ensure_ascii=False, separators=(",", ":"))
+                        for doc_id, document, metadata in zip(page["ids"], page["documents"], page["metadatas"])
+                    ]
+                    documents.write(("\n".join(lines) + "\n").encode("utf-8"))
+                    count += len(page["ids"])
+                    offset += len(page["ids"])
+                documents_info = documents.close()
+            sections = {"embeddings": {"offset": DATA_OFFSET, "length": f.tell() - DATA_OFFSET,
+                                       "sha256": embeddings_digest.hexdigest()}}
+
+            documents_info["offset"] = f.tell()
+            with open(documents_path, "rb") as documents_file:
+                while True:
+                    data = documents_file.read(STREAM_BLOCK_BYTES)
+                    if not data:
+                        break
+                    f.write(data)
+            os.remove(documents_path)
+            sections["documents"] = documents_info
+
+            manifest = IndexManifest()
+            try:
+                dump = manifest.dump()
+            finally:
+                manifest.close()
+            section = _SectionWriter(f)
+            section.write(json.dumps(dump, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            sections["manifest"] = section.close()
+            section = _SectionWriter(f)
+            section.write(json.dumps(get_value_index().dump(), ensure_ascii=False,
+                                     separators=(",", ":")).encode("utf-8"))
+            sections["values"] = section.close()
+
+            header = {
+                "format": FORMAT_VERSION,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "count": count,
+                "dim": dim or 0,
+                "dtype": "float32",
+                "store": VECTOR_STORE,
+                "model": model_signature(),
+                "files": len(dump["files"]),
+                "sections": sections,
+            }
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            header_offset = f.tell()
+            f.write(header_bytes)
+            f.seek(0)
+            f.write(MAGIC + struct.pack("<QQ", header_offset, len(header_bytes)))
+        os.replace(tmp_path, path)
+        return {
+            "success": True,
+            "message": f"Đã xuất {count} document của {len(dump['files'])} file vào {path}",
+            "details": {"documents": count, "files": len(dump["files"]), "dim": dim or 0,
+                        "bytes": os.path.getsize(path), "seconds": round(time.perf_counter() - started, 2)},
+        }
+    except Exception as e:
+        logger.exception("Lỗi khi xuất index")
+        return {"success": False, "message": f"Lỗi khi xuất index: {str(e)}"}
+
+
+def read_header(mm) -> Dict:
+    """Header của snapshot đã mở bằng mmap"""
+    if len(mm) < DATA_OFFSET or mm[:len(MAGIC)] != MAGIC:
+        raise ValueError("File không phải snapshot index")
+    header_offset, header_length = struct.unpack("<QQ", mm[len(MAGIC):len(MAGIC) + 16])
+    header = json.loads(bytes(mm[header_offset:header_offset + header_length]).decode("utf-8"))
+    if header.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Snapshot định dạng {header.get('format')}, chỉ hỗ trợ {FORMAT_VERSION}")
+    return header
+
+
+def _section(mm, info: Dict) -> memoryview:
+    return memoryview(mm)[info["offset"]:info["offset"] + info["length"]]
+
+
+def _iter_documents(view: memoryview) -> Iterator[Dict]:
+    """Giải nén dần phần documents, mỗi dòng một document"""
+    decompressor = zlib.decompressobj()
+    pending = b""
+    for start in range(0, len(view), STREAM_BLOCK_BYTES):
+        pending += decompressor.decompress(view[start:start + STREAM_BLOCK_BYTES])
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield json.loads(line)
+    pending += decompressor.flush()
+    for line in pending.split(b"\n"):
+        if line:
+            yield json.loads(line)
+
+
+def import_index(path: str, replace: bool = False, verify: bool = True, batch_size: int = IMPORT_BATCH_SIZE,
+                 on_progress: Optional[Callable[[Dict], None]] = None) -> Dict:
+    """Nạp snapshot vào collection, BM25, facet index và manifest, không embed lại
+
+    Index đang có dữ liệu chỉ được ghi đè khi `replace=True` (các file trong manifest hiện
+    tại bị xóa trước). Với `verify=True`, sha256 của từng phần được kiểm tra trước khi ghi.
+    """
+    started = time.perf_counter()
+    mm = vectors = None
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = read_header(mm)
+        current = model_signature()
+        if not same_model(header["model"], current):
+            return {
+                "success": False,
+                "message": f"Snapshot được tạo bằng model embedding khác ({header['model']['model_id']}), "
+                           f"không dùng được với model hiện tại ({current['model_id']})",
+            }
+        sections = header["sections"]
+        if verify:
+            for name, info in sections.items():
+                if hashlib.sha256(_section(mm, info)).hexdigest() != info["sha256"]:
+                    raise ValueError(f"Checksum của phần {name} không khớp, file snapshot bị hỏng")
+
+        collection = get_collection()
+        manifest = IndexManifest()
+        try:
+            if collection.count() and not replace:
+                return {"success": False, "message": "Index đang có dữ liệu, dùng replace=True (--replace) để ghi đè"}
+            value_index = get_value_index()
+            writer = ChromaBatchWriter(collection, batch_size=batch_size,
+                                       sinks=[get_lexical_index(), get_facet_index()], on_flush=bump_generation,
+                                       value_index=value_index)
+            for file_id, *_ in manifest.dump()["files"]:
+                writer.remove_file(file_id, manifest.chunk_ids(file_id))
+                manifest.remove_file(file_id)
+
+            count, dim = header["count"], header["dim"]
+            # Các vector được đọc thẳng từ vùng mmap, không copy cả khối
+            vectors = np.frombuffer(mm, dtype="<f4", count=count * dim,
+                                    offset=sections["embeddings"]["offset"]).reshape(count, dim)
+            for index, doc in enumerate(_iter_documents(_section(mm, sections["documents"]))):
+                writer.add(doc["document"], doc["metadata"], doc["id"], embedding=vectors[index].tolist())
+                if on_progress and (index + 1) % batch_size == 0:
+                    on_progress({"documents": index + 1, "total": count})
+            writer.flush()
+            if writer.written != count:
+                raise ValueError(f"Snapshot có {count} embedding nhưng {writer.written} document")
+            dump = json.loads(zlib.decompress(_section(mm, sections["manifest"])).decode("utf-8"))
+            value_index.restore(json.loads(zlib.decompress(_section(mm, sections["values"])).decode("utf-8")))
+            manifest.restore(dump)
+        finally:
+            manifest.close()
+        return {
+            "success": True,
+            "message": f"Đã nạp {writer.written} document của {len(dump['files'])} file từ {path}",
+            "details": {"documents": writer.written, "files": len(dump["files"]),
+                        "model_id": header["model"]["model_id"], "created_at": header["created_at"],
+                        "seconds": round(time.perf_counter() - started, 2)},
+        }
+    except Exception as e:
+        logger.exception("Lỗi khi nạp snapshot index %s", path)
+        return {"success": False, "message": f"Lỗi khi nạp snapshot index: {str(e)}"}
+    finally:
+        del vectors
+        if mm is not None:
+            try:
+                mm.close()
+            except BufferError:
+                # Còn view trỏ vào vùng nhớ (traceback của lỗi): mmap được đóng khi view được giải phóng
+                pass
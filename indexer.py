@@ -1,72 +1,575 @@
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-import chromadb
-from langchain.text_splitter import RecursiveCharacterTextSplitter  # Changed import to concrete class
-from typing import List, Dict, Tuple
-from chromadb.utils import embedding_functions
-
-# Khởi tạo Chroma với thư mục lưu trữ
-persist_directory = "./chroma_db"
-clientDB = chromadb.PersistentClient(path=persist_directory)
-default_ef = embedding_functions.DefaultEmbeddingFunction()
-collection = clientDB.get_or_create_collection(name="spec_collection", embedding_function=default_ef)
-                                             
-def index_spreadsheet(file_info: Dict, collection, text_splitter, clientGS) -> None:
-    """Index một Google Spreadsheet vào Chroma DB"""
-    file_id = file_info['id']
-    file_name = file_info['name']
-    
-    # Mở spreadsheet
-    spreadsheet = clientGS.open_by_key(file_id)
-    print('index_spreadsheet:', file_id, file_name, spreadsheet)
-    sheets = spreadsheet.worksheets()
-    
-    # Index từng sheet
-    for sheet in sheets:
-        tab_name = sheet.title
-        sheet_id = sheet.id
-        print('index_spreadsheet:', tab_name, sheet_id)
-        data = sheet.get_all_values()
-        print('index_spreadsheet:', data)
-        for row_index, row in enumerate(data):
-            for col_index, cell_value in enumerate(row):
-                if not cell_value:
-                    continue
-                
-                if not isinstance(cell_value, str):
-                    cell_value = str(cell_value)
-                
-                sentences = text_splitter.split_text(cell_value)
-                
-                # Convert column index to letter (e.g., 0->A, 1->B)
-                col_letter = chr(65 + col_index) if col_index < 26 else chr(64 + col_index // 26) + chr(65 + col_index % 26)
-                
-                # Add documents to the ChromaDB collection
-                for i, sentence in enumerate(sentences):
-                    collection.add(
-                        documents=[sentence],
-                        metadatas=[{
-                            "file_name": file_name,
-                            "file_id": file_id,
-                            "tab_name": tab_name,
-                            "sheet_id": str(sheet_id),
-                            "col": col_letter,
-                            "row": str(row_index + 2)  # +2 because of header row and 0-indexing
-                        }],
-                        ids=[f"{file_id}_{sheet_id}_{col_letter}{row_index+2}_{i}"]
-                    )
-
-def handle_new_file(file_info: Dict) -> Dict:
-    """Xử lý file mới được thêm vào folder"""
-    # Create a concrete text splitter instance
-    text_splitter = RecursiveCharacterTextSplitter(
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Iterator, List, Dict, Tuple, Optional, Union
+from facet_index import column_flag
+from index_manifest import IndexManifest, CellEntries, content_hash, chunk_id, is_full_rewrite
+from indexing_pipeline import IndexingPipeline
+from metrics import REGISTRY, StageTimings
+from query_cache import bump_generation
+from resources import (EMBED_WORKERS, VECTOR_STORE, VECTOR_STORE_SHARD_BUCKETS, get_collection, get_embedding_function,
+                       get_facet_index, get_indexing_embedding_function, get_lexical_index, get_value_index)
+from sheet_snapshots import SnapshotStore
+from sheets_api import (TokenBucket, call_with_retry, batch_get_values, get_client, quote_sheet_title,
+                        DEFAULT_READS_PER_MINUTE)
+from value_index import ValueIndex, classify_value
+
+if TYPE_CHECKING:
+    import gspread
+
+logger = logging.getLogger(__name__)
+
+# Client Chroma, embedding function và BM25 dùng chung cho cả process (xem resources.py),
+# chỉ được khởi tạo ở lần index đầu tiên chứ không phải lúc import module
+
+# Số documents tối đa trong một lần upsert vào Chroma
+DEFAULT_BATCH_SIZE = 256
+
+# Cách chia một tab thành documents: từng ô, từng hàng (kèm tiêu đề cột) hoặc nhóm hàng
+GRANULARITIES = ("cell", "row", "row_window")
+DEFAULT_GRANULARITY = "cell"
+
+# Số hàng trong một document ở chế độ "row_window"
+DEFAULT_ROW_WINDOW = 5
+
+# Tăng khi cách đánh số/id hoặc metadata của documents thay đổi, để manifest index lại các file cũ
+# (3: thêm cờ cột has_col_X cho filter theo cột; 4: ô số/ngày/boolean vào value_index thay vì Chroma)
+INDEX_LAYOUT_VERSION = 4
+
+
+def make_text_splitter():
+    """Text splitter dùng để chia nội dung ô thành các chunk"""
+    # Import khi cần, langchain nặng và không cần cho các thao tác chỉ tìm kiếm
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
         chunk_size=1000,
         chunk_overlap=200,
         length_function=len,
     )
+
+
+class ChromaBatchWriter:
+    """Gom documents/metadatas/ids và ghi vào Chroma theo lô bằng upsert (kèm các id cần xóa)
+
+    Các `sinks` (ví dụ LexicalIndex) nhận cùng các lô upsert/delete để luôn đồng bộ với
+    collection; mỗi sink cần có `upsert(ids, documents, metadatas)` và `delete(ids)`.
+    Nếu có `value_index`, giá trị của các ô số/ngày/boolean (set_values) được ghi vào đó
+    trong cùng lần flush.
+    `on_flush` được gọi sau mỗi lần flush có ghi/xóa (dùng để tăng thế hệ của index).
+    Nếu có `timings` (StageTimings), thời gian ghi Chroma và ghi sinks được cộng vào
+    stage "write" và "lexical_write".
+    """
+
+    def __init__(self, collection, batch_size: int = DEFAULT_BATCH_SIZE, sinks: Optional[List] = None,
+                 on_flush: Optional[Callable[[], None]] = None, timings: Optional[StageTimings] = None,
+                 value_index: Optional[ValueIndex] = None):
+        if batch_size < 1:
+            raise ValueError("batch_size phải lớn hơn 0")
+        self.collection = collection
+        self.batch_size = batch_size
+        self.sinks = list(sinks or [])
+        self.on_flush = on_flush
+        self.timings = timings
+        self.value_index = value_index
+        self.documents: List[str] = []
+        self.metadatas: List[Dict] = []
+        self.ids: List[str] = []
+        self.embeddings: List[Optional[List[float]]] = []
+        self.delete_ids: List[str] = []
+        self.value_units: List[Tuple] = []
+        self.written = 0
+        self.deleted = 0
+        self._rebuilding = set()
+
+    def add(self, document: str, metadata: Dict, doc_id: str,
+            embedding: Optional[List[float]] = None) -> None:
+        """Thêm một document vào buffer, tự flush khi buffer đầy
+
+        Nếu có sẵn `embedding` (đã tính ở stage embed) thì Chroma không phải embed lại.
+        """
+        self.documents.append(document)
+        self.metadatas.append(metadata)
+        self.ids.append(doc_id)
+        self.embeddings.append(embedding)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+
+    def delete(self, ids: List[str]) -> None:
+        """Đánh dấu các id cần xóa khỏi Chroma ở lần flush tiếp theo"""
+        self.delete_ids.extend(ids)
+        if len(self.delete_ids) >= self.batch_size:
+            self.flush()
+
+    def remove_file(self, file_id: str, ids: List[str]) -> None:
+        """Xóa toàn bộ một file: các chunk `ids` và các giá trị của file trong value index"""
+        self.delete(ids)
+        self.flush()
+        if self.value_index is not None:
+            self.value_index.remove_file(file_id)
+
+    def set_values(self, file_id: str, file_name: Optional[str], sheet_id: str, tab_name: Optional[str],
+                   unit: str, values: List[Tuple]) -> None:
+        """Thay các giá trị số/ngày/boolean của vùng ô `unit` trong value index ở lần flush tiếp theo"""
+        self.value_units.append((file_id, file_name, sheet_id, tab_name, unit, values))
+        if len(self.value_units) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Ghi toàn bộ buffer vào Chroma. Dùng upsert nên id đã tồn tại sẽ bị ghi đè"""
+        changed = bool(self.delete_ids or self.ids or self.value_units)
+        started = time.perf_counter()
+        if self.delete_ids:
+            self.collection.delete(ids=self.delete_ids)
+        if self.ids:
+            # Chỉ truyền embeddings khi cả lô đã có sẵn, ngược lại để Chroma tự embed
+            embeddings = self.embeddings if all(e is not None for e in self.embeddings) else None
+            self.collection.upsert(
+                documents=self.documents,
+                metadatas=self.metadatas,
+                ids=self.ids,
+                embeddings=embeddings
+            )
+        written = time.perf_counter()
+        for sink in self.sinks:
+            if self.delete_ids:
+                sink.delete(self.delete_ids)
+            if self.ids:
+                sink.upsert(self.ids, self.documents, self.metadatas)
+        if self.value_units and self.value_index is not None:
+            self.value_index.replace(self.value_units)
+            REGISTRY.inc("indexer_values_total", sum(len(unit[-1]) for unit in self.value_units))
+        if changed and self.timings:
+            self.timings.add("write", written - started)
+            if self.sinks:
+                self.timings.add("lexical_write", time.perf_counter() - written)
+        self.deleted += len(self.delete_ids)
+        self.written += len(self.ids)
+        REGISTRY.inc("indexer_chunks_total", len(self.ids))
+        self.discard()
+        if changed and self.on_flush:
+            self.on_flush()
+
+    def begin_rebuild(self, file_id: str) -> None:
+        """File sắp được ghi lại toàn bộ; collection hỗ trợ (ShardedVectorStore) dựng nó trong shard mới"""
+        begin = getattr(self.collection, "begin_rebuild", None)
+        if begin is not None and begin(file_id):
+            self._rebuilding.add(file_id)
+
+    def commit_rebuild(self, file_id: str) -> None:
+        """Flush và cho truy vấn thấy bản vừa dựng lại của file"""
+        if file_id in self._rebuilding:
+            self.flush()
+            self._rebuilding.discard(file_id)
+            self.collection.commit_rebuild(file_id)
+
+    def abort_rebuild(self, file_id: str) -> None:
+        if file_id in self._rebuilding:
+            self._rebuilding.discard(file_id)
+            self.collection.abort_rebuild(file_id)
+
+    def discard(self) -> None:
+        """Bỏ các documents đang chờ trong buffer (khi sheet bị lỗi giữa chừng)"""
+        self.documents, self.metadatas, self.ids, self.embeddings = [], [], [], []
+        self.delete_ids = []
+        self.value_units = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Chỉ flush khi không có lỗi, tránh ghi dở dang một sheet bị lỗi
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+        return False
+
+
+# Số ô mỗi request khi đọc tab lớn theo cửa sổ hàng: 2000 hàng của một tab 26 cột (A:Z)
+STREAM_WINDOW_CELLS = 52000
+STREAM_MIN_WINDOW_ROWS = 100
+
+
+class SheetWindows:
+    """Giá trị của một tab lớn, được đọc dần theo cửa sổ hàng khi lặp qua
+
+    Mỗi cửa sổ là một request values:batchGet ('Tab'!A{đầu}:{cột cuối}{cuối}); cửa sổ tiếp
+    theo được tải trước trên một thread trong lúc cửa sổ hiện tại được xử lý, nên bộ nhớ
+    chỉ giữ tối đa hai cửa sổ bất kể số hàng của tab. Lặp qua nó sinh ra (chỉ số hàng, hàng);
+    `cells` là số ô không rỗng đã đọc.
+    """
+
+    def __init__(self, spreadsheet, title: str, row_count: int, col_count: int,
+                 limiter: Optional[TokenBucket] = None, window_cells: int = STREAM_WINDOW_CELLS):
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.row_count = row_count
+        self.col_count = max(1, col_count)
+        self.limiter = limiter
+        self.window_rows = max(STREAM_MIN_WINDOW_ROWS, window_cells // self.col_count)
+        self.cells = 0
+
+    def _read(self, start: int) -> List[List[str]]:
+        end = min(start + self.window_rows, self.row_count)
+        range_name = f"{quote_sheet_title(self.title)}!A{start + 1}:{column_letter(self.col_count - 1)}{end}"
+        response = call_with_retry(self.spreadsheet.values_batch_get, [range_name], limiter=self.limiter)
+        return response.get("valueRanges", [{}])[0].get("values", [])
+
+    def __iter__(self) -> Iterator[Tuple[int, List[str]]]:
+        self.cells = 0
+        starts = range(0, self.row_count, self.window_rows)
+        if not starts:
+            return
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            pending = executor.submit(self._read, starts[0])
+            for position, start in enumerate(starts):
+                rows = pending.result()
+                if position + 1 < len(starts):
+                    pending = executor.submit(self._read, starts[position + 1])
+                for offset, row in enumerate(rows):
+                    self.cells += sum(1 for value in row if value)
+                    yield start + offset, row
+                del rows
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+
+# (tên tab, sheet_id, toàn bộ giá trị của tab hoặc SheetWindows nếu tab được đọc theo cửa sổ)
+SheetValues = Tuple[str, Any, Union[List[List[str]], SheetWindows]]
+
+
+def fetch_spreadsheet(file_info: Dict, clientGS, limiter: Optional[TokenBucket] = None,
+                      stream: bool = False, window_cells: int = STREAM_WINDOW_CELLS) -> List[SheetValues]:
+    """Tải giá trị của tất cả các tab trong một spreadsheet
+
+    Giá trị của mọi tab được lấy trong một request values:batchGet, nên số request cho
+    mỗi file không phụ thuộc số tab. Mỗi request đi qua `limiter` (nếu có) và được thử
+    lại khi gặp lỗi 429/5xx.
+    Với `stream=True`, tab lớn hơn `window_cells` ô (theo row_count x col_count) không được
+    tải ở đây mà trả về một SheetWindows, đọc theo cửa sổ hàng khi được chia document.
+    """
+    file_id = file_info['id']
+
+    # Mở spreadsheet
+    spreadsheet = call_with_retry(clientGS.open_by_key, file_id, limiter=limiter)
+    sheets = call_with_retry(spreadsheet.worksheets, limiter=limiter)
+    logger.info("Tải spreadsheet %s (%s): %d tab", file_info['name'], file_id, len(sheets))
+
+    streamed = {
+        sheet.title for sheet in sheets
+        if stream and sheet.row_count * max(1, sheet.col_count) > window_cells
+    }
+    values = iter(batch_get_values(spreadsheet, [sheet.title for sheet in sheets if sheet.title not in streamed],
+                                   limiter=limiter))
+    sheets_values = []
+    for sheet in sheets:
+        if sheet.title in streamed:
+            logger.info("Tab %s (%s): %d hàng, đọc theo cửa sổ", sheet.title, sheet.id, sheet.row_count)
+            data = SheetWindows(spreadsheet, sheet.title, sheet.row_count, sheet.col_count, limiter, window_cells)
+        else:
+            data = next(values)
+            # Nội dung ô chỉ được ghi ở mức debug
+            logger.debug("Tab %s (%s): %r", sheet.title, sheet.id, data)
+        sheets_values.append((sheet.title, sheet.id, data))
+    return sheets_values
+
+
+def column_letter(col_index: int) -> str:
+    """Chuyển chỉ số cột (bắt đầu từ 0) thành tên cột: 0 -> A, 25 -> Z, 26 -> AA"""
+    letters = ""
+    col_index += 1
+    while col_index:
+        col_index, remainder = divmod(col_index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _render_row(cells: List[Tuple[int, str]], header: Optional[List[str]]) -> str:
+    """Ghép các ô của một hàng thành văn bản "tiêu đề: giá trị", mỗi ô một dòng"""
+    if header is None:
+        return "\n".join(value for _, value in cells)
+    lines = []
+    for col_index, value in cells:
+        name = header[col_index].strip() if col_index < len(header) else ""
+        lines.append(f"{name or column_letter(col_index)}: {value}")
+    return "\n".join(lines)
+
+
+def _split_values(row_index: int, cells: List[Tuple[int, str]],
+                  header: List[str]) -> Tuple[List[Tuple[int, str]], List[Tuple]]:
+    """Tách các ô số/ngày/boolean (classify_value) của một hàng khỏi các ô văn bản
+
+    Trả về (ô văn bản, giá trị) với mỗi giá trị là (cột, hàng, tiêu đề cột, loại, giá trị
+    dạng số, giá trị gốc). Hàng tiêu đề luôn được giữ nguyên là văn bản.
+    """
+    if row_index == 0:
+        return cells, []
+    text_cells, values = [], []
+    for col_index, value in cells:
+        classified = classify_value(value)
+        if classified is None:
+            text_cells.append((col_index, value))
+            continue
+        name = header[col_index].strip() if col_index < len(header) else ""
+        values.append((column_letter(col_index), row_index + 1, name, *classified, value))
+    return text_cells, values
+
+
+def iter_sheet_units(data: List[List[str]], granularity: str = DEFAULT_GRANULARITY,
+                     row_window: int = DEFAULT_ROW_WINDOW) -> Iterator[Tuple[str, str, Dict, List[Tuple]]]:
+    """Chia giá trị của một tab thành các document, trả về (vùng ô, nội dung, metadata vị trí, giá trị)
+
+    - "cell": mỗi ô không rỗng là một document (nội dung ô, không có tiêu đề)
+    - "row": mỗi hàng là một document, mỗi ô kèm tiêu đề cột lấy từ hàng đầu tiên
+    - "row_window": mỗi nhóm `row_window` hàng liên tiếp là một document
+
+    Các ô số, ngày tháng và boolean không nằm trong nội dung mà được trả về riêng trong
+    "giá trị" (xem _split_values) để ghi vào value_index; vùng ô chỉ có các ô đó có nội
+    dung rỗng. Metadata gồm hàng/cột đầu tiên ("row", "col"), vùng ô ("range", dùng cho
+    deep link) và danh sách cột có văn bản ("cols").
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity phải là một trong {GRANULARITIES}")
+
+    # Các hàng được xử lý lần lượt, không giữ cả tab: SheetWindows chỉ giữ vài cửa sổ hàng
+    indexed_rows = iter(data) if isinstance(data, SheetWindows) else enumerate(data)
+    rows = (
+        (row_index, [(col_index, value if isinstance(value, str) else str(value))
+                     for col_index, value in enumerate(row) if value], row)
+        for row_index, row in indexed_rows
+    )
+
+    # Hàng đầu tiên là tiêu đề; bản thân nó được index như một hàng không có tiêu đề
+    header: List[str] = []
+    if granularity == "cell":
+        for row_index, cells, row in rows:
+            if row_index == 0:
+                header = [str(value) for value in row]
+            values = {entry[0]: entry for entry in _split_values(row_index, cells, header)[1]}
+            for col_index, value in cells:
+                col = column_letter(col_index)
+                cell = f"{col}{row_index + 1}"
+                entry = values.get(col)
+                yield cell, "" if entry else value, {
+                    "col": col,
+                    "row": str(row_index + 1),
+                    "range": cell,
+                    "cols": "" if entry else col,
+                }, [entry] if entry else []
+        return
+
+    size = 1 if granularity == "row" else max(1, row_window)
+    group: List = []
+    for row_index, cells, row in rows:
+        if row_index == 0:
+            header = [str(value) for value in row]
+        if not cells:
+            continue
+        # Các hàng đến theo thứ tự: nhóm trước đã đủ khi gặp hàng của nhóm sau
+        if group and group[0][0] // size != row_index // size:
+            yield _group_unit(group, header)
+            group = []
+        group.append((row_index, cells, *_split_values(row_index, cells, header)))
+    if group:
+        yield _group_unit(group, header)
+
+
+def _group_unit(group: List[Tuple[int, List, List, List]], header: List[str]) -> Tuple[str, str, Dict, List[Tuple]]:
+    """Document của một nhóm hàng liên tiếp (xem iter_sheet_units)"""
+    # Vùng ô tính trên mọi ô (khóa trong manifest không đổi khi một ô đổi loại giá trị)
+    col_indexes = sorted({col_index for _, cells, _, _ in group for col_index, _ in cells})
+    text_col_indexes = sorted({col_index for _, _, text_cells, _ in group for col_index, _ in text_cells})
+    first_row, last_row = group[0][0] + 1, group[-1][0] + 1
+    first_col, last_col = column_letter(col_indexes[0]), column_letter(col_indexes[-1])
+    cell_range = f"{first_col}{first_row}:{last_col}{last_row}"
+    text = "\n\n".join(
+        _render_row(text_cells, None if row_index == 0 else header)
+        for row_index, _, text_cells, _ in group if text_cells
+    )
+    return cell_range, text, {
+        "col": first_col,
+        "row": str(first_row),
+        "range": cell_range,
+        "cols": ",".join(column_letter(col_index) for col_index in text_col_indexes),
+    }, [entry for _, _, _, values in group for entry in values]
+
+
+def index_config_signature(text_splitter, granularity: str = DEFAULT_GRANULARITY,
+                           row_window: int = DEFAULT_ROW_WINDOW, model_id: Optional[str] = None) -> str:
+    """Chữ ký của cấu hình index, lưu trong manifest để biết khi nào phải index lại file"""
+    config = {
+        "layout": INDEX_LAYOUT_VERSION,
+        "granularity": granularity,
+        "row_window": row_window if granularity == "row_window" else None,
+        "chunk_size": getattr(text_splitter, "_chunk_size", None),
+        "chunk_overlap": getattr(text_splitter, "_chunk_overlap", None),
+        "model": model_id,
+    }
+    # Chroma không ghi vào chữ ký để manifest cũ vẫn hợp lệ; đổi backend thì phải index lại
+    if VECTOR_STORE != "chroma":
+        config["store"] = VECTOR_STORE
+    if VECTOR_STORE == "sharded":
+        config["shard_buckets"] = VECTOR_STORE_SHARD_BUCKETS
+    return content_hash(json.dumps(config, sort_keys=True))
+
+
+def iter_spreadsheet_ops(file_info: Dict, sheets_values: List[SheetValues], text_splitter,
+                         previous: CellEntries, current: CellEntries,
+                         granularity: str = DEFAULT_GRANULARITY,
+                         row_window: int = DEFAULT_ROW_WINDOW) -> Iterator[Tuple]:
+    """Sinh các thao tác ghi cho một spreadsheet đã tải
+
+    Các thao tác gồm ("add", id, document, metadata), ("delete", ids),
+    ("values", sheet_id, tên tab, vùng ô, giá trị) thay các ô số/ngày/boolean của vùng ô
+    trong value_index (giá trị rỗng là xóa) và ("sheet_end", số ô không rỗng của tab).
+    Document được chia theo `granularity` (xem iter_sheet_units). Chỉ các vùng ô mới hoặc
+    khác hash trong `previous` mới được split; trạng thái mới của chúng được ghi vào `current`.
+    """
+    file_id = file_info['id']
+    file_name = file_info['name']
+
+    # Index từng sheet
+    for tab_name, sheet_id, data in sheets_values:
+        for cell, text, position, values in iter_sheet_units(data, granularity, row_window):
+            # Bỏ qua vùng ô không thay đổi so với lần index trước (hash gồm cả các giá trị tách riêng)
+            key = (str(sheet_id), cell)
+            cell_hash = content_hash(json.dumps([text, values], ensure_ascii=False) if values else text)
+            if key in previous and previous[key][0] == cell_hash:
+                current[key] = previous[key]
+                continue
+
+            sentences = text_splitter.split_text(text) if text else []
+            # Cờ cho từng cột có dữ liệu, để filter theo cột được đẩy xuống where của collection
+            flags = {column_flag(col): 1 for col in position["cols"].split(",") if col}
+
+            for i, sentence in enumerate(sentences):
+                yield (
+                    "add",
+                    chunk_id(file_id, sheet_id, cell, i),
+                    sentence,
+                    {
+                        "file_name": file_name,
+                        "file_id": file_id,
+                        "tab_name": tab_name,
+                        "sheet_id": str(sheet_id),
+                        **position,
+                        **flags,
+                    }
+                )
+
+            # Xóa các chunk thừa nếu vùng ô đã sửa giờ ngắn hơn
+            old_chunks = previous[key][1] if key in previous else 0
+            if old_chunks > len(sentences):
+                yield ("delete", [chunk_id(file_id, sheet_id, cell, i) for i in range(len(sentences), old_chunks)])
+            if values or key in previous:
+                yield ("values", str(sheet_id), tab_name, cell, values)
+            current[key] = (cell_hash, len(sentences))
+
+        cells = data.cells if isinstance(data, SheetWindows) else sum(1 for row in data for value in row if value)
+        yield ("sheet_end", cells)
+
+    # Xóa chunk và giá trị của các ô/tab không còn tồn tại
+    for (sheet_id, cell), (_, chunks) in previous.items():
+        if (sheet_id, cell) not in current:
+            if chunks:
+                yield ("delete", [chunk_id(file_id, sheet_id, cell, i) for i in range(chunks)])
+            yield ("values", sheet_id, None, cell, [])
+
+
+def index_spreadsheet(file_info: Dict, collection, text_splitter, clientGS,
+                      writer: Optional[ChromaBatchWriter] = None,
+                      batch_size: int = DEFAULT_BATCH_SIZE,
+                      manifest: Optional[IndexManifest] = None,
+                      folder_id: Optional[str] = None,
+                      sheets_values: Optional[List[SheetValues]] = None,
+                      granularity: str = DEFAULT_GRANULARITY,
+                      row_window: int = DEFAULT_ROW_WINDOW,
+                      snapshots: Optional[SnapshotStore] = None,
+                      stream: bool = False) -> None:
+    """Index một Google Spreadsheet vào Chroma DB
+
+    Nếu truyền `writer` thì documents được gom chung vào writer đó (dùng lại giữa
+    nhiều spreadsheet), ngược lại tạo writer riêng với `batch_size`.
+    Nếu truyền `manifest` thì chỉ các ô mới hoặc đã sửa được split và embed, id của
+    các ô đã bị xóa được xóa khỏi Chroma, và manifest được cập nhật sau khi flush.
+    Nếu đã có sẵn `sheets_values` (từ fetch_spreadsheet) thì không gọi lại Google API.
+    `granularity` và `row_window` quyết định cách chia tab thành documents (xem iter_sheet_units).
+    Nếu truyền `snapshots` thì giá trị thô vừa tải được lưu lại để rebuild không cần mạng.
+    Với `stream=True` (và không có `snapshots`, vốn cần cả tab), tab lớn được đọc theo cửa sổ
+    hàng trong lúc chia document (xem SheetWindows).
+    """
+    if writer is None:
+        writer = ChromaBatchWriter(collection, batch_size=batch_size,
+                                   sinks=[get_lexical_index(), get_facet_index()], on_flush=bump_generation,
+                                   value_index=get_value_index())
+
+    if sheets_values is None:
+        sheets_values = fetch_spreadsheet(file_info, clientGS, stream=stream and not snapshots)
+        if snapshots:
+            snapshots.save(file_info, folder_id, sheets_values)
+
+    # Trạng thái các ô của lần index trước (rỗng nếu không dùng manifest)
+    previous: CellEntries = manifest.cell_entries(file_info['id']) if manifest else {}
+    current: CellEntries = {}
+    if is_full_rewrite(previous):
+        writer.begin_rebuild(file_info['id'])
+
+    try:
+        # Gom documents vào buffer, writer sẽ ghi vào Chroma theo lô
+        for op in iter_spreadsheet_ops(file_info, sheets_values, text_splitter, previous, current,
+                                       granularity, row_window):
+            if op[0] == "add":
+                _, doc_id, document, metadata = op
+                writer.add(document, metadata, doc_id)
+            elif op[0] == "delete":
+                writer.delete(op[1])
+            elif op[0] == "values":
+                writer.set_values(file_info['id'], file_info['name'], *op[1:])
+            else:
+                # Flush tại ranh giới sheet
+                writer.flush()
+
+        writer.flush()
+    except Exception:
+        writer.abort_rebuild(file_info['id'])
+        raise
+    writer.commit_rebuild(file_info['id'])
+    if manifest:
+        manifest.update_file(file_info, folder_id, current)
+
+def handle_new_file(file_info: Dict, credentials_path: str, client: Optional["gspread.Client"] = None,
+                    granularity: str = DEFAULT_GRANULARITY, row_window: int = DEFAULT_ROW_WINDOW,
+                    snapshot: bool = False, skip_unchanged: bool = False, stream: bool = False) -> Dict:
+    """Xử lý file mới được thêm vào folder hoặc vừa được sửa (lưu snapshot giá trị thô nếu `snapshot=True`)
+
+    Chỉ các ô đã đổi được index lại. Với `skip_unchanged=True`, file có modifiedTime và cấu
+    hình trùng lần index trước được bỏ qua mà không tải (thay đổi trên Drive không phải nội
+    dung, ví dụ đổi quyền chia sẻ). `stream` giống như ở index_spreadsheet.
+    """
+    text_splitter = make_text_splitter()
     
     try:
-        index_spreadsheet(file_info, collection, text_splitter)
+        clientGs = client or get_client(credentials_path)
+        model_id = get_embedding_function().model_id
+        manifest = IndexManifest(config=index_config_signature(text_splitter, granularity, row_window, model_id))
+        snapshots = SnapshotStore() if snapshot else None
+        try:
+            if skip_unchanged and manifest.is_unchanged(file_info):
+                return {
+                    "success": True,
+                    "skipped": True,
+                    "message": f"File {file_info['name']} không thay đổi"
+                }
+            index_spreadsheet(file_info, get_collection(), text_splitter, clientGs, manifest=manifest,
+                              folder_id=file_info.get("folder_id"), granularity=granularity,
+                              row_window=row_window, snapshots=snapshots, stream=stream)
+        finally:
+            manifest.close()
+            if snapshots:
+                snapshots.close()
         return {
             "success": True,
             "message": f"Đã index thành công file {file_info['name']}"
@@ -77,49 +580,181 @@ def handle_new_file(file_info: Dict) -> Dict:
             "message": f"Lỗi khi index file {file_info['name']}: {str(e)}"
         }
 
-def get_spreadsheets_in_folder(folder_id: str, credentials_path: str) -> Tuple[List[Dict], gspread.Client]:
+def handle_removed_file(file_id: str, snapshot: bool = False) -> Dict:
+    """Xóa các document của một file đã bị xóa hoặc chuyển khỏi folder (cùng snapshot nếu `snapshot=True`)"""
+    try:
+        manifest = IndexManifest()
+        try:
+            ids = manifest.chunk_ids(file_id)
+            writer = ChromaBatchWriter(get_collection(), sinks=[get_lexical_index(), get_facet_index()],
+                                       on_flush=bump_generation, value_index=get_value_index())
+            writer.remove_file(file_id, ids)
+            manifest.remove_file(file_id)
+        finally:
+            manifest.close()
+        if snapshot:
+            snapshots = SnapshotStore()
+            snapshots.remove(file_id)
+            snapshots.close()
+        return {
+            "success": True,
+            "deleted": len(ids),
+            "message": f"Đã xóa {len(ids)} document của file {file_id}"
+        }
+    except Exception as e:
+        return {
+            "success": False,
+            "message": f"Lỗi khi xóa file {file_id}: {str(e)}"
+        }
+
+def get_spreadsheets_in_folder(folder_id: str, credentials_path: str,
+                               client: Optional["gspread.Client"] = None) -> Tuple[List[Dict], "gspread.Client"]:
     """Lấy tất cả các Google Spreadsheets trong một folder"""
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, scope)
-    client = gspread.authorize(creds)
+    if client is None:
+        client = get_client(credentials_path)
     
     # Lấy danh sách tất cả các file
-    file_list = client.list_spreadsheet_files(folder_id=folder_id)
-    print('file_list:', file_list)
+    file_list = call_with_retry(client.list_spreadsheet_files, folder_id=folder_id)
+    logger.info("Folder %s có %d spreadsheet", folder_id, len(file_list))
 
     return file_list, client
 
-def index_folder(folder_id: str, credentials_path: str) -> Dict:
-    """Index tất cả các Google Spreadsheets trong một folder"""
-    # Create a concrete text splitter instance
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        length_function=len,
-    )
+def _cache_delta(before: Dict, after: Dict) -> Dict:
+    """Thống kê cache embedding của một lần chạy"""
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+    }
+
+def index_folder(folder_id: str, credentials_path: str, batch_size: int = DEFAULT_BATCH_SIZE,
+                 incremental: bool = True, workers: int = 1,
+                 reads_per_minute: float = DEFAULT_READS_PER_MINUTE,
+                 client: Optional["gspread.Client"] = None,
+                 on_progress: Optional[Callable[[Dict], None]] = None,
+                 granularity: str = DEFAULT_GRANULARITY,
+                 row_window: int = DEFAULT_ROW_WINDOW,
+                 snapshot: bool = False,
+                 embed_workers: Optional[int] = None,
+                 stream: bool = False) -> Dict:
+    """Index tất cả các Google Spreadsheets trong một folder
+
+    Với `incremental=True`, file không đổi modifiedTime được bỏ qua, file đã sửa chỉ
+    index lại các ô thay đổi và file đã bị xóa khỏi folder được xóa khỏi Chroma.
+    Việc index chạy qua IndexingPipeline: `workers` spreadsheet được tải song song
+    (tổng số request đọc được giữ dưới `reads_per_minute`), split và embed chạy trên
+    các stage riêng, còn ghi vào Chroma và `on_progress` chạy trên thread gọi hàm.
+    Có thể truyền sẵn `client` (ví dụ FakeClient) thay cho việc xác thực bằng credentials.
+    `granularity` quyết định mỗi document là một ô, một hàng hay `row_window` hàng; đổi
+    cấu hình này (hoặc tham số chunk) sẽ index lại toàn bộ các file ở lần chạy sau.
+    Thời gian của từng stage (list, fetch, split, embed, write...) được trả về trong
+    `details["timings"]` và ghi vào metrics.REGISTRY.
+    Với `snapshot=True`, giá trị thô của mỗi file vừa tải được lưu vào SnapshotStore để
+    sau này rebuild_from_snapshots chia và embed lại mà không gọi Google API.
+    Với `embed_workers` > 0 (mặc định EMBED_WORKERS), chunk được embed bởi EmbeddingPool
+    trên từng ấy process, mỗi process giữ một lô; việc ghi vẫn chạy trong process này.
+    Với `stream=True` và `snapshot=False`, tab lớn được đọc theo cửa sổ hàng trong stage
+    chunk thay vì tải cả tab ở stage fetch, nên bộ nhớ không tăng theo số hàng của tab.
+    """
+    text_splitter = make_text_splitter()
+    timings = StageTimings()
     
     try:
         # Lấy tất cả các spreadsheets trong folder
-        spreadsheets, clientGs = get_spreadsheets_in_folder(folder_id, credentials_path)
+        with timings.time("list"):
+            spreadsheets, clientGs = get_spreadsheets_in_folder(folder_id, credentials_path, client=client)
         
         results = {
             "total": len(spreadsheets),
             "successful": 0,
             "failed": 0,
+            "skipped": 0,
             "errors": []
         }
         
-        # Index từng spreadsheet
+        collection = get_collection()
+        embed_workers = EMBED_WORKERS if embed_workers is None else embed_workers
+        default_ef = get_indexing_embedding_function(embed_workers)
+        lexical_index = get_lexical_index()
+        facet_index = get_facet_index()
+        cache_before = default_ef.stats()
+
+        # Dựng lại BM25 và facet nếu collection đã có dữ liệu từ trước khi có các index đó
+        lexical_index.sync_with(collection)
+        facet_index.sync_with(collection)
+
+        # Writer dùng chung cho cả folder, gom documents giữa các sheet/spreadsheet
+        writer = ChromaBatchWriter(collection, batch_size=batch_size, sinks=[lexical_index, facet_index],
+                                   on_flush=bump_generation, value_index=get_value_index(),
+                                   timings=timings)
+        config = index_config_signature(text_splitter, granularity, row_window, default_ef.model_id)
+        manifest = IndexManifest(config=config) if incremental else None
+        snapshots = SnapshotStore() if snapshot else None
+
+        limiter = TokenBucket(reads_per_minute)
+
+        to_index = []
         for spreadsheet in spreadsheets:
-            try:
-                index_spreadsheet(spreadsheet, collection, text_splitter, clientGs)
+            if manifest and manifest.is_unchanged(spreadsheet):
                 results["successful"] += 1
-            except Exception as e:
-                results["failed"] += 1
-                results["errors"].append({
-                    "file_name": spreadsheet.get("name", "Unknown"),
-                    "error": str(e)
-                })
+                results["skipped"] += 1
+            else:
+                to_index.append(spreadsheet)
+
+        def report_progress(event: Dict) -> None:
+            event["files_skipped"] = results["skipped"]
+            on_progress(event)
+
+        def fetch(file_info: Dict) -> List[SheetValues]:
+            with timings.time("fetch"):
+                sheets_values = fetch_spreadsheet(file_info, clientGs, limiter, stream=stream and not snapshots)
+            if snapshots:
+                with timings.time("snapshot"):
+                    snapshots.save(file_info, folder_id, sheets_values)
+            return sheets_values
+
+        # Fetch -> chunk -> embed -> write, các stage chạy chồng lên nhau
+        pipeline = IndexingPipeline(
+            fetch=fetch,
+            plan=lambda file_info, sheets_values, previous, current: iter_spreadsheet_ops(
+                file_info, sheets_values, text_splitter, previous, current, granularity, row_window),
+            writer=writer,
+            embedding_function=default_ef,
+            manifest=manifest,
+            folder_id=folder_id,
+            workers=workers,
+            batch_size=batch_size,
+            on_progress=report_progress if on_progress else None,
+            timings=timings,
+            embed_concurrency=max(1, embed_workers),
+        )
+        pipeline_results = pipeline.run(to_index)
+        results["successful"] += pipeline_results["successful"]
+        results["failed"] += pipeline_results["failed"]
+        results["errors"].extend(pipeline_results["errors"])
+        REGISTRY.inc("indexer_files_total", pipeline_results["successful"], result="indexed")
+        REGISTRY.inc("indexer_files_total", pipeline_results["failed"], result="failed")
+        REGISTRY.inc("indexer_files_total", results["skipped"], result="skipped")
+
+        if manifest:
+            # Xóa các file đã bị xóa khỏi folder
+            listed_ids = {spreadsheet["id"] for spreadsheet in spreadsheets}
+            for file_id in manifest.files_in_folder(folder_id):
+                if file_id not in listed_ids:
+                    writer.remove_file(file_id, manifest.chunk_ids(file_id))
+                    manifest.remove_file(file_id)
+                    if snapshots:
+                        snapshots.remove(file_id)
+            manifest.close()
+        if snapshots:
+            snapshots.close()
+
+        results["documents"] = writer.written
+        results["deleted"] = writer.deleted
+        results["embedding_cache"] = _cache_delta(cache_before, default_ef.stats())
+        results["timings"] = timings.summary()
         
         return {
             "success": True,
@@ -127,7 +762,145 @@ def index_folder(folder_id: str, credentials_path: str) -> Dict:
             "details": results
         }
     except Exception as e:
+        logger.exception("Lỗi khi index folder %s", folder_id)
         return {
             "success": False,
             "message": f"Lỗi khi index folder: {str(e)}"
-        }
\ No newline at end of file
+        }
+
+def rebuild_from_snapshots(folder_id: Optional[str] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                           granularity: str = DEFAULT_GRANULARITY, row_window: int = DEFAULT_ROW_WINDOW,
+                           on_progress: Optional[Callable[[Dict], None]] = None,
+                           embed_workers: Optional[int] = None) -> Dict:
+    """Chia và embed lại các file từ snapshot giá trị thô, không gọi Google API
+
+    Dùng sau khi đổi tham số chunk, `granularity` hoặc model embedding: manifest thấy cấu
+    hình mới nên mọi vùng ô được chia lại và id cũ bị xóa; nội dung không đổi được lấy từ
+    cache embedding. Chỉ các file có snapshot (index với `snapshot=True`) được rebuild,
+    lọc theo `folder_id` nếu có. `embed_workers` giống như ở index_folder.
+    """
+    text_splitter = make_text_splitter()
+    timings = StageTimings()
+
+    try:
+        snapshots = SnapshotStore()
+        files = snapshots.files(folder_id)
+        results = {"total": len(files), "successful": 0, "failed": 0, "skipped": 0, "errors": []}
+
+        collection = get_collection()
+        embed_workers = EMBED_WORKERS if embed_workers is None else embed_workers
+        default_ef = get_indexing_embedding_function(embed_workers)
+        lexical_index = get_lexical_index()
+        facet_index = get_facet_index()
+        cache_before = default_ef.stats()
+        lexical_index.sync_with(collection)
+        facet_index.sync_with(collection)
+
+        writer = ChromaBatchWriter(collection, batch_size=batch_size, sinks=[lexical_index, facet_index],
+                                   on_flush=bump_generation, value_index=get_value_index(),
+                                   timings=timings)
+        manifest = IndexManifest(config=index_config_signature(text_splitter, granularity, row_window,
+                                                               default_ef.model_id))
+
+        def fetch(file_info: Dict) -> List[SheetValues]:
+            with timings.time("snapshot_load"):
+                return snapshots.load(file_info["id"])
+
+        def report_progress(event: Dict) -> None:
+            event["files_skipped"] = 0
+            on_progress(event)
+
+        # Đọc snapshot rất nhanh nên một worker là đủ, thời gian bị chặn bởi embed
+        pipeline = IndexingPipeline(
+            fetch=fetch,
+            plan=lambda file_info, sheets_values, previous, current: iter_spreadsheet_ops(
+                file_info, sheets_values, text_splitter, previous, current, granularity, row_window),
+            writer=writer,
+            embedding_function=default_ef,
+            manifest=manifest,
+            workers=1,
+            batch_size=batch_size,
+            on_progress=report_progress if on_progress else None,
+            timings=timings,
+            embed_concurrency=max(1, embed_workers),
+        )
+        pipeline_results = pipeline.run(files)
+        manifest.close()
+        snapshots.close()
+
+        results["successful"] = pipeline_results["successful"]
+        results["failed"] = pipeline_results["failed"]
+        results["errors"] = pipeline_results["errors"]
+        results["documents"] = writer.written
+        results["deleted"] = writer.deleted
+        results["embedding_cache"] = _cache_delta(cache_before, default_ef.stats())
+        results["timings"] = timings.summary()
+        return {
+            "success": True,
+            "message": f"Đã rebuild {results['successful']}/{results['total']} files từ snapshot",
+            "details": results
+        }
+    except Exception as e:
+        logger.exception("Lỗi khi rebuild từ snapshot")
+        return {
+            "success": False,
+            "message": f"Lỗi khi rebuild từ snapshot: {str(e)}"
+        }
+
+
+def main() -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Các lệnh bảo trì index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild", help="Chia và embed lại từ snapshot, không gọi Google API")
+    rebuild.add_argument("--folder-id", help="Chỉ rebuild các file thuộc folder này")
+    rebuild.add_argument("--granularity", choices=GRANULARITIES, default=DEFAULT_GRANULARITY)
+    rebuild.add_argument("--row-window", type=int, default=DEFAULT_ROW_WINDOW)
+    rebuild.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    rebuild.add_argument("--embed-workers", type=int, default=EMBED_WORKERS,
+                         help="Số process embed (0: embed trong process này)")
+    export = commands.add_parser("export", help="Xuất index (embedding, document, manifest) ra file snapshot")
+    export.add_argument("path")
+    load = commands.add_parser("import", help="Nạp index từ file snapshot, không gọi Google API và không embed")
+    load.add_argument("path")
+    load.add_argument("--replace", action="store_true", help="Ghi đè index đang có dữ liệu")
+    load.add_argument("--no-verify", dest="verify", action="store_false", help="Bỏ qua kiểm tra sha256")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    if args.command in ("export", "import"):
+        import index_snapshot
+
+        if args.command == "export":
+            result = index_snapshot.export_index(args.path)
+        else:
+            result = index_snapshot.import_index(
+                args.path, replace=args.replace, verify=args.verify,
+                on_progress=lambda event: logger.info("%d/%d documents đã nạp", event["documents"], event["total"]))
+        print(result["message"])
+        if result.get("details"):
+            print(json.dumps(result["details"], ensure_ascii=False, indent=2))
+        return 0 if result["success"] else 1
+
+    def show_progress(event: Dict) -> None:
+        stages = event["stages"]
+        logger.info("%d/%d files, %d chunks đã embed, %d chunks đã ghi", event["files_done"], event["files_total"],
+                    stages["embed"]["chunks"], stages["write"]["chunks"])
+
+    result = rebuild_from_snapshots(args.folder_id, batch_size=args.batch_size, granularity=args.granularity,
+                                    row_window=args.row_window, on_progress=show_progress,
+                                    embed_workers=args.embed_workers)
+    print(result["message"])
+    details = result.get("details")
+    if details:
+        print(json.dumps({key: details[key] for key in ("documents", "deleted", "embedding_cache", "errors")},
+                         ensure_ascii=False, indent=2))
+    return 0 if result["success"] and not details["failed"] else 1
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
@@ -0,0 +1,383 @@
+"""Daemon giữ index luôn mới theo change feed của Google Drive
+
+Chạy:
+
+    python indexer_daemon.py --folder-id <folder_id>
+
+Daemon đọc các thay đổi qua một ChangeSource (mặc định DriveChangeSource, dùng được với
+fake_gspread.FakeClient để thử không cần Google), gom các lần sửa liên tiếp của cùng một
+spreadsheet (debounce) rồi index lại từng file theo hàng đợi ưu tiên: file vừa sửa và
+file nhỏ trước. Cursor của change feed và các file đang chờ được lưu vào file trạng thái,
+nên khởi động lại chỉ đọc tiếp các thay đổi chưa xử lý thay vì quét lại cả folder.
+"""
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from index_manifest import IndexManifest
+from indexer import (DEFAULT_GRANULARITY, DEFAULT_ROW_WINDOW, handle_new_file, handle_removed_file,
+                     index_folder)
+from metrics import REGISTRY
+from sheets_api import TokenBucket, call_with_retry, get_client
+
+logger = logging.getLogger(__name__)
+
+# Cursor của change feed và các file đang chờ index, nằm cạnh thư mục ./chroma_db
+DAEMON_STATE_PATH = "./indexer_daemon_state.json"
+
+DEFAULT_POLL_INTERVAL = 30.0
+
+# File được index khi đã không có thay đổi mới trong DEBOUNCE_SECONDS giây; file bị sửa
+# liên tục vẫn được index sau MAX_DEBOUNCE_SECONDS giây kể từ thay đổi đầu tiên
+DEBOUNCE_SECONDS = 60.0
+MAX_DEBOUNCE_SECONDS = 300.0
+
+# Khi xếp hàng, mỗi chunk của lần index trước tính như lần sửa cũ hơn chừng này giây
+# (1000 chunk ~ 1 phút), để file nhỏ được index trước file lớn sửa cùng lúc
+SIZE_PENALTY_SECONDS_PER_CHUNK = 0.06
+
+# Index lỗi thì thử lại sau một lần debounce, tối đa chừng này lần
+MAX_ATTEMPTS = 5
+
+DRIVE_CHANGES_URL = "https://www.googleapis.com/drive/v3/changes"
+SPREADSHEET_MIME_TYPE = "application/vnd.google-apps.spreadsheet"
+_CHANGE_FIELDS = "nextPageToken,newStartPageToken,changes(fileId,removed,time,file(id,name,mimeType,modifiedTime,parents,trashed))"
+
+
+class ChangeSource(ABC):
+    """Nguồn thay đổi của daemon
+
+    Mỗi thay đổi là dict {"id", "name", "modifiedTime", "folder_id", "removed"}; removed là
+    True khi file bị xóa, vào thùng rác hoặc không còn nằm trong folder.
+    """
+
+    @abstractmethod
+    def start_cursor(self) -> str:
+        """Cursor trỏ vào thời điểm hiện tại của change feed"""
+
+    @abstractmethod
+    def changes(self, cursor: str) -> Tuple[List[Dict], str]:
+        """Các thay đổi kể từ `cursor` và cursor mới"""
+
+
+def normalize_change(change: Dict, folder_id: str) -> Optional[Dict]:
+    """Chuyển một phần tử của changes.list thành thay đổi của daemon; None nếu không phải spreadsheet"""
+    file = change.get("file") or {}
+    if file and file.get("mimeType") != SPREADSHEET_MIME_TYPE:
+        return None
+    removed = change.get("removed") or file.get("trashed") or folder_id not in file.get("parents", [])
+    return {
+        "id": change["fileId"],
+        "name": file.get("name", change["fileId"]),
+        "modifiedTime": file.get("modifiedTime") or change.get("time"),
+        "folder_id": folder_id,
+        "removed": bool(removed),
+    }
+
+
+class DriveChangeSource(ChangeSource):
+    """Change feed của Drive API v3 (changes.getStartPageToken, changes.list) cho một folder
+
+    Có thể truyền sẵn `client` (ví dụ FakeClient) thay cho việc xác thực bằng credentials.
+    """
+
+    def __init__(self, folder_id: str, credentials_path: Optional[str] = None, client=None,
+                 limiter: Optional[TokenBucket] = None, page_size: int = 1000):
+        self.folder_id = folder_id
+        self.client = client or get_client(credentials_path)
+        self.limiter = limiter
+        self.page_size = page_size
+
+    def _get(self, endpoint: str, params: Dict) -> Dict:
+        return call_with_retry(self.client.request, "get", endpoint, params=params, limiter=self.limiter).json()
+
+    def start_cursor(self) -> str:
+        return self._get(f"{DRIVE_CHANGES_URL}/startPageToken", {"supportsAllDrives": True})["startPageToken"]
+
+    def changes(self, cursor: str) -> Tuple[List[Dict], str]:
+        result = []
+        while True:
+            payload = self._get(DRIVE_CHANGES_URL, {
+                "pageToken": cursor,
+                "pageSize": self.page_size,
+                "includeRemoved": True,
+                "supportsAllDrives": True,
+                "includeItemsFromAllDrives": True,
+                "fields": _CHANGE_FIELDS,
+            })
+            for change in payload.get("changes", []):
+                normalized = normalize_change(change, self.folder_id)
+                if normalized is not None:
+                    result.append(normalized)
+            if "newStartPageToken" in payload:
+                return result, payload["newStartPageToken"]
+            cursor = payload["nextPageToken"]
+
+
+def _timestamp(modified_time: Optional[str], default: float) -> float:
+    if not modified_time:
+        return default
+    try:
+        return datetime.fromisoformat(modified_time.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return default
+
+
+class IndexerDaemon:
+    """Index lại các spreadsheet của một folder khi chúng thay đổi
+
+    Mỗi file đang chờ là một entry trong `state["pending"]`, được đưa vào hàng đợi ưu tiên
+    khi hết thời gian debounce. File bị xóa hoặc chuyển khỏi folder được xóa khỏi index.
+    Lần chạy đầu (chưa có cursor) lấy cursor rồi chạy index_folder tăng dần một lần nếu
+    `initial_sync=True`, để các thay đổi trước khi daemon chạy không bị bỏ sót.
+
+    Args:
+        source: ChangeSource của folder
+        client: gspread client dùng để tải spreadsheet (ví dụ FakeClient)
+        clock: Hàm trả về thời gian hiện tại (giây), thay được khi thử
+    """
+
+    def __init__(self, source: ChangeSource, folder_id: str, credentials_path: Optional[str] = None,
+                 client=None, state_path: str = DAEMON_STATE_PATH,
+                 poll_interval: float = DEFAULT_POLL_INTERVAL, debounce: float = DEBOUNCE_SECONDS,
+                 max_debounce: float = MAX_DEBOUNCE_SECONDS, granularity: str = DEFAULT_GRANULARITY,
+                 row_window: int = DEFAULT_ROW_WINDOW, snapshot: bool = False, stream: bool = False,
+                 initial_sync: bool = True, clock: Callable[[], float] = time.time):
+        self.source = source
+        self.folder_id = folder_id
+        self.credentials_path = credentials_path
+        self.client = client
+        self.state_path = state_path
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_debounce = max_debounce
+        self.granularity = granularity
+        self.row_window = row_window
+        self.snapshot = snapshot
+        self.stream = stream
+        self.initial_sync = initial_sync
+        self._clock = clock
+        self._stop = threading.Event()
+        # (độ ưu tiên, thứ tự, file_id, version); entry cũ hơn version hiện tại bị bỏ qua khi lấy ra
+        self._queue: List[Tuple[float, int, str, int]] = []
+        self._sequence = 0
+        self.state = self._load_state()
+        # Entry đã xếp hàng trước khi dừng được debounce lại
+        for entry in self.state["pending"].values():
+            entry["scheduled"] = False
+
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {"folder_id": self.folder_id, "cursor": None, "pending": {}}
+        if state.get("folder_id") != self.folder_id:
+            raise ValueError(f"{self.state_path} là trạng thái của folder {state.get('folder_id')}")
+        return state
+
+    def _save_state(self) -> None:
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        # Ghi file tạm rồi đổi tên để dừng giữa chừng không làm hỏng trạng thái
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def cursor(self) -> Optional[str]:
+        return self.state["cursor"]
+
+    @property
+    def pending(self) -> Dict[str, Dict]:
+        return self.state["pending"]
+
+    def add_change(self, change: Dict, now: Optional[float] = None) -> None:
+        """Ghi nhận một thay đổi; các thay đổi liên tiếp của cùng file được gộp lại"""
+        now = self._clock() if now is None else now
+        entry = self.pending.get(change["id"])
+        if entry is None:
+            entry = self.pending[change["id"]] = {"first_seen": now, "version": 0, "attempts": 0}
+        entry.update(change)
+        entry["last_seen"] = now
+        entry["version"] += 1
+        entry["scheduled"] = False
+
+    def poll(self) -> int:
+        """Đọc các thay đổi mới từ source, trả về số thay đổi"""
+        if self.cursor is None:
+            # Lấy cursor trước khi quét để các thay đổi trong lúc quét vẫn được đọc lại
+            cursor = self.source.start_cursor()
+            if self.initial_sync:
+                logger.info("Chưa có cursor, index tăng dần folder %s một lần", self.folder_id)
+                result = index_folder(self.folder_id, self.credentials_path, client=self.client,
+                                      granularity=self.granularity, row_window=self.row_window,
+                                      snapshot=self.snapshot, stream=self.stream)
+                if not result["success"]:
+                    raise RuntimeError(result["message"])
+            self.state["cursor"] = cursor
+            self._save_state()
+        changes, cursor = self.source.changes(self.cursor)
+        now = self._clock()
+        for change in changes:
+            self.add_change(change, now)
+        self.state["cursor"] = cursor
+        self._save_state()
+        REGISTRY.inc("indexer_daemon_changes_total", len(changes))
+        return len(changes)
+
+    def _due_at(self, entry: Dict) -> float:
+        return min(entry["last_seen"] + self.debounce, entry["first_seen"] + self.max_debounce)
+
+    def _priority(self, entry: Dict, manifest: IndexManifest) -> float:
+        """Nhỏ hơn thì index trước: xóa file trước, rồi file sửa gần nhất và nhỏ nhất"""
+        if entry["removed"]:
+            return float("-inf")
+        edited = _timestamp(entry.get("modifiedTime"), entry["last_seen"])
+        return -edited + manifest.chunk_count(entry["id"]) * SIZE_PENALTY_SECONDS_PER_CHUNK
+
+    def schedule(self, now: Optional[float] = None) -> int:
+        """Đưa các file đã hết thời gian debounce vào hàng đợi, trả về số file vừa thêm"""
+        now = self._clock() if now is None else now
+        due = [entry for entry in self.pending.values() if not entry["scheduled"] and self._due_at(entry) <= now]
+        if not due:
+            return 0
+        manifest = IndexManifest()
+        try:
+            for entry in due:
+                entry["scheduled"] = True
+                self._sequence += 1
+                heapq.heappush(self._queue, (self._priority(entry, manifest), self._sequence,
+                                             entry["id"], entry["version"]))
+        finally:
+            manifest.close()
+        return len(due)
+
+    def _process(self, entry: Dict) -> Dict:
+        if entry["removed"]:
+            manifest = IndexManifest()
+            try:
+                indexed_here = entry["id"] in manifest.files_in_folder(self.folder_id)
+            finally:
+                manifest.close()
+            if not indexed_here:
+                # File ngoài folder (hoặc chưa từng index) không có gì để xóa
+                return {"success": True, "skipped": True, "message": f"Bỏ qua file {entry['id']}"}
+            return handle_removed_file(entry["id"], snapshot=self.snapshot)
+        file_info = {key: entry[key] for key in ("id", "name", "modifiedTime", "folder_id")}
+        return handle_new_file(file_info, self.credentials_path, client=self.client, granularity=self.granularity,
+                               row_window=self.row_window, snapshot=self.snapshot, skip_unchanged=True,
+                               stream=self.stream)
+
+    def process_next(self) -> Optional[Dict]:
+        """Index file đầu hàng đợi; None nếu hàng đợi rỗng"""
+        while self._queue:
+            _, _, file_id, version = heapq.heappop(self._queue)
+            entry = self.pending.get(file_id)
+            if entry is None or entry["version"] != version or not entry["scheduled"]:
+                # File có thay đổi mới sau khi xếp hàng: đang được debounce lại
+                continue
+            result = self._process(entry)
+            now = self._clock()
+            if result["success"]:
+                del self.pending[file_id]
+                outcome = "skipped" if result.get("skipped") else ("removed" if entry["removed"] else "indexed")
+                REGISTRY.observe("indexer_daemon_lag_seconds", max(0.0, now - entry["first_seen"]))
+            else:
+                entry["attempts"] += 1
+                if entry["attempts"] >= MAX_ATTEMPTS:
+                    logger.error("Bỏ file %s sau %d lần lỗi: %s", file_id, entry["attempts"], result["message"])
+                    del self.pending[file_id]
+                else:
+                    # Thử lại sau một lần debounce
+                    entry["scheduled"] = False
+                    entry["last_seen"] = now
+                outcome = "failed"
+            REGISTRY.inc("indexer_daemon_files_total", result=outcome)
+            logger.info("%s", result["message"])
+            self._save_state()
+            return {"file_id": file_id, "result": outcome, "message": result["message"]}
+        return None
+
+    def run_pending(self, now: Optional[float] = None) -> List[Dict]:
+        """Xếp hàng và index mọi file đã hết thời gian debounce"""
+        self.schedule(now)
+        processed = []
+        while True:
+            result = self.process_next()
+            if result is None:
+                return processed
+            processed.append(result)
+
+    def _next_due(self) -> float:
+        waiting = [self._due_at(entry) for entry in self.pending.values() if not entry["scheduled"]]
+        return min(waiting, default=float("inf"))
+
+    def run(self) -> None:
+        """Chạy tới khi stop(): đọc thay đổi mỗi `poll_interval` giây, giữa các lần đọc thì index"""
+        next_poll = 0.0
+        while not self._stop.is_set():
+            if self._clock() >= next_poll:
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Lỗi khi đọc change feed")
+                next_poll = self._clock() + self.poll_interval
+            self.schedule()
+            if self.process_next() is not None:
+                continue
+            self._stop.wait(max(0.05, min(next_poll, self._next_due()) - self._clock()))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def main() -> int:
+    import argparse
+
+    from dotenv import load_dotenv
+
+    from indexer import GRANULARITIES
+    from resources import get_metrics_server
+
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--folder-id", required=True)
+    parser.add_argument("--credentials", default=os.getenv("GOOGLE_CREDENTIALS_PATH", "./secret/credentials.json"))
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL)
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS)
+    parser.add_argument("--max-debounce", type=float, default=MAX_DEBOUNCE_SECONDS)
+    parser.add_argument("--granularity", choices=GRANULARITIES, default=DEFAULT_GRANULARITY)
+    parser.add_argument("--row-window", type=int, default=DEFAULT_ROW_WINDOW)
+    parser.add_argument("--snapshot", action="store_true", help="Lưu snapshot giá trị thô của các file vừa tải")
+    parser.add_argument("--stream", action="store_true",
+                        help="Đọc tab lớn theo cửa sổ hàng (không dùng cùng --snapshot)")
+    parser.add_argument("--no-initial-sync", action="store_true",
+                        help="Lần chạy đầu chỉ lấy cursor, không index tăng dần cả folder")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                        format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    get_metrics_server()
+    client = get_client(args.credentials)
+    daemon = IndexerDaemon(DriveChangeSource(args.folder_id, client=client), args.folder_id,
+                           credentials_path=args.credentials, client=client, poll_interval=args.poll_interval,
+                           debounce=args.debounce, max_debounce=args.max_debounce, granularity=args.granularity,
+                           row_window=args.row_window, snapshot=args.snapshot, stream=args.stream,
+                           initial_sync=not args.no_initial_sync)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(main())
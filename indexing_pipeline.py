@@ -0,0 +1,368 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from index_manifest import is_full_rewrite
+from metrics import StageTimings
+
+# Số message tối đa chờ giữa hai stage, giữ bộ nhớ không tăng theo kích thước folder
+DEFAULT_QUEUE_SIZE = 4
+
+# Khoảng thời gian tối thiểu (giây) giữa hai progress event
+DEFAULT_PROGRESS_INTERVAL = 0.5
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    """Pipeline đã dừng (do stage khác lỗi) trong khi một stage đang chờ queue"""
+
+
+def fetch_concurrently(files: List[Dict], fetch: Callable, workers: int) -> Iterator[Tuple]:
+    """Tải nhiều spreadsheet song song, trả về (file_info, sheets_values, lỗi) theo thứ tự hoàn thành
+
+    Số file đang tải hoặc chờ xử lý được giới hạn ở 2 * workers để bộ nhớ không tăng theo số file.
+    """
+    pending_files = iter(files)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_next() -> None:
+            file_info = next(pending_files, None)
+            if file_info is not None:
+                in_flight[executor.submit(fetch, file_info)] = file_info
+
+        for _ in range(2 * workers):
+            submit_next()
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_info = in_flight.pop(future)
+                submit_next()
+                error = future.exception()
+                yield file_info, (None if error else future.result()), error
+
+
+def timed_iter(iterable: Iterable, timings: Optional[StageTimings], stage: str) -> Iterator:
+    """Duyệt `iterable`, chỉ cộng thời gian sinh phần tử (không tính thời gian xử lý của bên gọi)"""
+    if timings is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    elapsed = 0.0
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        timings.add(stage, elapsed)
+
+
+class IndexingPipeline:
+    """Pipeline index theo stage: fetch -> chunk -> embed -> write
+
+    Các stage chạy trên thread riêng, nối với nhau bằng queue có giới hạn nên I/O mạng
+    chạy song song với embed mà bộ nhớ vẫn bị chặn trên. Stage write chạy trên thread
+    gọi `run`, vì vậy các ghi vào Chroma/manifest và callback `on_progress` đều diễn ra
+    trên thread đó (an toàn khi gọi API của Streamlit).
+
+    Args:
+        fetch: Hàm (file_info) -> sheets_values
+        plan: Hàm (file_info, sheets_values, previous, current) -> các thao tác ghi
+            (xem indexer.iter_spreadsheet_ops)
+        writer: ChromaBatchWriter dùng ở stage write
+        embedding_function: Hàm embed dùng ở stage embed; None thì để Chroma tự embed khi ghi
+        embed_concurrency: Số lô embed chạy song song (số process của EmbeddingPool); các lô
+            vẫn được chuyển sang stage write theo đúng thứ tự đến
+        manifest: IndexManifest để index tăng dần (tùy chọn)
+        timings: StageTimings nhận thời gian của stage "split" và "embed" (tùy chọn)
+    """
+
+    def __init__(self, fetch: Callable, plan: Callable, writer, embedding_function: Optional[Callable] = None,
+                 manifest=None, folder_id: Optional[str] = None, workers: int = 1, batch_size: int = 256,
+                 queue_size: int = DEFAULT_QUEUE_SIZE, on_progress: Optional[Callable[[Dict], None]] = None,
+                 progress_interval: float = DEFAULT_PROGRESS_INTERVAL, timings: Optional[StageTimings] = None,
+                 embed_concurrency: int = 1):
+        self.fetch = fetch
+        self.plan = plan
+        self.writer = writer
+        self.embedding_function = embedding_function
+        self.manifest = manifest
+        self.folder_id = folder_id
+        self.workers = max(1, workers)
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.on_progress = on_progress
+        self.progress_interval = progress_interval
+        self.timings = timings
+        self.embed_concurrency = max(1, embed_concurrency)
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._counters = {
+            "files_fetched": 0,
+            "cells": 0,
+            "chunks": 0,
+            "chunks_embedded": 0,
+            "files_written": 0,
+            "files_failed": 0,
+            "chunks_written": 0,
+        }
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] += value
+
+    def _put(self, q: queue.Queue, item) -> None:
+        while True:
+            if self._stop.is_set():
+                raise PipelineAborted()
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def _get(self, q: queue.Queue):
+        while True:
+            if self._stop.is_set():
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+
+    def _run_stage(self, target: Callable, output: queue.Queue) -> threading.Thread:
+        def runner():
+            try:
+                target()
+            except PipelineAborted:
+                return
+            except Exception as e:
+                # Lỗi không thuộc về một file cụ thể: báo cho các stage sau dừng lại
+                try:
+                    self._put(output, ("fatal", e))
+                except PipelineAborted:
+                    return
+            try:
+                self._put(output, _DONE)
+            except PipelineAborted:
+                return
+
+        thread = threading.Thread(target=runner, daemon=True)
+        thread.start()
+        return thread
+
+    def _fetch_stage(self, files: List[Dict], output: queue.Queue) -> None:
+        for file_info, sheets_values, error in fetch_concurrently(files, self.fetch, self.workers):
+            if self._stop.is_set():
+                raise PipelineAborted()
+            self._count("files_fetched")
+            self._put(output, (file_info, sheets_values, error))
+
+    def _chunk_stage(self, source: queue.Queue, output: queue.Queue) -> None:
+        while True:
+            item = self._get(source)
+            if item is _DONE:
+                return
+            if item[0] == "fatal":
+                self._put(output, item)
+                continue
+            file_info, sheets_values, error = item
+            if error is not None:
+                self._put(output, ("file_error", file_info, error))
+                continue
+            try:
+                previous = self.manifest.cell_entries(file_info["id"]) if self.manifest else {}
+                current = {}
+                if is_full_rewrite(previous):
+                    # Mọi vùng ô của file được ghi lại: writer có thể dựng file trong shard mới
+                    self._put(output, ("file_rebuild", file_info))
+                batch, values = [], []
+                for op in timed_iter(self.plan(file_info, sheets_values, previous, current), self.timings, "split"):
+                    if op[0] == "add":
+                        batch.append(op[1:])
+                        if len(batch) >= self.batch_size:
+                            self._count("chunks", len(batch))
+                            self._put(output, ("chunks", file_info, batch))
+                            batch = []
+                    elif op[0] == "delete":
+                        self._put(output, ("delete", file_info, op[1]))
+                    elif op[0] == "values":
+                        # Giá trị của các vùng ô không cần embed, được gom thành lô như chunk
+                        values.append(op[1:])
+                        if len(values) >= self.batch_size:
+                            self._put(output, ("values", file_info, values))
+                            values = []
+                    else:
+                        self._count("cells", op[1])
+                if batch:
+                    self._count("chunks", len(batch))
+                    self._put(output, ("chunks", file_info, batch))
+                if values:
+                    self._put(output, ("values", file_info, values))
+                self._put(output, ("file_done", file_info, current))
+            except PipelineAborted:
+                raise
+            except Exception as e:
+                self._put(output, ("file_error", file_info, e))
+
+    def _embed(self, batch: List[Tuple]) -> List:
+        started = time.perf_counter()
+        vectors = self.embedding_function([document for _, document, _ in batch])
+        if self.timings:
+            self.timings.add("embed", time.perf_counter() - started)
+        return vectors
+
+    def _emit_embedded(self, item: Tuple, future, failed: set, output: queue.Queue) -> None:
+        if future is not None:
+            file_info, batch = item[1], item[2]
+            if file_info["id"] in failed:
+                return
+            try:
+                vectors = future.result()
+            except Exception as e:
+                failed.add(file_info["id"])
+                self._put(output, ("file_error", file_info, e))
+                return
+            self._count("chunks_embedded", len(batch))
+            item = ("chunks", file_info, batch, vectors)
+        self._put(output, item)
+
+    def _embed_stage(self, source: queue.Queue, output: queue.Queue) -> None:
+        failed = set()
+        # Các message theo thứ tự đến, kèm future nếu là lô đang embed; chỉ gửi đi từ đầu hàng
+        # để "file_done" luôn đi sau các chunk của file đó
+        in_flight = deque()
+        executor = ThreadPoolExecutor(max_workers=self.embed_concurrency)
+        try:
+            while True:
+                item = self._get(source)
+                if item is _DONE:
+                    break
+                future = None
+                if item[0] == "chunks" and self.embedding_function is not None:
+                    if item[1]["id"] in failed:
+                        continue
+                    future = executor.submit(self._embed, item[2])
+                in_flight.append((item, future))
+                while in_flight:
+                    head, head_future = in_flight[0]
+                    busy = sum(1 for _, pending in in_flight if pending is not None and not pending.done())
+                    # Chờ lô đầu hàng khi đã đủ số lô chạy song song hoặc hàng đợi đã dài
+                    if (head_future is None or head_future.done() or busy >= self.embed_concurrency
+                            or len(in_flight) >= 2 * self.embed_concurrency + self.queue_size):
+                        in_flight.popleft()
+                        self._emit_embedded(head, head_future, failed, output)
+                    else:
+                        break
+            while in_flight:
+                head, head_future = in_flight.popleft()
+                self._emit_embedded(head, head_future, failed, output)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def snapshot(self, files_total: int, started: float, done: bool = False) -> Dict:
+        """Progress event: bộ đếm và tốc độ của từng stage"""
+        elapsed = max(time.monotonic() - started, 1e-9)
+        with self._lock:
+            c = dict(self._counters)
+        return {
+            "done": done,
+            "elapsed": elapsed,
+            "files_total": files_total,
+            "files_done": c["files_written"] + c["files_failed"],
+            "stages": {
+                "fetch": {"files": c["files_fetched"], "files_per_sec": c["files_fetched"] / elapsed},
+                "chunk": {"cells": c["cells"], "chunks": c["chunks"],
+                          "cells_per_sec": c["cells"] / elapsed, "chunks_per_sec": c["chunks"] / elapsed},
+                "embed": {"chunks": c["chunks_embedded"], "chunks_per_sec": c["chunks_embedded"] / elapsed},
+                "write": {"files": c["files_written"], "failed": c["files_failed"], "chunks": c["chunks_written"],
+                          "files_per_sec": c["files_written"] / elapsed,
+                          "chunks_per_sec": c["chunks_written"] / elapsed},
+            },
+        }
+
+    def run(self, files: List[Dict]) -> Dict:
+        """Chạy pipeline cho danh sách file, trả về số file thành công/lỗi và chi tiết lỗi"""
+        results = {"successful": 0, "failed": 0, "errors": []}
+        started = time.monotonic()
+        fetched = queue.Queue(maxsize=self.queue_size)
+        chunked = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+
+        threads = [
+            self._run_stage(lambda: self._fetch_stage(files, fetched), fetched),
+            self._run_stage(lambda: self._chunk_stage(fetched, chunked), chunked),
+            self._run_stage(lambda: self._embed_stage(chunked, embedded), embedded),
+        ]
+
+        failed = set()
+        last_progress = 0.0
+        try:
+            while True:
+                try:
+                    item = embedded.get(timeout=self.progress_interval)
+                except queue.Empty:
+                    item = None
+
+                if item is _DONE:
+                    break
+                if item is not None:
+                    kind = item[0]
+                    if kind == "fatal":
+                        raise item[1]
+                    file_info = item[1]
+                    if file_info["id"] in failed:
+                        continue
+                    if kind == "chunks":
+                        vectors = item[3] if len(item) > 3 else [None] * len(item[2])
+                        for (doc_id, document, metadata), vector in zip(item[2], vectors):
+                            self.writer.add(document, metadata, doc_id, embedding=vector)
+                        self._count("chunks_written", len(item[2]))
+                    elif kind == "delete":
+                        self.writer.delete(item[2])
+                    elif kind == "values":
+                        for unit in item[2]:
+                            self.writer.set_values(file_info["id"], file_info.get("name"), *unit)
+                    elif kind == "file_rebuild":
+                        self.writer.begin_rebuild(file_info["id"])
+                    elif kind == "file_done":
+                        self.writer.flush()
+                        self.writer.commit_rebuild(file_info["id"])
+                        if self.manifest:
+                            self.manifest.update_file(file_info, self.folder_id, item[2])
+                        self._count("files_written")
+                        results["successful"] += 1
+                    elif kind == "file_error":
+                        # Bỏ phần documents dở dang của file lỗi, không để lẫn vào lô của file sau
+                        self.writer.discard()
+                        self.writer.abort_rebuild(file_info["id"])
+                        failed.add(file_info["id"])
+                        self._count("files_failed")
+                        results["failed"] += 1
+                        results["errors"].append({
+                            "file_name": file_info.get("name", "Unknown"),
+                            "error": str(item[2])
+                        })
+
+                now = time.monotonic()
+                if self.on_progress and now - last_progress >= self.progress_interval:
+                    last_progress = now
+                    self.on_progress(self.snapshot(len(files), started))
+            self.writer.flush()
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join(timeout=5)
+
+        if self.on_progress:
+            self.on_progress(self.snapshot(len(files), started, done=True))
+        return results
@@ -0,0 +1,228 @@
+import json
+import math
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+# Inverted index nằm cạnh thư mục ./chroma_db
+LEXICAL_INDEX_PATH = "./lexical_index.sqlite3"
+
+# Tham số BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Một từ: chữ/số, có thể nối bằng các ký tự thường gặp trong mã spec (SCR-001, user_id, FR1.2)
+_WORD_RE = re.compile(r"\w+(?:[-_./#]\w+)*")
+_SEPARATOR_RE = re.compile(r"[-_./#]")
+
+
+def strip_accents(text: str) -> str:
+    """Bỏ dấu tiếng Việt: 'tìm kiếm' -> 'tim kiem', 'đ' -> 'd'"""
+    text = text.replace("đ", "d").replace("Đ", "D")
+    decomposed = unicodedata.normalize("NFD", text)
+    return unicodedata.normalize("NFC", "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn"))
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách token cho tiếng Việt và mã định danh
+
+    Mỗi từ sinh ra: dạng có dấu, dạng không dấu (người dùng hay gõ không dấu), các phần
+    của mã ghép (SCR-001 -> scr, 001) và cặp âm tiết liền kề, vì từ tiếng Việt thường
+    gồm nhiều âm tiết ('tìm kiếm').
+    """
+    words = _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+    tokens = []
+    for word in words:
+        tokens.append(word)
+        plain = strip_accents(word)
+        if plain != word:
+            tokens.append(plain)
+        if _SEPARATOR_RE.search(word):
+            tokens.extend(part for part in _SEPARATOR_RE.split(word) if part)
+    for first, second in zip(words, words[1:]):
+        bigram = f"{first} {second}"
+        tokens.append(bigram)
+        plain = strip_accents(bigram)
+        if plain != bigram:
+            tokens.append(plain)
+    return tokens
+
+
+class LexicalIndex:
+    """Inverted index BM25 lưu trong sqlite, đồng bộ với spec_collection qua ChromaBatchWriter"""
+
+    def __init__(self, path: str = LEXICAL_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS docs (
+                doc INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                length INTEGER NOT NULL,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS postings (
+                term TEXT NOT NULL,
+                doc INTEGER NOT NULL,
+                tf INTEGER NOT NULL,
+                PRIMARY KEY (term, doc)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc);
+            CREATE TABLE IF NOT EXISTS terms (
+                term TEXT PRIMARY KEY,
+                df INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            -- Tổng số document và tổng độ dài, tránh COUNT(*) trên mỗi truy vấn
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                docs INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO stats (id, docs, length) VALUES (0, 0, 0);
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(docs)")]
+        if "file_id" not in columns:
+            # Index tạo trước khi có filter: thêm cột vị trí và điền từ metadata đã lưu
+            for column in ("file_id", "sheet_id", "cols"):
+                self._conn.execute(f"ALTER TABLE docs ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+            self._conn.execute(
+                "UPDATE docs SET file_id = COALESCE(json_extract(metadata, '$.file_id'), ''), "
+                "sheet_id = COALESCE(json_extract(metadata, '$.sheet_id'), ''), "
+                "cols = COALESCE(json_extract(metadata, '$.cols'), json_extract(metadata, '$.col'), '')"
+            )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS docs_scope ON docs (file_id, sheet_id)")
+        self._conn.commit()
+
+    def _delete_locked(self, ids: List[str]) -> None:
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT doc, length FROM docs WHERE id IN ({placeholders})", batch).fetchall()
+            if not rows:
+                continue
+            docs = [row[0] for row in rows]
+            self._conn.execute(
+                "UPDATE stats SET docs = docs - ?, length = length - ? WHERE id = 0",
+                (len(rows), sum(row[1] for row in rows))
+            )
+            doc_placeholders = ",".join("?" * len(docs))
+            terms = Counter(row[0] for row in self._conn.execute(
+                f"SELECT term FROM postings WHERE doc IN ({doc_placeholders})", docs))
+            self._conn.executemany(
+                "UPDATE terms SET df = df - ? WHERE term = ?", [(count, term) for term, count in terms.items()])
+            self._conn.execute("DELETE FROM terms WHERE df <= 0")
+            self._conn.execute(f"DELETE FROM postings WHERE doc IN ({doc_placeholders})", docs)
+            self._conn.execute(f"DELETE FROM docs WHERE doc IN ({doc_placeholders})", docs)
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict]) -> None:
+        """Thêm hoặc ghi đè các document (cùng id với spec_collection)"""
+        with self._lock, self._conn:
+            self._delete_locked(list(ids))
+            df = Counter()
+            total_length = 0
+            for doc_id, document, metadata in zip(ids, documents, metadatas):
+                counts = Counter(tokenize(document))
+                cursor = self._conn.execute(
+                    "INSERT INTO docs (id, length, document, metadata, file_id, sheet_id, cols) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (doc_id, sum(counts.values()), document, json.dumps(metadata, ensure_ascii=False),
+                     str(metadata.get("file_id", "")), str(metadata.get("sheet_id", "")),
+                     str(metadata.get("cols") or metadata.get("col") or ""))
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc, tf) VALUES (?, ?, ?)",
+                    [(term, cursor.lastrowid, tf) for term, tf in counts.items()]
+                )
+                df.update(counts.keys())
+                total_length += sum(counts.values())
+            self._conn.execute(
+                "UPDATE stats SET docs = docs + ?, length = length + ? WHERE id = 0", (len(ids), total_length))
+            self._conn.executemany(
+                "INSERT INTO terms (term, df) VALUES (?, ?) ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+                list(df.items())
+            )
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock, self._conn:
+            self._delete_locked(list(ids))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT docs FROM stats WHERE id = 0").fetchone()[0]
+
+    @staticmethod
+    def _scope_sql(filters: Optional[Dict]) -> Tuple[str, List[str]]:
+        """Điều kiện SQL trên bảng docs (alias d) cho filters {file_id, sheet_id, col}"""
+        conditions, params = [], []
+        filters = filters or {}
+        for key in ("file_id", "sheet_id"):
+            if filters.get(key):
+                conditions.append(f"d.{key} = ?")
+                params.append(str(filters[key]))
+        if filters.get("col"):
+            conditions.append("instr(',' || d.cols || ',', ?) > 0")
+            params.append(f",{filters['col']},")
+        return "".join(f" AND {condition}" for condition in conditions), params
+
+    def search(self, query: str, n_results: int = 10, filters: Optional[Dict] = None) -> List[Dict]:
+        """Tìm theo BM25, trả về list {id, document, metadata, score} theo điểm giảm dần
+
+        `filters` ({file_id, sheet_id, col}) giới hạn kết quả trong một file, tab hoặc các
+        document có dữ liệu ở một cột; thống kê BM25 vẫn tính trên toàn bộ index.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        scope, scope_params = self._scope_sql(filters)
+        with self._lock:
+            total_docs, total_length = self._conn.execute(
+                "SELECT docs, length FROM stats WHERE id = 0").fetchone()
+            if not total_docs:
+                return []
+            avg_length = total_length / total_docs
+            scores: Dict[int, float] = {}
+            for term in terms:
+                row = self._conn.execute("SELECT df FROM terms WHERE term = ?", (term,)).fetchone()
+                if row is None:
+                    continue
+                idf = math.log((total_docs - row[0] + 0.5) / (row[0] + 0.5) + 1)
+                for doc, tf, length in self._conn.execute(
+                        "SELECT p.doc, p.tf, d.length FROM postings p JOIN docs d ON d.doc = p.doc "
+                        f"WHERE p.term = ?{scope}", (term, *scope_params)):
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+            hits = []
+            for doc, score in top:
+                doc_id, document, metadata = self._conn.execute(
+                    "SELECT id, document, metadata FROM docs WHERE doc = ?", (doc,)).fetchone()
+                hits.append({"id": doc_id, "document": document, "metadata": json.loads(metadata), "score": score})
+        return hits
+
+    def sync_with(self, collection, page_size: int = 1000) -> bool:
+        """Dựng lại index từ collection nếu số document lệch nhau (ví dụ index được tạo trước BM25)"""
+        if self.count() == collection.count():
+            return False
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM terms")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.execute("UPDATE stats SET docs = 0, length = 0 WHERE id = 0")
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=["documents", "metadatas"])
+            if not page["ids"]:
+                break
+            self.upsert(page["ids"], page["documents"], page["metadatas"])
+            offset += len(page["ids"])
+        return True
+
+    def close(self) -> None:
+        self._conn.close()
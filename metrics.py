@@ -0,0 +1,226 @@
+"""Bộ đếm, timer và histogram cho indexer và tìm kiếm
+
+Các chỉ số được gom trong REGISTRY của process; có thể xuất dạng Prometheus text hoặc
+JSON, và phục vụ qua HTTP bằng serve_metrics (chỉ bật khi cần).
+"""
+import bisect
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Ngưỡng bucket (giây) mặc định cho histogram thời gian, từ 1ms tới 60s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict) -> LabelKey:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(labels: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Histogram với bucket cố định, giữ tổng và số lần quan sát"""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Ước lượng quantile bằng cận trên của bucket chứa nó"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Nơi lưu counter và histogram của process, an toàn khi dùng từ nhiều thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Tăng counter `name` (tên nên kết thúc bằng _total)"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Ghi một giá trị (thường là số giây) vào histogram `name`"""
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = Histogram()
+            series[key].observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Đo thời gian chạy của khối lệnh và ghi vào histogram `name`"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict:
+        """Toàn bộ chỉ số dạng dict (dùng cho JSON)"""
+        with self._lock:
+            counters = {
+                name: [{"labels": dict(key), "value": value} for key, value in series.items()]
+                for name, series in self._counters.items()
+            }
+            histograms = {
+                name: [{
+                    "labels": dict(key),
+                    "count": histogram.count,
+                    "sum": histogram.sum,
+                    "p50": histogram.quantile(0.5),
+                    "p95": histogram.quantile(0.95),
+                    "p99": histogram.quantile(0.99),
+                } for key, histogram in series.items()]
+                for name, series in self._histograms.items()
+            }
+        return {"counters": counters, "histograms": histograms}
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self) -> str:
+        """Chỉ số theo định dạng text của Prometheus"""
+        lines: List[str] = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in series.items():
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, histogram in series.items():
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{_format_labels(key, ('le', le))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe("indexer_stage_seconds", "Thời gian của từng stage index (list, fetch, split, embed, write)")
+REGISTRY.describe("indexer_files_total", "Số spreadsheet đã xử lý theo kết quả")
+REGISTRY.describe("indexer_chunks_total", "Số chunk đã ghi vào collection")
+REGISTRY.describe("indexer_values_total", "Số ô số/ngày/boolean đã ghi vào value index thay vì collection")
+REGISTRY.describe("search_seconds", "Thời gian tìm kiếm theo phần (vector, lexical, total)")
+REGISTRY.describe("search_queries_total", "Số truy vấn tìm kiếm theo đường xử lý")
+REGISTRY.describe("vector_shards_queried_total", "Số shard được truy vấn (VECTOR_STORE=sharded)")
+REGISTRY.describe("indexer_daemon_changes_total", "Số thay đổi daemon đọc được từ change feed")
+REGISTRY.describe("indexer_daemon_files_total", "Số file daemon đã xử lý theo kết quả")
+REGISTRY.describe("indexer_daemon_lag_seconds", "Thời gian từ thay đổi đầu tiên tới khi file được index lại")
+REGISTRY.describe("agent_turn_seconds", "Thời gian một lượt agent Sheet Creator (first_token, total)")
+
+
+class StageTimings:
+    """Thời gian của từng stage trong một lần index, đồng thời ghi vào registry
+
+    Các stage chạy song song (ví dụ fetch với nhiều worker) nên tổng thời gian các stage
+    có thể lớn hơn thời gian thực của cả lần chạy.
+    """
+
+    def __init__(self, registry: MetricsRegistry = REGISTRY, metric: str = "indexer_stage_seconds"):
+        self.registry = registry
+        self.metric = metric
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, Dict] = {}
+
+    def add(self, stage: str, seconds: float, count: int = 1) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"seconds": 0.0, "count": 0})
+            entry["seconds"] += seconds
+            entry["count"] += count
+        self.registry.observe(self.metric, seconds, stage=stage)
+
+    @contextmanager
+    def time(self, stage: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def summary(self) -> Dict:
+        """{"wall_seconds": ..., "stages": {stage: {"seconds", "count"}}}"""
+        with self._lock:
+            stages = {stage: dict(entry) for stage, entry in self._stages.items()}
+        return {"wall_seconds": time.perf_counter() - self.started, "stages": stages}
+
+
+def serve_metrics(port: int, host: str = "127.0.0.1", registry: MetricsRegistry = REGISTRY):
+    """Phục vụ /metrics (Prometheus text) và /metrics.json trên một thread nền, trả về server"""
+    # Import khi cần để các module dùng metrics vẫn import nhanh
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = self.path.split("?")[0]
+            if path == "/metrics":
+                body, content_type = registry.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+            elif path == "/metrics.json":
+                body, content_type = registry.to_json(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            payload = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            # Không ghi log cho mỗi lần Prometheus scrape
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from embedding_cache import normalize_text
+
+# Bộ đếm thế hệ của index, indexer tăng mỗi lần ghi vào collection
+GENERATION_PATH = "./index_generation"
+
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_TTL = 300.0
+
+_generation_lock = threading.Lock()
+
+
+def read_generation(path: str = GENERATION_PATH) -> int:
+    """Đọc thế hệ hiện tại của index (0 nếu chưa từng ghi)"""
+    try:
+        with open(path) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+
+def bump_generation(path: str = GENERATION_PATH) -> int:
+    """Tăng thế hệ của index, làm mất hiệu lực các kết quả truy vấn đã cache (kể cả ở process khác)"""
+    with _generation_lock:
+        generation = read_generation(path) + 1
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(generation))
+        # Ghi file tạm rồi đổi tên để process khác không đọc phải file ghi dở
+        os.replace(tmp_path, path)
+    return generation
+
+
+def make_key(query: str, filters: Optional[Dict] = None, **options) -> Tuple:
+    """Khóa cache: truy vấn đã chuẩn hóa + filters + các tùy chọn (n_results, ...)"""
+    def freeze(value):
+        if isinstance(value, dict):
+            return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+        if isinstance(value, (list, tuple)):
+            return tuple(freeze(v) for v in value)
+        return value
+
+    return (normalize_text(query).lower(), freeze(filters or {}), freeze(options))
+
+
+class QueryCache:
+    """Cache LRU + TTL cho kết quả truy vấn, bị xóa khi thế hệ của index thay đổi"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL,
+                 generation_path: str = GENERATION_PATH, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation_path = generation_path
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._generation = read_generation(generation_path)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _check_generation(self) -> None:
+        generation = read_generation(self.generation_path)
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+
+    def generation(self) -> int:
+        """Thế hệ của index mà các kết quả đang cache ứng với; đọc trước khi tính kết quả để truyền cho put"""
+        with self._lock:
+            self._check_generation()
+            return self._generation
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            self._check_generation()
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < self._clock():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        """Lưu kết quả; bỏ qua nếu index đã sang thế hệ khác `generation` (thế hệ lúc bắt đầu tính)"""
+        with self._lock:
+            self._check_generation()
+            if generation is not None and generation != self._generation:
+                # Kết quả có thể được tính trên index cũ: lưu lại sẽ phục vụ dữ liệu cũ tới hết TTL
+                return
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_compute(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Trả kết quả đã cache, hoặc tính bằng `compute` rồi lưu lại"""
+        generation = self.generation()
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value, generation=generation)
+        return value
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
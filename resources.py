@@ -0,0 +1,139 @@
+import importlib
+import os
+from functools import lru_cache
+
+from embedding_cache import CachedEmbeddingFunction
+from facet_index import FacetIndex
+from lexical_index import LexicalIndex
+from metrics import serve_metrics
+from query_cache import QueryCache
+from value_index import ValueIndex
+
+# Khởi tạo Chroma với thư mục lưu trữ
+persist_directory = "./chroma_db"
+COLLECTION_NAME = "spec_collection"
+
+# Các tài nguyên nặng được tạo một lần cho mỗi process và dùng chung giữa các session
+# Streamlit (mỗi lần rerun app.py không tạo lại client, không nạp lại model ONNX).
+# chromadb chỉ được import ở lần dùng đầu tiên để import các module khác vẫn nhanh.
+
+
+@lru_cache(maxsize=None)
+def get_chroma_client():
+    import chromadb
+
+    return chromadb.PersistentClient(path=persist_directory)
+
+
+# Có thể thay model embedding bằng "module:tên_class" (ví dụ model giả lập trong benchmark)
+EMBEDDING_FUNCTION = os.getenv("EMBEDDING_FUNCTION", "")
+
+
+def load_embedding_function(spec: str = ""):
+    """Tạo embedding function từ "module:tên" (class hoặc hàm không tham số), mặc định là model của Chroma"""
+    if not spec:
+        from chromadb.utils import embedding_functions
+
+        return embedding_functions.DefaultEmbeddingFunction()
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+@lru_cache(maxsize=None)
+def get_embedding_function() -> CachedEmbeddingFunction:
+    # Embedding được cache trên đĩa theo nội dung, dùng chung giữa các file và các lần chạy
+    return CachedEmbeddingFunction(load_embedding_function(EMBEDDING_FUNCTION))
+
+
+# Số process embed khi index; 0 là embed ngay trong process gọi indexer
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "0"))
+
+
+@lru_cache(maxsize=None)
+def get_indexing_embedding_function(workers: int = EMBED_WORKERS) -> CachedEmbeddingFunction:
+    """Embedding function của indexer: qua EmbeddingPool với `workers` process nếu workers > 0
+
+    Dùng chung cache và model_id với get_embedding_function() nên manifest và cache
+    không đổi khi bật hoặc tắt pool. Pool được tạo một lần cho mỗi process.
+    """
+    default_ef = get_embedding_function()
+    if workers <= 0:
+        return default_ef
+    from embedding_pool import EmbeddingPool
+
+    return CachedEmbeddingFunction(EmbeddingPool(EMBEDDING_FUNCTION, workers), cache=default_ef.cache,
+                                   model_id=default_ef.model_id)
+
+
+# Backend lưu vector: "chroma" (mặc định), "compact" (vector_store.CompactVectorStore) hoặc
+# "sharded" (vector_store.ShardedVectorStore: mỗi file một collection, hoặc
+# VECTOR_STORE_SHARD_BUCKETS collection theo hash của file_id)
+VECTOR_STORE = os.getenv("VECTOR_STORE", "chroma")
+VECTOR_STORE_SHARD_BUCKETS = int(os.getenv("VECTOR_STORE_SHARD_BUCKETS", "0"))
+
+
+@lru_cache(maxsize=None)
+def get_collection():
+    if VECTOR_STORE == "compact":
+        from vector_store import COMPACT_STORE_PATH, DEFAULT_DTYPE, CompactVectorStore
+
+        return CompactVectorStore(
+            COMPACT_STORE_PATH, embedding_function=get_embedding_function(),
+            dtype=os.getenv("VECTOR_STORE_DTYPE", DEFAULT_DTYPE),
+            rerank=os.getenv("VECTOR_STORE_RERANK", "0") == "1")
+    if VECTOR_STORE == "sharded":
+        from vector_store import DEFAULT_SHARD_WORKERS, ShardedVectorStore
+
+        return ShardedVectorStore(
+            get_chroma_client(), embedding_function=get_embedding_function(),
+            buckets=VECTOR_STORE_SHARD_BUCKETS, facet_index=get_facet_index(),
+            workers=int(os.getenv("VECTOR_STORE_SHARD_WORKERS", str(DEFAULT_SHARD_WORKERS))))
+    return get_chroma_client().get_or_create_collection(
+        name=COLLECTION_NAME, embedding_function=get_embedding_function())
+
+
+@lru_cache(maxsize=None)
+def get_lexical_index() -> LexicalIndex:
+    # Inverted index BM25 trên cùng các chunk, được writer cập nhật cùng lúc với collection
+    return LexicalIndex()
+
+
+@lru_cache(maxsize=None)
+def get_facet_index() -> FacetIndex:
+    # Số document theo file/tab/cột cho bộ lọc tìm kiếm, cũng được writer cập nhật
+    return FacetIndex()
+
+
+@lru_cache(maxsize=None)
+def get_value_index() -> ValueIndex:
+    # Các ô số, ngày tháng và boolean (không đưa vào collection), cũng được writer cập nhật
+    return ValueIndex()
+
+
+@lru_cache(maxsize=None)
+def get_query_cache() -> QueryCache:
+    return QueryCache()
+
+
+@lru_cache(maxsize=None)
+def load_index_snapshot():
+    """Nạp file snapshot INDEX_SNAPSHOT nếu index còn trống (một lần mỗi process)
+
+    Dùng cho replica mới: có index ngay mà không index lại từ Google và không embed.
+    Trả về kết quả của index_snapshot.import_index, hoặc None nếu không cần nạp.
+    """
+    path = os.getenv("INDEX_SNAPSHOT")
+    if not path or get_collection().count():
+        return None
+    from index_snapshot import import_index
+
+    return import_index(path)
+
+
+@lru_cache(maxsize=None)
+def get_metrics_server():
+    """Bật endpoint /metrics và /metrics.json nếu có biến môi trường METRICS_PORT (một lần mỗi process)"""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    return serve_metrics(int(port), host=os.getenv("METRICS_HOST", "127.0.0.1"))
@@ -0,0 +1,213 @@
+import base64
+import hashlib
+import json
+import re
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from facet_index import build_where
+from metrics import REGISTRY
+
+# Hằng số k của Reciprocal Rank Fusion
+RRF_K = 60
+
+# Số ứng viên lấy từ mỗi nguồn trước khi trộn
+DEFAULT_CANDIDATES = 50
+
+# Phạm vi lọc có không quá chừng này document thì chấm điểm chính xác trên đúng các
+# document đó thay vì để collection lọc metadata (chi phí theo kích thước phạm vi, không
+# theo kích thước index)
+EXACT_SCOPE_MAX = 500
+
+# Số kết quả tối đa có thể phân trang tới và số kết quả mỗi trang mặc định
+DEFAULT_TOP_K = 100
+DEFAULT_PAGE_SIZE = 10
+
+# Truy vấn một "từ" gồm chữ/số và các ký tự nối hay gặp trong mã spec
+_IDENTIFIER_RE = re.compile(r"^[\w]+(?:[-_./#:][\w]+)*$")
+
+
+def looks_like_identifier(query: str) -> bool:
+    """Truy vấn trông giống mã spec, mã màn hình hoặc tên field (SCR-001, user_id, btnSubmit, FR1.2)"""
+    query = query.strip()
+    if not query or " " in query or not _IDENTIFIER_RE.match(query):
+        return False
+    has_digit = any(ch.isdigit() for ch in query)
+    has_separator = any(ch in "-_./#:" for ch in query)
+    is_camel_case = any(ch.isupper() for ch in query[1:]) and any(ch.islower() for ch in query)
+    return has_digit or has_separator or is_camel_case
+
+
+def _vector_hits(results: Dict, position: int = 0) -> List[Dict]:
+    """Kết quả của truy vấn thứ `position` trong một lần collection.query"""
+    hits = []
+    for index, doc_id in enumerate(results["ids"][position]):
+        hits.append({
+            "id": doc_id,
+            "document": results["documents"][position][index],
+            "metadata": results["metadatas"][position][index],
+            "score": results["distances"][position][index] if results.get("distances") else None,
+        })
+    return hits
+
+
+def _exact_vector_hits(queries: List[str], collection, ids: List[str], n_results: int,
+                       embedding_function: Callable) -> List[List[Dict]]:
+    """Chấm điểm chính xác các truy vấn trên đúng các document `ids` (phạm vi lọc nhỏ)"""
+    import numpy as np
+
+    scope = collection.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+    if not scope["ids"]:
+        return [[] for _ in queries]
+    vectors = np.asarray(scope["embeddings"], dtype=np.float32)
+    query_vectors = np.asarray(embedding_function(list(queries)), dtype=np.float32)
+    # Khoảng cách L2 bình phương, cùng thang với distances của Chroma
+    distances = ((query_vectors ** 2).sum(axis=1)[:, None] - 2 * query_vectors @ vectors.T
+                 + (vectors ** 2).sum(axis=1)[None, :])
+    results = []
+    for row in distances:
+        order = np.argsort(row, kind="stable")[:n_results]
+        results.append([{
+            "id": scope["ids"][index],
+            "document": scope["documents"][index],
+            "metadata": scope["metadatas"][index],
+            "score": float(row[index]),
+        } for index in order])
+    return results
+
+
+def reciprocal_rank_fusion(rankings: Dict[str, List[Dict]], n_results: int, k: int = RRF_K) -> List[Dict]:
+    """Trộn nhiều danh sách kết quả theo RRF: score = tổng 1 / (k + hạng)"""
+    fused: Dict[str, Dict] = {}
+    for source, hits in rankings.items():
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {**hit, "score": 0.0, "sources": []})
+            entry["score"] += 1.0 / (k + rank)
+            entry["sources"].append(source)
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)[:n_results]
+
+
+def hybrid_search_batch(queries: List[str], collection, lexical_index, n_results: int = 10,
+                        candidates: int = DEFAULT_CANDIDATES, filters: Optional[Dict] = None,
+                        facet_index=None, embedding_function: Optional[Callable] = None) -> List[List[Dict]]:
+    """Tìm kiếm kết hợp BM25 và vector cho nhiều truy vấn, trả về kết quả theo thứ tự `queries`
+
+    Truy vấn trông như mã định danh được trả lời chỉ từ inverted index (không cần embed
+    truy vấn); nếu không có kết quả thì rơi về tìm kiếm kết hợp. Các truy vấn còn lại lấy
+    ứng viên từ cả BM25 và Chroma rồi trộn bằng Reciprocal Rank Fusion; phần vector của
+    tất cả các truy vấn đó được embed và truy vấn trong một lần gọi collection.query.
+    Mỗi kết quả là dict {id, document, metadata, score, sources}. Thời gian của phần
+    lexical, vector và cả lô được ghi vào histogram search_seconds.
+
+    `filters` ({file_id, sheet_id, col}) giới hạn cả hai nguồn: BM25 lọc trong SQL, phần
+    vector dùng `where` của collection. Nếu có `facet_index` và `embedding_function`,
+    phạm vi không quá EXACT_SCOPE_MAX document và collection không có index cho where
+    (Chroma lọc metadata bằng cách quét) thì phần vector được chấm điểm chính xác trên
+    đúng các document trong phạm vi.
+    """
+    started = time.perf_counter()
+    candidates = max(candidates, n_results)
+    where = build_where(filters)
+    lexical_seconds = 0.0
+    results: List[List[Dict]] = [[] for _ in queries]
+    pending = []
+    for index, query in enumerate(queries):
+        if looks_like_identifier(query):
+            lexical_started = time.perf_counter()
+            hits = lexical_index.search(query, n_results, filters)
+            lexical_seconds += time.perf_counter() - lexical_started
+            if hits:
+                results[index] = [{**hit, "sources": ["bm25"]} for hit in hits]
+                continue
+        pending.append(index)
+    REGISTRY.inc("search_queries_total", len(queries) - len(pending), path="identifier")
+
+    if pending:
+        REGISTRY.inc("search_queries_total", len(pending), path="hybrid")
+        pending_queries = [queries[index] for index in pending]
+        total = facet_index.scope_size(filters) if where and facet_index else collection.count()
+        vector_results = [[] for _ in pending]
+        exact_scope = (where and facet_index and embedding_function and total <= EXACT_SCOPE_MAX
+                       and not getattr(collection, "indexed_where", False))
+        if total and exact_scope:
+            with REGISTRY.timer("search_seconds", part="vector"):
+                vector_results = _exact_vector_hits(pending_queries, collection, facet_index.scope_ids(filters),
+                                                    candidates, embedding_function)
+        elif total:
+            with REGISTRY.timer("search_seconds", part="vector"):
+                batch = collection.query(query_texts=pending_queries, n_results=min(candidates, total),
+                                         **({"where": where} if where else {}))
+            vector_results = [_vector_hits(batch, position) for position in range(len(pending))]
+        for index, vector_hits in zip(pending, vector_results):
+            lexical_started = time.perf_counter()
+            lexical_hits = lexical_index.search(queries[index], candidates, filters)
+            lexical_seconds += time.perf_counter() - lexical_started
+            results[index] = reciprocal_rank_fusion({"bm25": lexical_hits, "vector": vector_hits}, n_results)
+
+    REGISTRY.observe("search_seconds", lexical_seconds, part="lexical")
+    REGISTRY.observe("search_seconds", time.perf_counter() - started, part="total")
+    return results
+
+
+def hybrid_search(query: str, collection, lexical_index, n_results: int = 10,
+                  candidates: int = DEFAULT_CANDIDATES, filters: Optional[Dict] = None,
+                  facet_index=None, embedding_function: Optional[Callable] = None) -> List[Dict]:
+    """Tìm kiếm kết hợp BM25 và vector cho một truy vấn (xem hybrid_search_batch)"""
+    return hybrid_search_batch([query], collection, lexical_index, n_results, candidates,
+                               filters, facet_index, embedding_function)[0]
+
+
+def restrict_to_rows(hits: List[Dict], rows: Set[Tuple[str, str, int]]) -> List[Dict]:
+    """Các kết quả nằm trên ít nhất một hàng trong `rows` ({(file_id, sheet_id, hàng)}, xem ValueIndex.matching_rows)"""
+    kept = []
+    for hit in hits:
+        metadata = hit["metadata"]
+        # Vùng ô của document: "C5" (theo ô) hoặc "A5:F9" (theo hàng/nhóm hàng)
+        bounds = [int(match) for match in re.findall(r"(\d+)", metadata.get("range") or metadata.get("row", ""))]
+        if not bounds:
+            continue
+        key = (str(metadata.get("file_id", "")), str(metadata.get("sheet_id", "")))
+        if any((*key, row) in rows for row in range(bounds[0], bounds[-1] + 1)):
+            kept.append(hit)
+    return kept
+
+
+def cursor_key(query: str, filters: Optional[Dict] = None, top_k: int = DEFAULT_TOP_K) -> str:
+    """Chữ ký của truy vấn + filters + top_k, gắn vào cursor để không dùng nhầm cho truy vấn khác"""
+    payload = json.dumps([query.strip().lower(), filters or {}, top_k], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def encode_cursor(offset: int, key: str) -> str:
+    payload = json.dumps({"offset": offset, "key": key}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(payload).decode("ascii")
+
+
+def decode_cursor(cursor: Optional[str], key: str) -> int:
+    """Vị trí bắt đầu trong cursor; cursor rỗng, hỏng hoặc của truy vấn khác thì trả về 0"""
+    if not cursor:
+        return 0
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        offset = int(payload["offset"])
+    except (ValueError, TypeError, KeyError):
+        return 0
+    return max(0, offset) if payload.get("key") == key else 0
+
+
+def paginate(hits: List[Dict], key: str, page_size: int = DEFAULT_PAGE_SIZE,
+             cursor: Optional[str] = None) -> Dict:
+    """Cắt một trang từ danh sách top-k đã xếp hạng
+
+    Trả về {"hits", "offset", "total", "next_cursor"}; next_cursor là None ở trang cuối.
+    Danh sách top-k được tính một lần (và cache), các trang chỉ là lát cắt của nó nên thứ
+    tự giữa các trang luôn nhất quán.
+    """
+    offset = decode_cursor(cursor, key)
+    end = offset + page_size
+    return {
+        "hits": hits[offset:end],
+        "offset": offset,
+        "total": len(hits),
+        "next_cursor": encode_cursor(end, key) if end < len(hits) else None,
+    }
@@ -0,0 +1,255 @@
+"""Dịch vụ HTTP tìm kiếm/index không cần giao diện Streamlit
+
+Chạy:
+
+    uvicorn service:app --host 0.0.0.0 --port 8000
+
+Embed truy vấn, truy vấn Chroma và các job index đều chạy trên pool thread có giới hạn,
+nên event loop không bao giờ bị chặn.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
+
+from metrics import REGISTRY
+from query_cache import make_key
+from resources import (get_collection, get_embedding_function, get_facet_index, get_lexical_index, get_query_cache,
+                       load_index_snapshot)
+from search import DEFAULT_CANDIDATES, cursor_key, hybrid_search_batch, paginate
+
+load_dotenv()
+
+# Mức log lấy từ LOG_LEVEL (mặc định INFO); nội dung ô chỉ được ghi ở mức DEBUG
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+
+# Số thread dùng cho tìm kiếm (embed + truy vấn Chroma) và cho job index
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+
+# Số job index tối đa đang chờ hoặc đang chạy; vượt quá thì trả về 429
+MAX_PENDING_JOBS = int(os.getenv("MAX_PENDING_JOBS", "16"))
+
+# Số job đã xong được giữ lại để tra trạng thái
+MAX_FINISHED_JOBS = 1000
+
+# File credentials của service account dùng cho các job index
+GOOGLE_CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH", "./secret/credentials.json")
+
+MAX_QUERIES_PER_REQUEST = 256
+
+app = FastAPI(title="Spec search service")
+
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+# Mặc định một worker: các job index ghi vào cùng collection/manifest nên chạy lần lượt
+index_executor = ThreadPoolExecutor(max_workers=INDEX_WORKERS, thread_name_prefix="index")
+
+
+class SearchFilters(BaseModel):
+    file_id: Optional[str] = None
+    sheet_id: Optional[str] = None
+    col: Optional[str] = Field(None, regex="^[A-Z]+$")
+
+
+class SearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_items=1, max_items=MAX_QUERIES_PER_REQUEST)
+    # Số kết quả xếp hạng cho mỗi truy vấn (top-k); có page_size thì trả về từng trang của top-k
+    n_results: int = Field(10, ge=1, le=500)
+    filters: Optional[SearchFilters] = None
+    page_size: Optional[int] = Field(None, ge=1, le=100)
+    # Cursor của từng truy vấn (cùng thứ tự với queries), lấy từ next_cursor của lần trước
+    cursors: Optional[List[Optional[str]]] = None
+
+
+class IndexFolderRequest(BaseModel):
+    folder_id: str
+    workers: int = Field(4, ge=1, le=32)
+    incremental: bool = True
+    granularity: str = Field("cell", regex="^(cell|row|row_window)$")
+    row_window: int = Field(5, ge=1, le=50)
+    snapshot: bool = True
+    stream: bool = False
+
+
+class IndexFileRequest(BaseModel):
+    file_info: Dict
+    granularity: str = Field("cell", regex="^(cell|row|row_window)$")
+    row_window: int = Field(5, ge=1, le=50)
+    snapshot: bool = True
+    stream: bool = False
+
+
+class JobStore:
+    """Lưu trạng thái các job index trong bộ nhớ"""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job["status"] in ("queued", "running"))
+
+    def create(self, kind: str, params: Dict) -> Dict:
+        with self._lock:
+            job = {
+                "id": uuid.uuid4().hex,
+                "kind": kind,
+                "params": params,
+                "status": "queued",
+                "created_at": time.time(),
+                "started_at": None,
+                "finished_at": None,
+                "progress": None,
+                "result": None,
+            }
+            self._jobs[job["id"]] = job
+            # Bỏ bớt các job cũ đã xong
+            finished = [job_id for job_id, item in self._jobs.items() if item["status"] in ("succeeded", "failed")]
+            for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+                del self._jobs[job_id]
+            return dict(job)
+
+    def update(self, job_id: str, **fields) -> None:
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+
+jobs = JobStore()
+
+
+def _run_job(job_id: str, task) -> None:
+    jobs.update(job_id, status="running", started_at=time.time())
+    try:
+        result = task(lambda event: jobs.update(job_id, progress=event))
+        status = "succeeded" if result.get("success") else "failed"
+    except Exception as e:
+        result = {"success": False, "message": str(e)}
+        status = "failed"
+    jobs.update(job_id, status=status, result=result, finished_at=time.time())
+
+
+def _enqueue(kind: str, params: Dict, task) -> Dict:
+    if jobs.pending() >= MAX_PENDING_JOBS:
+        raise HTTPException(status_code=429, detail="Quá nhiều job index đang chờ, thử lại sau")
+    job = jobs.create(kind, params)
+    index_executor.submit(_run_job, job["id"], task)
+    return job
+
+
+def _search(queries: List[str], n_results: int, filters: Optional[Dict] = None) -> List[List[Dict]]:
+    """Tìm kiếm cho cả lô; truy vấn đã có trong cache không bị embed lại"""
+    query_cache = get_query_cache()
+    keys = [make_key(query, filters, n_results=n_results) for query in queries]
+    generation = query_cache.generation()
+    results = [query_cache.get(key) for key in keys]
+    missing = [index for index, hits in enumerate(results) if hits is None]
+    if missing:
+        computed = hybrid_search_batch([queries[index] for index in missing], get_collection(),
+                                       get_lexical_index(), n_results=n_results,
+                                       candidates=max(DEFAULT_CANDIDATES, n_results), filters=filters,
+                                       facet_index=get_facet_index(), embedding_function=get_embedding_function())
+        for index, hits in zip(missing, computed):
+            query_cache.put(keys[index], hits, generation=generation)
+            results[index] = hits
+    return results
+
+
+@app.post("/search")
+async def search(request: SearchRequest):
+    if request.cursors is not None and len(request.cursors) != len(request.queries):
+        raise HTTPException(status_code=422, detail="cursors phải có cùng số phần tử với queries")
+    filters = {key: value for key, value in (request.filters.dict() if request.filters else {}).items() if value}
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(search_executor, _search, request.queries, request.n_results, filters)
+    if request.page_size is None:
+        return {"results": [{"query": query, "hits": hits} for query, hits in zip(request.queries, results)]}
+    cursors = request.cursors or [None] * len(request.queries)
+    pages = []
+    for query, hits, cursor in zip(request.queries, results, cursors):
+        page = paginate(hits, cursor_key(query, filters, request.n_results), request.page_size, cursor)
+        pages.append({"query": query, **page})
+    return {"results": pages}
+
+
+@app.get("/facets")
+async def facets(file_id: Optional[str] = None, sheet_id: Optional[str] = None):
+    """Số document theo file, tab (trong file_id) và cột (trong file_id/sheet_id)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(search_executor, get_facet_index().facets,
+                                      {"file_id": file_id, "sheet_id": sheet_id})
+
+
+@app.post("/index/folder", status_code=202)
+async def index_folder_job(request: IndexFolderRequest):
+    def task(on_progress):
+        from indexer import index_folder
+
+        return index_folder(request.folder_id, GOOGLE_CREDENTIALS_PATH, workers=request.workers,
+                            incremental=request.incremental, on_progress=on_progress,
+                            granularity=request.granularity, row_window=request.row_window,
+                            snapshot=request.snapshot, stream=request.stream)
+
+    return _enqueue("index_folder", request.dict(), task)
+
+
+@app.post("/index/file", status_code=202)
+async def index_file_job(request: IndexFileRequest):
+    if "id" not in request.file_info or "name" not in request.file_info:
+        raise HTTPException(status_code=422, detail="file_info cần có 'id' và 'name'")
+
+    def task(on_progress):
+        from indexer import handle_new_file
+
+        return handle_new_file(request.file_info, GOOGLE_CREDENTIALS_PATH, granularity=request.granularity,
+                               row_window=request.row_window, snapshot=request.snapshot,
+                               stream=request.stream)
+
+    return _enqueue("index_file", request.dict(), task)
+
+
+@app.get("/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Không tìm thấy job")
+    return job
+
+
+@app.get("/metrics")
+async def metrics(format: str = "prometheus"):
+    if format == "json":
+        return REGISTRY.snapshot()
+    return PlainTextResponse(REGISTRY.to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.on_event("startup")
+def startup() -> None:
+    # Replica mới nạp index từ snapshot INDEX_SNAPSHOT (nếu có) trước khi nhận truy vấn
+    result = load_index_snapshot()
+    if result and not result["success"]:
+        logger.warning(result["message"])
+
+
+@app.on_event("shutdown")
+def shutdown() -> None:
+    search_executor.shutdown(wait=False)
+    index_executor.shutdown(wait=True)
@@ -1,30 +1,204 @@
-from typing import Dict, Any, Optional, Type, List
-from langchain.tools import BaseTool, Tool, StructuredTool, tool
-from pydantic import BaseModel, Field, validator
-import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, List, Optional, Tuple
+import importlib
+import os
 import re
-from langchain.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
-from langgraph.prebuilt import create_react_agent
+import threading
+import time
+import uuid
+from metrics import REGISTRY
+from sheets_api import call_with_retry, get_client, quote_sheet_title
 # https://python.langchain.com/docs/how_to/custom_tools/
 
+# langchain/langgraph chỉ được import khi thật sự tạo tools hoặc agent,
+# để `from sheet_creator_tool import GoogleSheetsToolkit` nhẹ và không gọi mạng
+if TYPE_CHECKING:
+    from langchain.tools import StructuredTool
+
+# Số vùng ghi đang chờ tối đa trước khi tự gửi, để một lượt agent rất dài không giữ quá nhiều dữ liệu
+MAX_PENDING_WRITES = 500
+
+# valueInputOption của gspread: update_acell dùng USER_ENTERED, worksheet.update mặc định RAW
+USER_ENTERED = "USER_ENTERED"
+RAW = "RAW"
+
+# Model chat của agent dạng "module:tên" (ví dụ fake_chat_model:FakeChatModel), mặc định gpt-4o-mini
+CHAT_MODEL = os.getenv("CHAT_MODEL", "")
+
+# Vùng đã đọc được dùng lại trong chừng này giây, sau đó đọc lại từ Google Sheets
+READ_CACHE_TTL = 60.0
+READ_CACHE_MAX_RANGES = 256
+
+_A1_RE = re.compile(r"^\$?([A-Za-z]*)\$?(\d*)$")
+
+# (hàng đầu, cột đầu, hàng cuối, cột cuối), tính từ 1; vùng mở (A:C, 2:5) dùng vô cực
+Bounds = Tuple[float, float, float, float]
+
+
+def _column_number(letters: str) -> int:
+    number = 0
+    for letter in letters.upper():
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+def a1_bounds(range_str: str) -> Bounds:
+    """Vùng ô của một range A1 ("B2", "A1:C5", "A:C", "2:5"), bỏ qua tên sheet nếu có"""
+    range_str = range_str.rsplit("!", 1)[-1]
+    corners = []
+    for part in range_str.split(":")[:2]:
+        match = _A1_RE.match(part.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            raise ValueError(f"Range không hợp lệ: {range_str}")
+        letters, digits = match.groups()
+        corners.append((int(digits) if digits else None, _column_number(letters) if letters else None))
+    (row1, col1), (row2, col2) = corners[0], corners[-1]
+    return (row1 or 1, col1 or 1, row2 or float("inf"), col2 or float("inf"))
+
+
+def _overlaps(first: Bounds, second: Bounds) -> bool:
+    return not (first[2] < second[0] or second[2] < first[0] or first[3] < second[1] or second[3] < first[1])
+
+
+def _trim(values: List[List[str]]) -> List[List[str]]:
+    """Bỏ ô rỗng cuối hàng và hàng rỗng cuối vùng, giống kết quả của Sheets API"""
+    values = [list(row) for row in values]
+    for row in values:
+        while row and row[-1] == "":
+            row.pop()
+    while values and not values[-1]:
+        values.pop()
+    return values
+
+
+class RangeCache:
+    """Cache đọc xuyên các vùng đã đọc của một spreadsheet, theo tên sheet (LRU + TTL)
+
+    Một lần đọc nằm trong một vùng đã đọc và chưa hết hạn được cắt ra từ vùng đó. Các
+    lệnh ghi của toolkit cập nhật thẳng vào các vùng chứa ô được ghi; công thức ("=...")
+    làm mất hiệu lực các vùng đó vì giá trị của nó chỉ tính được ở phía Google.
+    """
+
+    def __init__(self, ttl: float = READ_CACHE_TTL, max_entries: int = READ_CACHE_MAX_RANGES,
+                 clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        # (tên sheet, bounds) -> (hạn dùng, values tính từ góc trên trái của bounds)
+        self._entries: "OrderedDict[Tuple[str, Bounds], Tuple[float, List[List[str]]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, sheet_name: str, bounds: Bounds) -> Optional[List[List[str]]]:
+        """Giá trị của vùng `bounds` nếu nằm trong một vùng đã cache, None nếu không"""
+        now = self._clock()
+        with self._lock:
+            for key, (expires, values) in list(self._entries.items()):
+                if expires < now:
+                    del self._entries[key]
+                    continue
+                name, cached = key
+                if name != sheet_name or not (cached[0] <= bounds[0] and cached[1] <= bounds[1]
+                                              and bounds[2] <= cached[2] and bounds[3] <= cached[3]):
+                    continue
+                self._entries.move_to_end(key)
+                self.hits += 1
+                row_end = None if bounds[2] == float("inf") else int(bounds[2] - cached[0]) + 1
+                col_end = None if bounds[3] == float("inf") else int(bounds[3] - cached[1]) + 1
+                row_start, col_start = int(bounds[0] - cached[0]), int(bounds[1] - cached[1])
+                return _trim([row[col_start:col_end] for row in values[row_start:row_end]])
+            self.misses += 1
+            return None
+
+    def put(self, sheet_name: str, bounds: Bounds, values: List[List[str]]) -> None:
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            # Vùng mới chứa trọn vùng cũ thì vùng cũ không còn cần
+            for name, cached in [key for key in self._entries if key[0] == sheet_name]:
+                if (bounds[0] <= cached[0] and bounds[1] <= cached[1]
+                        and cached[2] <= bounds[2] and cached[3] <= bounds[3]):
+                    del self._entries[(name, cached)]
+            self._entries[(sheet_name, bounds)] = (self._clock() + self.ttl, [list(row) for row in values])
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def apply_write(self, sheet_name: str, bounds: Bounds, values: List[List[str]]) -> None:
+        """Cập nhật các vùng đã cache theo một lệnh ghi `values` bắt đầu từ góc trên trái của `bounds`"""
+        has_formula = any(isinstance(value, str) and value.startswith("=") for row in values for value in row)
+        written = (bounds[0], bounds[1], bounds[0] + len(values) - 1,
+                   bounds[1] + max((len(row) for row in values), default=1) - 1)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == sheet_name and _overlaps(key[1], written)]:
+                if has_formula:
+                    del self._entries[key]
+                    continue
+                cached = key[1]
+                cached_values = self._entries[key][1]
+                for row_offset, row_values in enumerate(values):
+                    row = int(written[0] + row_offset)
+                    if not cached[0] <= row <= cached[2]:
+                        continue
+                    cached_row_index = int(row - cached[0])
+                    while len(cached_values) <= cached_row_index:
+                        cached_values.append([])
+                    cached_row = cached_values[cached_row_index]
+                    for col_offset, value in enumerate(row_values):
+                        col = int(written[1] + col_offset)
+                        if not cached[1] <= col <= cached[3]:
+                            continue
+                        while len(cached_row) <= col - cached[1]:
+                            cached_row.append("")
+                        cached_row[int(col - cached[1])] = "" if value is None else str(value)
+
+    def invalidate(self, sheet_name: Optional[str] = None) -> int:
+        """Bỏ các vùng đã cache của một sheet (hoặc của mọi sheet), trả về số vùng đã bỏ"""
+        with self._lock:
+            keys = [key for key in self._entries if sheet_name is None or key[0] == sheet_name]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+            }
+
+
 class GoogleSheetsToolkit:
-    def __init__(self, credentials_path: str = "path/to/credentials.json"):
-        """Khởi tạo bộ công cụ Google Sheets với đường dẫn đến tệp credentials."""
+    def __init__(self, credentials_path: str = "path/to/credentials.json", client=None,
+                 cache_ttl: float = READ_CACHE_TTL):
+        """Khởi tạo bộ công cụ Google Sheets với đường dẫn đến tệp credentials.
+
+        Có thể truyền sẵn `client` (ví dụ fake_gspread.FakeClient) để không cần credentials.
+        Handle của các sheet được cache theo tên; các lệnh ghi được gom lại và gửi bằng một
+        request batchUpdate khi gọi flush() (cuối mỗi lượt agent) hoặc khi một lệnh đọc
+        chạm vào vùng đang chờ ghi. Các vùng đã đọc được giữ trong `read_cache` tối đa
+        `cache_ttl` giây (0 để tắt) và được cập nhật theo các lệnh ghi của toolkit.
+        """
         self.credentials_path = credentials_path
-        self.client = None
+        self.client = client
         self.spreadsheet = None
-        
+        self._lock = threading.RLock()
+        self._worksheets: Dict[str, object] = {}
+        # (tên sheet, range, valueInputOption) -> values; dict giữ thứ tự ghi
+        self._pending: Dict[Tuple[str, str, str], List[List[str]]] = {}
+        self.read_cache = RangeCache(ttl=cache_ttl)
+
     def connect(self, spreadsheet_id: str = None):
         """Kết nối với Google Sheets API và mở spreadsheet theo ID."""
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.credentials_path, scope)
-        self.client = gspread.authorize(creds)
+        # Client được dùng chung với indexer cho cùng một file credentials
+        if self.client is None:
+            self.client = get_client(self.credentials_path)
         
         if spreadsheet_id:
-            self.spreadsheet = self.client.open_by_key(spreadsheet_id)
+            self._set_spreadsheet(self.client.open_by_key(spreadsheet_id))
             return self.spreadsheet
         return None
     
@@ -32,9 +206,111 @@ class GoogleSheetsToolkit:
         """Tạo spreadsheet mới với tiêu đề cho trước."""
         if not self.client:
             self.connect()
-        self.spreadsheet = self.client.create(title)
+        self._set_spreadsheet(self.client.create(title))
         return self.spreadsheet
+
+    def _set_spreadsheet(self, spreadsheet) -> None:
+        # Ghi nốt các thay đổi của spreadsheet cũ trước khi chuyển
+        self.flush()
+        with self._lock:
+            self.spreadsheet = spreadsheet
+            self._worksheets = {}
+            self.read_cache.invalidate()
+
+    def invalidate_worksheets(self) -> None:
+        """Bỏ cache handle của các sheet (khi sheet được thêm/đổi tên từ bên ngoài)"""
+        with self._lock:
+            self._worksheets = {}
+
+    def _worksheet(self, sheet_name: str):
+        """Handle của sheet theo tên; lần đầu (hoặc khi không thấy) lấy cả danh sách trong một request"""
+        with self._lock:
+            worksheet = self._worksheets.get(sheet_name)
+            if worksheet is None:
+                self._worksheets = {sheet.title: sheet for sheet in call_with_retry(self.spreadsheet.worksheets)}
+                worksheet = self._worksheets.get(sheet_name)
+            if worksheet is None:
+                from gspread.exceptions import WorksheetNotFound
+
+                raise WorksheetNotFound(sheet_name)
+            return worksheet
+
+    def _queue_write(self, sheet_name: str, range_str: str, values: List[List[str]], input_option: str) -> None:
+        # Kiểm tra tên sheet ngay để agent nhận lỗi ở đúng lệnh ghi sai
+        self._worksheet(sheet_name)
+        range_str = range_str.rsplit("!", 1)[-1].strip()
+        bounds = a1_bounds(range_str)
+        with self._lock:
+            # Mỗi valueInputOption là một request riêng, nên lệnh ghi chồng lên vùng đang chờ
+            # với option khác phải đợi vùng đó được gửi để giữ đúng thứ tự ghi
+            conflict = any(name == sheet_name and option != input_option
+                           and _overlaps(bounds, a1_bounds(pending_range))
+                           for name, pending_range, option in self._pending)
+        if conflict:
+            self.flush()
+        with self._lock:
+            key = (sheet_name, range_str.upper(), input_option)
+            # Ghi lại cùng một vùng: chỉ giữ giá trị cuối, ở vị trí của lần ghi cuối
+            self._pending.pop(key, None)
+            self._pending[key] = values
+            self.read_cache.apply_write(sheet_name, bounds, values)
+            full = len(self._pending) >= MAX_PENDING_WRITES
+        if full:
+            self.flush()
+
+    def _flush_overlapping(self, sheet_name: str, range_str: str) -> None:
+        """Gửi các lệnh ghi đang chờ nếu có lệnh chạm vào vùng sắp đọc"""
+        bounds = a1_bounds(range_str)
+        with self._lock:
+            overlapping = any(name == sheet_name and _overlaps(bounds, a1_bounds(pending_range))
+                              for name, pending_range, _ in self._pending)
+        if overlapping:
+            self.flush()
+
+    @property
+    def pending_writes(self) -> int:
+        """Số vùng ô đang chờ ghi"""
+        with self._lock:
+            return len(self._pending)
+
+    def flush(self) -> int:
+        """Gửi mọi lệnh ghi đang chờ, một request values:batchUpdate cho mỗi valueInputOption
+
+        Trả về số vùng ô đã ghi. Nếu request lỗi, các lệnh ghi vẫn được giữ lại để thử lại.
+        """
+        with self._lock:
+            if not self._pending or self.spreadsheet is None:
+                return 0
+            groups: Dict[str, List[Dict]] = {}
+            for (sheet_name, range_str, input_option), values in self._pending.items():
+                groups.setdefault(input_option, []).append(
+                    {"range": f"{quote_sheet_title(sheet_name)}!{range_str}", "values": values})
+            for input_option, data in groups.items():
+                try:
+                    call_with_retry(self.spreadsheet.values_batch_update,
+                                    body={"valueInputOption": input_option, "data": data})
+                except Exception:
+                    # Cache đã mang giá trị của các lệnh ghi chưa gửi được
+                    self.read_cache.invalidate()
+                    raise
+                # Bỏ các vùng đã ghi xong, phòng khi nhóm sau bị lỗi
+                self._pending = {key: values for key, values in self._pending.items() if key[2] != input_option}
+            return sum(len(data) for data in groups.values())
     
+    def refresh_cache(self, sheet_name: str = "") -> str:
+        """
+        Bỏ dữ liệu đã đọc được lưu tạm để lần đọc sau lấy lại từ Google Sheets.
+        Dùng khi sheet có thể đã được sửa từ bên ngoài.
+
+        Args:
+            sheet_name: Tên sheet cần đọc lại; để trống để áp dụng cho mọi sheet
+
+        Returns:
+            Xác nhận đã làm mới
+        """
+        removed = self.read_cache.invalidate(sheet_name or None)
+        return f"Đã làm mới {removed} vùng dữ liệu đã đọc" + (f" của sheet {sheet_name}" if sheet_name else "")
+
     def get_spreedsheet(self):
         """Trả về spreadsheet hiện tại."""
         return self.spreadsheet
@@ -50,7 +326,14 @@ class GoogleSheetsToolkit:
         Returns:
             Giá trị trong ô theo vị trí chỉ định
         """
-        return self.spreadsheet.worksheet(sheet_name).acell(cell).value
+        bounds = a1_bounds(cell)
+        cached = self.read_cache.get(sheet_name, bounds)
+        if cached is not None:
+            return cached[0][0] if cached and cached[0] else None
+        self._flush_overlapping(sheet_name, cell)
+        value = self._worksheet(sheet_name).acell(cell).value
+        self.read_cache.put(sheet_name, bounds, [["" if value is None else value]])
+        return value
 
     def write_cell(self, sheet_name: str, cell: str, value: str) -> str:
         """
@@ -64,7 +347,7 @@ class GoogleSheetsToolkit:
         Returns:
             Xác nhận đã ghi thành công
         """
-        self.spreadsheet.worksheet(sheet_name).update_acell(cell, value)
+        self._queue_write(sheet_name, cell, [[value]], USER_ENTERED)
         return f"Đã ghi thành công giá trị '{value}' vào ô {cell} trong sheet {sheet_name}"
 
     def read_values(self, sheet_name: str, range_str: str) -> List[List[str]]:
@@ -78,7 +361,14 @@ class GoogleSheetsToolkit:
         Returns:
             Danh sách các giá trị trong phạm vi
         """
-        return self.spreadsheet.worksheet(sheet_name).get(range_str)
+        bounds = a1_bounds(range_str)
+        cached = self.read_cache.get(sheet_name, bounds)
+        if cached is not None:
+            return cached
+        self._flush_overlapping(sheet_name, range_str)
+        values = self._worksheet(sheet_name).get(range_str)
+        self.read_cache.put(sheet_name, bounds, values)
+        return values
 
     def write_values(self, sheet_name: str, range_str: str, values: List[List[str]]) -> str:
         """
@@ -92,7 +382,7 @@ class GoogleSheetsToolkit:
         Returns:
             Xác nhận đã ghi thành công
         """
-        self.spreadsheet.worksheet(sheet_name).update(range_str, values)
+        self._queue_write(sheet_name, range_str, values, RAW)
         return f"Đã ghi thành công dữ liệu vào phạm vi {range_str} trong sheet {sheet_name}"
 
     def suggest_data_type(self, data: str) -> str:
@@ -127,68 +417,134 @@ class GoogleSheetsToolkit:
         
         return "Chuỗi"
     
-    def get_tools(self) -> List[StructuredTool]:
+    def get_tools(self) -> List["StructuredTool"]:
         """
         Trả về danh sách các công cụ dưới dạng StructuredTool
         
         Returns:
             List các công cụ
         """
+        from langchain.tools import StructuredTool
+
         tools = [
             StructuredTool.from_function(self.read_cell),
             StructuredTool.from_function(self.write_cell),
             StructuredTool.from_function(self.read_values),
             StructuredTool.from_function(self.write_values),
+            StructuredTool.from_function(self.refresh_cache),
             StructuredTool.from_function(self.suggest_data_type)
         ]
         return tools
 
 
-# Khởi tạo toolkit và kết nối với spreadsheet
-toolkit = GoogleSheetsToolkit(
-    credentials_path="./secret/glass-core-386002-9a86ff813d4a.json")
-toolkit.connect("1g9lniOcnHfB-v8FMKZWYocavO9TLm-mr6zM6JY2XLMk")
-# toolkit.create_spreadsheet("Dữ liệu mẫu LangGraph")
+def load_chat_model(spec: str = ""):
+    """Tạo model chat từ "module:tên" (class hoặc hàm không tham số), mặc định là gpt-4o-mini của OpenAI"""
+    if not spec:
+        from langchain_openai import ChatOpenAI
 
+        return ChatOpenAI(model="gpt-4o-mini", temperature=0, streaming=True)
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
 
-# Sử dụng LangGraph ReAct agent
-def example_with_react_agent():
-    # Tạo và kết nối Google Sheets toolkit
-    try:
-        # Lấy các tool từ toolkit
-        tools = toolkit.get_tools()
 
-        # Khởi tạo mô hình ngôn ngữ (LLM)
-        model = ChatOpenAI(model="gpt-4o-mini", temperature=0)
+class AgentSession:
+    """ReAct agent của một toolkit: tools và graph được tạo một lần, lịch sử hội thoại giữ qua các lượt
+
+    Lịch sử nằm trong checkpointer của graph theo `thread_id`; reset() bắt đầu hội thoại mới.
+    """
+
+    def __init__(self, toolkit: GoogleSheetsToolkit, model=None):
+        from langgraph.checkpoint.memory import MemorySaver
+        from langgraph.prebuilt import create_react_agent
+
+        self.toolkit = toolkit
+        self.tools = toolkit.get_tools()
+        self.graph = create_react_agent(model if model is not None else load_chat_model(CHAT_MODEL),
+                                        tools=self.tools, checkpointer=MemorySaver())
+        self.thread_id = uuid.uuid4().hex
+        # Lỗi khi gửi các ô đã ghi ở cuối lượt trước, báo cho model ở đầu lượt sau
+        self._flush_error: Optional[str] = None
+
+    def reset(self) -> None:
+        """Bắt đầu hội thoại mới (graph và tools vẫn dùng lại)"""
+        self.thread_id = uuid.uuid4().hex
+
+    def stream(self, user_input: str) -> Iterator[Dict]:
+        """Chạy một lượt agent, trả về sự kiện ngay khi có
         
-        # Tạo ReAct agent
-        graph = create_react_agent(model, tools=tools)
+        Mỗi sự kiện là {"type": "token", "content"} cho từng đoạn câu trả lời,
+        {"type": "tool_call", "name"} khi agent gọi một tool và {"type": "tool_result", "name",
+        "content"} khi tool chạy xong. Cuối lượt, các ô agent đã ghi được gửi bằng toolkit.flush();
+        nếu gửi lỗi, sự kiện cuối là {"type": "error", "content"}, các lệnh ghi được giữ lại để gửi
+        lần sau và lỗi được đưa vào hội thoại ở đầu lượt tiếp theo để model biết.
+        Thời gian tới token đầu tiên và của cả lượt được ghi vào histogram agent_turn_seconds.
+        """
+        started = time.perf_counter()
+        first_token = True
+        config = {"configurable": {"thread_id": self.thread_id}}
+        messages = [("user", user_input)]
+        if self._flush_error:
+            messages.insert(0, ("system", self._flush_error))
+            self._flush_error = None
+        for message, _ in self.graph.stream({"messages": messages}, config, stream_mode="messages"):
+            if message.type == "tool":
+                yield {"type": "tool_result", "name": message.name, "content": message.content}
+                continue
+            if message.type not in ("ai", "AIMessageChunk"):
+                continue
+            # Tên tool có ngay ở đoạn đầu tiên của lần gọi; model không stream thì có sẵn tool_calls
+            names = [chunk["name"] for chunk in getattr(message, "tool_call_chunks", None) or [] if chunk.get("name")]
+            if message.type == "ai":
+                names = [tool_call["name"] for tool_call in message.tool_calls]
+            for name in names:
+                yield {"type": "tool_call", "name": name}
+            if isinstance(message.content, str) and message.content:
+                if first_token:
+                    REGISTRY.observe("agent_turn_seconds", time.perf_counter() - started, part="first_token")
+                    first_token = False
+                yield {"type": "token", "content": message.content}
+        # Gửi các ô agent đã ghi trong lượt này bằng một request batchUpdate
+        try:
+            self.toolkit.flush()
+        except Exception as e:
+            self._flush_error = (f"Các ô đã ghi ở lượt trước chưa được gửi lên Google Sheets (lỗi: {e}). "
+                                 "Chúng được giữ lại và sẽ được gửi cùng lần ghi tiếp theo.")
+            yield {"type": "error", "content": f"Lỗi khi ghi dữ liệu vào Google Sheets: {e}"}
+        REGISTRY.observe("agent_turn_seconds", time.perf_counter() - started, part="total")
+
+
+# Sử dụng LangGraph ReAct agent
+def example_with_react_agent(toolkit: GoogleSheetsToolkit):
+    try:
+        # Tools, model và graph được tạo một lần; các yêu cầu sau thấy được lịch sử của yêu cầu trước
+        session = AgentSession(toolkit)
         
         print("Agent đã được khởi tạo thành công. Bắt đầu thử nghiệm...")
         
-        # Hàm hiển thị kết quả từ stream
-        def print_stream(stream):
-            for s in stream:
-                message = s["messages"][-1]
-                if isinstance(message, tuple):
-                    print(message)
+        # Hiển thị câu trả lời ngay khi từng token về
+        def print_stream(user_input: str):
+            for event in session.stream(user_input):
+                if event["type"] == "token":
+                    print(event["content"], end="", flush=True)
+                elif event["type"] == "tool_call":
+                    print(f"\n[Gọi {event['name']}]")
+                elif event["type"] == "error":
+                    print(f"\n[Lỗi] {event['content']}")
                 else:
-                    print(f"AI: {message.content}")
+                    print(f"[{event['name']}] {event['content']}")
+            print()
 
         # Tạo bảng với 3 cột và thêm 5 sản phẩm
         print("\n== Yêu cầu 1: Tạo bảng với 3 cột và thêm sản phẩm ==")
-        inputs = {"messages": [("user", "Tạo bảng với 3 cột: Sản phẩm, Số lượng, Giá, range từ A1 tới C6 và thêm 5 sản phẩm vào bảng")]}
-        print_stream(graph.stream(inputs, stream_mode="values"))
+        print_stream("Tạo bảng với 3 cột: Sản phẩm, Số lượng, Giá, range từ A1 tới C6 và thêm 5 sản phẩm vào bảng")
         
         # Đọc dữ liệu và tính tổng
         print("\n== Yêu cầu 2: Đọc dữ liệu và tính tổng ==")
-        inputs = {"messages": [("user", "Đọc dữ liệu ở ô A1 đến C6 và tính tổng số lượng của tất cả sản phẩm")]}
-        print_stream(graph.stream(inputs, stream_mode="values"))
+        print_stream("Đọc dữ liệu của bảng vừa tạo và tính tổng số lượng của tất cả sản phẩm")
         
         # Tạo bảng doanh thu theo tháng
         print("\n== Yêu cầu 3: Tạo bảng doanh thu ==")
-        inputs = {"messages": [("user", "Tạo một bảng dữ liệu mới với các cột: Tháng, Doanh thu, Chi phí, Lợi nhuận. Thêm dữ liệu cho các tháng từ T1-T6/2023")]}
-        print_stream(graph.stream(inputs, stream_mode="values"))
+        print_stream("Tạo một bảng dữ liệu mới với các cột: Tháng, Doanh thu, Chi phí, Lợi nhuận. Thêm dữ liệu cho các tháng từ T1-T6/2023")
         
         return "Quá trình thực thi hoàn tất!"
     
@@ -197,4 +553,9 @@ def example_with_react_agent():
         return f"Lỗi: {str(e)}"
 
 if __name__ == "__main__":
-    example_with_react_agent()
\ No newline at end of file
+    # Khởi tạo toolkit và kết nối với spreadsheet
+    toolkit = GoogleSheetsToolkit(
+        credentials_path="./secret/glass-core-386002-9a86ff813d4a.json")
+    toolkit.connect("1g9lniOcnHfB-v8FMKZWYocavO9TLm-mr6zM6JY2XLMk")
+    # toolkit.create_spreadsheet("Dữ liệu mẫu LangGraph")
+    example_with_react_agent(toolkit)
\ No newline at end of file
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import threading
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+# Snapshot nằm cạnh thư mục ./chroma_db
+SNAPSHOT_PATH = "./sheet_snapshots.sqlite3"
+
+# Mức nén zlib: dữ liệu spec lặp lại nhiều theo cột nên mức vừa phải đã nén tốt
+COMPRESSION_LEVEL = 6
+
+# (tên tab, sheet_id, toàn bộ giá trị của tab), giống indexer.SheetValues
+SheetValues = Tuple[str, str, List[List[str]]]
+
+
+def encode_values(values: List[List[str]]) -> bytes:
+    """Nén giá trị của một tab theo cột: các ô cùng cột thường giống nhau nên nén tốt hơn theo hàng"""
+    width = max((len(row) for row in values), default=0)
+    columns = [[row[col] if col < len(row) else "" for row in values] for col in range(width)]
+    payload = {"rows": len(values), "columns": columns}
+    return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                         COMPRESSION_LEVEL)
+
+
+def decode_values(blob: bytes) -> List[List[str]]:
+    """Giải nén về dạng hàng như values_batch_get (bỏ các ô rỗng ở cuối hàng)"""
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    if payload["columns"]:
+        rows = [list(row) for row in zip(*payload["columns"])]
+    else:
+        rows = [[] for _ in range(payload["rows"])]
+    values = []
+    for row in rows[:payload["rows"]]:
+        while row and row[-1] == "":
+            row.pop()
+        values.append(row)
+    return values
+
+
+class SnapshotStore:
+    """Lưu giá trị thô của từng tab theo (file_id, sheet_id, revision)
+
+    Revision là modifiedTime của file trên Drive. Mỗi file chỉ giữ snapshot của revision
+    mới nhất, đủ để chia và embed lại toàn bộ index mà không gọi Google API.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                file_id TEXT PRIMARY KEY,
+                folder_id TEXT,
+                file_name TEXT,
+                revision TEXT
+            );
+            CREATE TABLE IF NOT EXISTS sheets (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                revision TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                tab_name TEXT NOT NULL,
+                data BLOB NOT NULL,
+                PRIMARY KEY (file_id, sheet_id, revision)
+            );
+            CREATE INDEX IF NOT EXISTS snapshot_files_folder ON files (folder_id);
+        """)
+        self._conn.commit()
+
+    def save(self, file_info: Dict, folder_id: Optional[str], sheets_values: List[SheetValues]) -> None:
+        """Lưu snapshot của một file, thay cho snapshot của revision cũ"""
+        file_id = file_info["id"]
+        revision = file_info.get("modifiedTime") or ""
+        rows = [
+            (file_id, str(sheet_id), revision, position, tab_name, encode_values(values))
+            for position, (tab_name, sheet_id, values) in enumerate(sheets_values)
+        ]
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO files (file_id, folder_id, file_name, revision) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(file_id) DO UPDATE SET folder_id = COALESCE(excluded.folder_id, files.folder_id), "
+                "file_name = excluded.file_name, revision = excluded.revision",
+                (file_id, folder_id, file_info.get("name"), revision)
+            )
+            self._conn.execute("DELETE FROM sheets WHERE file_id = ?", (file_id,))
+            self._conn.executemany(
+                "INSERT INTO sheets (file_id, sheet_id, revision, position, tab_name, data) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def has(self, file_id: str, revision: Optional[str] = None) -> bool:
+        """Đã có snapshot của file (đúng `revision` nếu truyền vào)"""
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM files WHERE file_id = ?", (file_id,)).fetchone()
+        return row is not None and (revision is None or row[0] == revision)
+
+    def load(self, file_id: str) -> List[SheetValues]:
+        """Giá trị của các tab theo đúng thứ tự lúc tải; lỗi KeyError nếu chưa có snapshot"""
+        with self._lock:
+            row = self._conn.execute("SELECT revision FROM files WHERE file_id = ?", (file_id,)).fetchone()
+            if row is None:
+                raise KeyError(f"Không có snapshot cho file {file_id}")
+            sheets = self._conn.execute(
+                "SELECT tab_name, sheet_id, data FROM sheets WHERE file_id = ? AND revision = ? ORDER BY position",
+                (file_id, row[0])
+            ).fetchall()
+        return [(tab_name, sheet_id, decode_values(data)) for tab_name, sheet_id, data in sheets]
+
+    def files(self, folder_id: Optional[str] = None) -> List[Dict]:
+        """file_info (id, name, modifiedTime) của các file có snapshot, lọc theo folder nếu có"""
+        query = "SELECT file_id, file_name, revision, folder_id FROM files"
+        params: Tuple = ()
+        if folder_id is not None:
+            query += " WHERE folder_id = ?"
+            params = (folder_id,)
+        with self._lock:
+            rows = self._conn.execute(query, params).fetchall()
+        return [
+            {"id": file_id, "name": name, "modifiedTime": revision, "folder_id": folder}
+            for file_id, name, revision, folder in rows
+        ]
+
+    def size(self) -> Dict:
+        """Số file, số tab và tổng số byte đã nén"""
+        with self._lock:
+            files = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+            sheets, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM sheets").fetchone()
+        return {"files": files, "sheets": sheets, "bytes": size}
+
+    def remove(self, file_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM sheets WHERE file_id = ?", (file_id,))
+
+    def close(self) -> None:
+        self._conn.close()
@@ -0,0 +1,134 @@
+import hashlib
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+if TYPE_CHECKING:
+    import gspread
+
+# Quota đọc mặc định của Sheets API cho mỗi user mỗi phút
+DEFAULT_READS_PER_MINUTE = 60
+
+SCOPES = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+# Số kết nối keep-alive tối đa tới mỗi host của Google trong một client
+DEFAULT_POOL_MAXSIZE = 32
+
+# Các mã lỗi HTTP nên thử lại (quota và lỗi tạm thời phía Google)
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket dùng chung giữa các thread để giữ số request dưới quota mỗi phút"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None,
+                 clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep):
+        if rate_per_minute <= 0:
+            raise ValueError("rate_per_minute phải lớn hơn 0")
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_minute / 10.0)
+        self.tokens = self.capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Chờ cho tới khi đủ token rồi trừ đi"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            self._sleep(wait)
+
+
+def status_code(exc: Exception) -> Optional[int]:
+    """Lấy mã HTTP từ lỗi của gspread (APIError có thuộc tính response)"""
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(exc: Exception) -> bool:
+    return status_code(exc) in RETRYABLE_STATUS_CODES
+
+
+def call_with_retry(func: Callable, *args, limiter: Optional[TokenBucket] = None,
+                    max_retries: int = 5, base_delay: float = 1.0, max_delay: float = 32.0,
+                    sleep: Callable[[float], None] = time.sleep, **kwargs):
+    """Gọi một request tới Google API, thử lại với exponential backoff khi gặp 429/5xx
+
+    Mỗi lần gọi (kể cả lần thử lại) đều lấy một token từ `limiter` nếu có.
+    """
+    attempt = 0
+    while True:
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            if attempt >= max_retries or not is_retryable(e):
+                raise
+            # Backoff kèm jitter để các thread không thử lại cùng lúc
+            delay = min(max_delay, base_delay * (2 ** attempt))
+            sleep(delay / 2 + random.uniform(0, delay / 2))
+            attempt += 1
+
+
+_clients: Dict[str, "gspread.Client"] = {}
+_clients_lock = threading.Lock()
+
+
+def _credentials_key(credentials_path: str) -> str:
+    # Khóa theo nội dung file, vì app ghi lại file credentials tải lên ở cùng một đường dẫn
+    with open(credentials_path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def get_client(credentials_path: str, pool_maxsize: int = DEFAULT_POOL_MAXSIZE) -> "gspread.Client":
+    """Trả về gspread client đã xác thực, dùng chung cho mỗi file credentials
+
+    Client giữ một AuthorizedSession (requests.Session) nên các request dùng lại
+    kết nối keep-alive và access token được cache tới khi hết hạn.
+    """
+    key = _credentials_key(credentials_path)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            # Import khi cần để các module chỉ tìm kiếm không phải nạp gspread/oauth2client
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            from requests.adapters import HTTPAdapter
+
+            creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, SCOPES)
+            client = gspread.authorize(creds)
+            # Đủ kết nối cho các thread tải song song trong index_folder
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_maxsize)
+            client.session.mount("https://", adapter)
+            _clients[key] = client
+        return client
+
+
+def quote_sheet_title(title: str) -> str:
+    """Tên tab dạng range A1 (bao bởi dấu nháy đơn) để dùng trong values batchGet"""
+    return "'{}'".format(title.replace("'", "''"))
+
+
+def batch_get_values(spreadsheet, titles: List[str], limiter: Optional[TokenBucket] = None) -> List[List[List[str]]]:
+    """Đọc giá trị của nhiều tab trong một request values:batchGet, theo thứ tự `titles`"""
+    if not titles:
+        return []
+    response = call_with_retry(
+        spreadsheet.values_batch_get,
+        [quote_sheet_title(title) for title in titles],
+        limiter=limiter
+    )
+    return [value_range.get("values", []) for value_range in response.get("valueRanges", [])]
@@ -0,0 +1,36 @@
+"""Dữ liệu giả lập của benchmark phải tái lập được và so sánh baseline đúng chiều"""
+from benchmarks.run import compare
+from benchmarks.synthetic import HashEmbeddingFunction, populate_client
+from fake_gspread import FakeClient
+from resources import load_embedding_function
+
+
+def test_same_seed_generates_same_folder():
+    first, second = FakeClient(), FakeClient()
+    ids = populate_client(first, files=2, tabs=2, rows=5, cols=3, seed=7)
+    assert populate_client(second, files=2, tabs=2, rows=5, cols=3, seed=7) == ids
+
+    for file_id in ids:
+        assert [sheet.values for sheet in first.spreadsheets[file_id]._worksheets] == \
+            [sheet.values for sheet in second.spreadsheets[file_id]._worksheets]
+
+
+def test_embedding_function_is_loaded_from_spec():
+    embed = load_embedding_function("benchmarks.synthetic:HashEmbeddingFunction")
+
+    assert isinstance(embed, HashEmbeddingFunction)
+    vectors = embed(["màn hình", "màn hình", "báo cáo"])
+    assert vectors[0] == vectors[1] != vectors[2]
+    assert len(vectors[0]) == HashEmbeddingFunction.DIMENSIONS
+
+
+def test_compare_flags_regressions_in_the_right_direction():
+    baseline = {"metrics": {"index": {"cells_per_sec": 1000.0, "cells": 50},
+                            "query": {"p99_ms": 10.0, "p50_ms": 5.0}}}
+    results = {"metrics": {"index": {"cells_per_sec": 700.0, "cells": 80},
+                           "query": {"p99_ms": 11.0, "p50_ms": 7.0}}}
+
+    rows = {row["metric"]: row["regression"] for row in compare(results, baseline, tolerance=0.25)}
+
+    # Số ô chỉ để tham khảo, không so sánh
+    assert rows == {"index.cells_per_sec": True, "query.p99_ms": False, "query.p50_ms": True}
@@ -0,0 +1,55 @@
+"""Cache embedding theo nội dung: trùng nội dung chỉ embed một lần, loại bỏ theo LRU"""
+from embedding_cache import CachedEmbeddingFunction, EmbeddingCache, cache_key
+
+
+class CountingEmbedding:
+    MODEL_NAME = "counting"
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+
+def test_duplicates_are_embedded_once(tmp_path):
+    model = CountingEmbedding()
+    embed = CachedEmbeddingFunction(model, EmbeddingCache(str(tmp_path / "cache.sqlite3")))
+
+    vectors = embed(["Màn hình", "Báo cáo", "Màn  hình "])
+
+    # Nội dung giống nhau sau khi chuẩn hóa khoảng trắng dùng chung một embedding
+    assert model.calls == [["Màn hình", "Báo cáo"]]
+    assert vectors[0] == vectors[2]
+    assert embed(["Báo cáo"]) == [vectors[1]]
+    assert len(model.calls) == 1
+    assert embed.stats()["hits"] == 2 and embed.stats()["misses"] == 2
+
+
+def test_cache_survives_restart_and_separates_models(tmp_path):
+    path = str(tmp_path / "cache.sqlite3")
+    CachedEmbeddingFunction(CountingEmbedding(), EmbeddingCache(path))(["Màn hình"])
+
+    model = CountingEmbedding()
+    embed = CachedEmbeddingFunction(model, EmbeddingCache(path))
+    embed(["Màn hình"])
+    assert model.calls == []
+
+    other = CachedEmbeddingFunction(model, EmbeddingCache(path), model_id="other-model")
+    other(["Màn hình"])
+    assert model.calls == [["Màn hình"]]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / "cache.sqlite3"), max_entries=10)
+    keys = [cache_key(f"text {i}", "m") for i in range(10)]
+    cache.put_many({key: [1.0] for key in keys})
+    cache.get_many(keys[:2])
+
+    cache.put_many({cache_key("new", "m"): [2.0]})
+
+    # Vượt quá 10 entry thì giữ lại 90%: hai key vừa đọc và key mới còn, key cũ nhất bị xóa
+    assert len(cache) == 9
+    assert set(cache.get_many(keys[:2] + [cache_key("new", "m")])) == set(keys[:2] + [cache_key("new", "m")])
+    assert cache.get_many(keys[2:4]) == {}
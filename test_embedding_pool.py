@@ -0,0 +1,44 @@
+"""EmbeddingPool phải trả đúng vector như embedding function chạy trong process hiện tại"""
+import os
+
+import numpy as np
+import pytest
+
+from embedding_pool import THREAD_ENV_VARS, EmbeddingPool, _limit_onnx_threads
+from resources import load_embedding_function
+
+SPEC = "benchmarks.synthetic:HashEmbeddingFunction"
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = EmbeddingPool(SPEC, workers=2, min_batch=4)
+    yield pool
+    pool.close()
+
+
+def test_pool_matches_local_embeddings(pool):
+    texts = [f"Màn hình SCR-{i:03d}" for i in range(10)]
+    expected = np.asarray(load_embedding_function(SPEC)(texts), dtype=np.float32)
+
+    vectors = pool(texts)
+
+    assert vectors.shape == (10, pool.dimension)
+    np.testing.assert_allclose(vectors, expected, rtol=1e-6)
+
+
+def test_pool_handles_empty_input(pool):
+    assert pool([]).shape == (0, pool.dimension)
+
+
+def test_workers_limit_library_threads(pool):
+    for name in THREAD_ENV_VARS:
+        assert pool._executor.submit(os.getenv, name).result() == "1"
+
+
+def test_onnx_thread_limit_fails_loudly_without_a_session():
+    from chromadb.utils.embedding_functions import ONNXMiniLM_L6_V2
+
+    # Model chưa được nạp: báo lỗi thay vì bỏ qua giới hạn thread
+    with pytest.raises(RuntimeError):
+        _limit_onnx_threads(ONNXMiniLM_L6_V2(), 1)
@@ -0,0 +1,94 @@
+"""Snapshot index: xuất rồi nạp vào thư mục mới phải cho lại đúng index mà không embed lại"""
+import json
+import struct
+
+import pytest
+
+from conftest import _clear_resources
+from fake_gspread import FakeClient
+from index_snapshot import DATA_OFFSET, MAGIC, export_index, import_index
+
+HEADER = ["Mã", "Tên màn hình"]
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [HEADER, ["SCR-001", "Đăng nhập"], ["SCR-002", "Báo cáo"]]},
+                           folder_id="folder")
+    return client
+
+
+@pytest.fixture
+def snapshot(index_dir, client):
+    from indexer import index_folder
+
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9)["success"]
+    path = str(index_dir / "spec_index.idx")
+    result = export_index(path)
+    assert result["success"], result["message"]
+    assert result["details"]["documents"] == 6
+    return path
+
+
+def move_to_new_index(tmp_path, monkeypatch):
+    replica = tmp_path / "replica"
+    replica.mkdir()
+    monkeypatch.chdir(replica)
+    _clear_resources()
+
+
+def test_import_restores_every_index(snapshot, client, index_dir, monkeypatch):
+    import resources
+    from indexer import index_folder
+    from search import hybrid_search
+
+    move_to_new_index(index_dir, monkeypatch)
+    result = import_index(snapshot)
+
+    assert result["success"], result["message"]
+    assert result["details"] == {**result["details"], "documents": 6, "files": 1}
+    assert resources.get_collection().count() == resources.get_lexical_index().count() == 6
+    files = resources.get_facet_index().facets()["files"]
+    assert [(item["label"], item["count"]) for item in files] == [("Spec A", 6)]
+    hits = hybrid_search("SCR-002", resources.get_collection(), resources.get_lexical_index())
+    assert hits[0]["metadata"]["row"] == "3"
+
+    # Manifest đi kèm snapshot: lần index tăng dần sau đó bỏ qua file chưa đổi
+    requests = client.requests
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9)["details"]["skipped"] == 1
+    assert client.requests == requests + 1
+
+
+def test_import_refuses_to_overwrite_without_replace(snapshot):
+    import resources
+
+    result = import_index(snapshot)
+    assert not result["success"]
+
+    assert import_index(snapshot, replace=True)["success"]
+    assert resources.get_collection().count() == 6
+
+
+def test_import_rejects_corrupted_or_foreign_snapshots(snapshot, index_dir, monkeypatch):
+    with open(snapshot, "r+b") as f:
+        f.seek(DATA_OFFSET)
+        f.write(b"\xff\xff\xff\xff")
+    move_to_new_index(index_dir, monkeypatch)
+
+    assert "Checksum" in import_index(snapshot)["message"]
+
+    with open(snapshot, "r+b") as f:
+        header_offset, header_length = struct.unpack("<QQ", f.read(len(MAGIC) + 16)[len(MAGIC):])
+        f.seek(header_offset)
+        header = json.loads(f.read(header_length))
+        header["model"]["checksum"] = "0" * 64
+        f.seek(header_offset)
+        data = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        f.write(data)
+        f.truncate()
+        f.seek(len(MAGIC))
+        f.write(struct.pack("<QQ", header_offset, len(data)))
+
+    result = import_index(snapshot)
+    assert not result["success"] and "model embedding khác" in result["message"]
@@ -0,0 +1,378 @@
+"""Index tăng dần qua FakeClient: collection, BM25, facet và value index phải luôn khớp nhau"""
+import os
+import subprocess
+import sys
+import threading
+
+import pytest
+
+from fake_gspread import FakeClient
+from index_manifest import IndexManifest
+from indexer import (ChromaBatchWriter, SheetWindows, fetch_spreadsheet, index_folder, iter_sheet_units,
+                     rebuild_from_snapshots)
+from sheet_snapshots import SnapshotStore, decode_values, encode_values
+from sheets_api import call_with_retry
+from value_index import parse_value_query
+
+FOLDER_ID = "folder"
+HEADER = ["Mã", "Tên màn hình", "Giá"]
+
+
+class RecordingCollection:
+    """Collection giả lập, ghi lại từng lần upsert/delete"""
+
+    def __init__(self):
+        self.upserts = []
+        self.deletes = []
+
+    def upsert(self, documents, metadatas, ids, embeddings=None):
+        self.upserts.append(list(ids))
+
+    def delete(self, ids):
+        self.deletes.append(list(ids))
+
+
+class RecordingSink(RecordingCollection):
+    """Sink nhận lô theo thứ tự (ids, documents, metadatas) như LexicalIndex"""
+
+    def upsert(self, ids, documents, metadatas):
+        self.upserts.append(list(ids))
+
+
+def make_rows(prefix, count, price=1000):
+    return [[f"{prefix}-{i:03d}", f"Màn hình {prefix.lower()} số {i}", str(price * i)] for i in range(1, count + 1)]
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [HEADER] + make_rows("SCR", 5)}, folder_id=FOLDER_ID)
+    client.add_spreadsheet("f2", "Spec B", {"Reports": [HEADER] + make_rows("RPT", 3, price=50)},
+                           folder_id=FOLDER_ID)
+    return client
+
+
+def touch(client, file_id, modified_time="2024-02-01T00:00:00.000Z"):
+    client.files[file_id]["modifiedTime"] = modified_time
+
+
+def run_index(client, **kwargs):
+    result = index_folder(FOLDER_ID, None, client=client, reads_per_minute=1e9, **kwargs)
+    assert result["success"], result["message"]
+    return result["details"]
+
+
+def documents_of(file_id):
+    from resources import get_collection
+
+    return sorted(get_collection().get(where={"file_id": file_id})["documents"])
+
+
+def value_files(query="col:Giá > 0"):
+    from resources import get_value_index
+
+    return sorted((match["file_id"], match["range"], match["value"])
+                  for match in get_value_index().lookup(parse_value_query(query)[0]))
+
+
+def assert_indexes_consistent():
+    """Chroma, BM25 và facet index chứa đúng các chunk manifest đang ghi nhận"""
+    from resources import get_collection, get_facet_index, get_lexical_index
+
+    manifest = IndexManifest()
+    try:
+        expected = sum(len(manifest.chunk_ids(file_id)) for file_id in manifest.files_in_folder(FOLDER_ID))
+    finally:
+        manifest.close()
+    assert get_collection().count() == expected
+    assert get_lexical_index().count() == expected
+    assert get_facet_index().count() == expected
+
+
+def test_import_has_no_side_effects(tmp_path):
+    repo_root = os.path.dirname(os.path.abspath(__file__))
+    code = "import sys, indexer, resources, search; print('chromadb' in sys.modules)"
+    completed = subprocess.run([sys.executable, "-c", code], cwd=tmp_path, capture_output=True, text=True,
+                               env={**os.environ, "PYTHONPATH": repo_root}, check=True)
+
+    # Không nạp Chroma và không tạo chroma_db, manifest hay file cache nào trong thư mục hiện tại
+    assert completed.stdout.strip() == "False"
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_writer_upserts_in_batches():
+    collection = RecordingCollection()
+    writer = ChromaBatchWriter(collection, batch_size=3)
+    for i in range(7):
+        writer.add(f"doc {i}", {"i": i}, f"id{i}")
+    assert [len(ids) for ids in collection.upserts] == [3, 3]
+
+    writer.flush()
+    writer.flush()
+
+    assert [len(ids) for ids in collection.upserts] == [3, 3, 1]
+    assert writer.written == 7
+
+
+def test_writer_forwards_batches_to_sinks():
+    collection, sink = RecordingCollection(), RecordingSink()
+    writer = ChromaBatchWriter(collection, batch_size=10, sinks=[sink])
+    writer.add("a", {}, "a")
+    writer.delete(["b"])
+
+    writer.flush()
+
+    assert sink.upserts == collection.upserts == [["a"]]
+    assert sink.deletes == collection.deletes == [["b"]]
+
+
+def test_writer_context_flushes_on_success_and_discards_on_error():
+    collection = RecordingCollection()
+    with ChromaBatchWriter(collection, batch_size=10) as writer:
+        writer.add("a", {}, "a")
+    assert collection.upserts == [["a"]]
+
+    with pytest.raises(RuntimeError):
+        with ChromaBatchWriter(collection, batch_size=10) as writer:
+            writer.add("b", {}, "b")
+            writer.delete(["a"])
+            raise RuntimeError("sheet lỗi")
+
+    assert collection.upserts == [["a"]]
+    assert collection.deletes == []
+
+
+def test_writer_rejects_empty_batch():
+    with pytest.raises(ValueError):
+        ChromaBatchWriter(RecordingCollection(), batch_size=0)
+
+
+def test_initial_index(index_dir, client):
+    details = run_index(client)
+
+    assert details["successful"] == 2 and details["failed"] == 0
+    assert "SCR-001" in documents_of("f1")
+    # 3 ô header + 5 dòng x 2 ô chữ của f1, 3 ô header + 3 dòng x 2 ô chữ của f2
+    assert details["documents"] == 13 + 9
+    # Ô số không thành document mà nằm trong value index
+    assert not any(document == "1000" for document in documents_of("f1"))
+    assert ("f1", "C2", "1000") in value_files()
+    assert len(value_files()) == 8
+    assert {"list", "fetch", "split", "embed", "write", "lexical_write"} <= set(details["timings"]["stages"])
+    assert_indexes_consistent()
+
+
+def test_failed_file_does_not_block_others(index_dir, client):
+    # File vẫn được liệt kê trong folder nhưng không mở được
+    del client.spreadsheets["f2"]
+
+    details = run_index(client)
+
+    assert details["successful"] == 1 and details["failed"] == 1
+    assert details["errors"][0]["file_name"] == "Spec B"
+    assert documents_of("f2") == []
+    assert_indexes_consistent()
+
+
+def test_unchanged_files_are_skipped(index_dir, client):
+    run_index(client)
+    requests = client.requests
+
+    details = run_index(client)
+
+    assert details["skipped"] == 2
+    assert details["documents"] == 0 and details["deleted"] == 0
+    # Chỉ một request liệt kê folder, không tải lại spreadsheet nào
+    assert client.requests == requests + 1
+
+
+def test_edited_cells_are_reindexed(index_dir, client):
+    run_index(client)
+    values = client.spreadsheets["f1"]._worksheets[0].values
+    values[1][1] = "Màn hình đăng xuất"
+    values[2][2] = "999999"
+    touch(client, "f1")
+
+    details = run_index(client)
+
+    assert details["skipped"] == 1
+    # Chỉ ô chữ vừa sửa được embed lại
+    assert details["documents"] == 1
+    assert "Màn hình đăng xuất" in documents_of("f1")
+    assert "Màn hình scr số 1" not in documents_of("f1")
+    assert ("f1", "C3", "999999") in value_files()
+    assert ("f1", "C3", "2000") not in value_files()
+    assert_indexes_consistent()
+
+
+def test_deleted_rows_are_removed(index_dir, client):
+    from resources import get_lexical_index
+
+    run_index(client)
+    client.spreadsheets["f1"]._worksheets[0].values.pop()
+    touch(client, "f1")
+
+    details = run_index(client)
+
+    assert details["deleted"] == 2
+    assert not any("SCR-005" in document for document in documents_of("f1"))
+    assert not any("SCR-005" in hit["document"] for hit in get_lexical_index().search("SCR-005", 10))
+    assert ("f1", "C6", "5000") not in value_files()
+    assert len(value_files()) == 7
+    assert_indexes_consistent()
+
+
+def test_removed_file_is_dropped_everywhere(index_dir, client):
+    from resources import get_facet_index, get_value_index
+
+    run_index(client)
+    del client.files["f2"], client.spreadsheets["f2"]
+
+    details = run_index(client)
+
+    assert details["deleted"] == 9
+    assert documents_of("f2") == []
+    assert [facet["value"] for facet in get_facet_index().facets()["files"]] == ["f1"]
+    assert all(file_id == "f1" for file_id, _, _ in value_files())
+    assert [row[0] for row in get_value_index().dump()["tabs"]] == ["f1"]
+    assert_indexes_consistent()
+
+
+def test_sheet_units_by_granularity():
+    data = [HEADER] + make_rows("SCR", 3) + [["", "", ""], ["SCR-005", "", "5000"]]
+
+    cells = list(iter_sheet_units(data, "cell"))
+    assert cells[3] == ("A2", "SCR-001", {"col": "A", "row": "2", "range": "A2", "cols": "A"}, [])
+    # Ô số không có văn bản để embed, giá trị đã parse đi vào value index
+    assert cells[5] == ("C2", "", {"col": "C", "row": "2", "range": "C2", "cols": ""},
+                        [("C", 2, "Giá", "number", 1000.0, "1000")])
+
+    rows = list(iter_sheet_units(data, "row"))
+    assert [cell for cell, _, _, _ in rows] == ["A1:C1", "A2:C2", "A3:C3", "A4:C4", "A6:C6"]
+    # Mỗi ô chữ kèm tiêu đề cột, ô rỗng bị bỏ qua
+    assert rows[1][1] == "Mã: SCR-001\nTên màn hình: Màn hình scr số 1"
+    assert rows[4][1] == "Mã: SCR-005" and rows[4][2]["cols"] == "A"
+    assert rows[4][3] == [("C", 6, "Giá", "number", 5000.0, "5000")]
+
+    windows = list(iter_sheet_units(data, "row_window", row_window=3))
+    assert [cell for cell, _, _, _ in windows] == ["A1:C3", "A4:C6"]
+    assert windows[1][2] == {"col": "A", "row": "4", "range": "A4:C6", "cols": "A,B"}
+    assert [value[1] for value in windows[1][3]] == [4, 6]
+
+    with pytest.raises(ValueError):
+        list(iter_sheet_units(data, "column"))
+
+
+def test_granularity_change_reindexes_and_drops_old_ids(index_dir, client):
+    from resources import get_collection
+
+    run_index(client)
+
+    details = run_index(client, granularity="row")
+
+    # modifiedTime không đổi nhưng cấu hình đổi: index lại toàn bộ, xóa hết id theo ô
+    assert details["skipped"] == 0
+    assert details["documents"] == 6 + 4 and details["deleted"] == 22
+    row = get_collection().get(where={"$and": [{"file_id": "f1"}, {"range": "A2:C2"}]})["documents"]
+    assert row == ["Mã: SCR-001\nTên màn hình: Màn hình scr số 1"]
+    assert_indexes_consistent()
+
+
+def test_snapshot_values_round_trip():
+    values = [HEADER, ["SCR-001", "", ""], [], ["", "Màn hình", "", "x"]]
+
+    # Ô rỗng ở cuối hàng bị bỏ như values_batch_get trả về
+    assert decode_values(encode_values(values)) == [HEADER, ["SCR-001"], [], ["", "Màn hình", "", "x"]]
+    assert decode_values(encode_values([[], []])) == [[], []]
+
+
+def test_rebuild_from_snapshots_makes_no_requests(index_dir, client):
+    run_index(client, snapshot=True)
+    requests = client.requests
+
+    result = rebuild_from_snapshots(granularity="row")
+
+    assert result["success"], result["message"]
+    details = result["details"]
+    assert details["successful"] == 2 and details["failed"] == 0
+    assert details["documents"] == 6 + 4 and details["deleted"] == 22
+    assert client.requests == requests
+    assert_indexes_consistent()
+
+    snapshots = SnapshotStore()
+    try:
+        assert snapshots.load("f1")[0][2] == [HEADER] + make_rows("SCR", 5)
+    finally:
+        snapshots.close()
+
+
+def test_parallel_index_matches_sequential(index_dir, client):
+    for index in range(3, 7):
+        client.add_spreadsheet(f"f{index}", f"Spec {index}", {"Screens": [HEADER] + make_rows(f"S{index}", 4)},
+                               folder_id=FOLDER_ID)
+    client.latency = 0.01
+
+    details = run_index(client, workers=4)
+
+    assert details["successful"] == 6 and details["failed"] == 0
+    assert_indexes_consistent()
+
+
+def test_pipeline_reports_progress_on_calling_thread(index_dir, client):
+    events = []
+    threads = set()
+
+    def on_progress(event):
+        events.append(event)
+        threads.add(threading.get_ident())
+
+    details = run_index(client, workers=2, on_progress=on_progress)
+
+    assert threads == {threading.get_ident()}
+    final = events[-1]
+    assert final["done"] and final["files_total"] == final["files_done"] == 2
+    assert final["stages"]["write"]["chunks"] == details["documents"] == 22
+    assert_indexes_consistent()
+
+
+def test_fetch_reads_all_tabs_in_one_batch_get():
+    client = FakeClient()
+    tabs = {f"Tab {index}": [HEADER] + make_rows(f"T{index}", 2) for index in range(5)}
+    client.add_spreadsheet("f1", "Spec A", tabs)
+
+    sheets_values = fetch_spreadsheet(client.files["f1"], client)
+
+    assert [(title, sheet_id) for title, sheet_id, _ in sheets_values] == [(title, i) for i, title in enumerate(tabs)]
+    assert sheets_values[3][2] == tabs["Tab 3"]
+    # open_by_key, worksheets và một values:batchGet, không phụ thuộc số tab
+    assert client.requests == 3
+
+
+def test_streamed_tabs_are_read_in_row_windows():
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Nhỏ": [HEADER] + make_rows("S", 2),
+                                            "Lớn": [HEADER] + make_rows("L", 249)})
+
+    # 250 hàng x 3 cột vượt 600 ô: tab lớn được đọc theo cửa sổ 200 hàng, tab nhỏ vẫn đi chung một batchGet
+    sheets_values = fetch_spreadsheet(client.files["f1"], client, stream=True, window_cells=600)
+    assert client.requests == 3
+    windows = sheets_values[1][2]
+    assert isinstance(windows, SheetWindows) and windows.window_rows == 200
+
+    streamed = list(iter_sheet_units(windows, "row"))
+    assert client.requests == 5
+    assert streamed == list(iter_sheet_units(client.spreadsheets["f1"]._worksheets[1].values, "row"))
+    assert windows.cells == 750
+
+
+def test_call_with_retry_backs_off_on_429():
+    client = FakeClient(error_rate=0.5, seed=1)
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [HEADER]})
+    delays = []
+
+    for _ in range(10):
+        assert call_with_retry(client.open_by_key, "f1", sleep=delays.append, max_retries=20).id == "f1"
+
+    assert client.rate_limited == len(delays) > 0
+    # Lần thử lại đầu tiên chờ 0.5-1 giây, các lần sau gấp đôi (có jitter), tối đa 32 giây
+    assert all(0.5 <= delay <= 32.0 for delay in delays)
@@ -0,0 +1,165 @@
+"""IndexerDaemon trên change feed của FakeClient: debounce, thứ tự ưu tiên và tiếp tục từ cursor"""
+import pytest
+
+import indexer_daemon
+from fake_gspread import FakeClient
+from index_manifest import IndexManifest
+from indexer import index_folder
+from indexer_daemon import ChangeSource, DriveChangeSource, IndexerDaemon
+
+FOLDER_ID = "folder"
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def sheet(rows):
+    return {"Screens": [["Mã", "Tên"]] + [[f"SCR-{i:03d}", f"Màn hình số {i}"] for i in range(1, rows + 1)]}
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.add_spreadsheet("small", "Small", sheet(2), folder_id=FOLDER_ID)
+    client.add_spreadsheet("big", "Big", sheet(40), folder_id=FOLDER_ID)
+    client.add_spreadsheet("older", "Older", sheet(2), folder_id=FOLDER_ID)
+    client.add_spreadsheet("gone", "Gone", sheet(2), folder_id=FOLDER_ID)
+    return client
+
+
+def make_daemon(client, clock, **kwargs):
+    kwargs.setdefault("debounce", 60)
+    kwargs.setdefault("max_debounce", 300)
+    return IndexerDaemon(DriveChangeSource(FOLDER_ID, client=client), FOLDER_ID, client=client,
+                         clock=clock, **kwargs)
+
+
+def indexed_files():
+    manifest = IndexManifest()
+    try:
+        return sorted(manifest.files_in_folder(FOLDER_ID))
+    finally:
+        manifest.close()
+
+
+def test_bursts_of_edits_are_debounced(index_dir, client):
+    clock = FakeClock()
+    daemon = make_daemon(client, clock, initial_sync=False)
+    assert daemon.poll() == 0
+
+    client.touch_spreadsheet("small", "2024-02-01T00:00:00.000Z")
+    daemon.poll()
+    clock.now += 50
+    client.touch_spreadsheet("small", "2024-02-01T00:00:50.000Z")
+    daemon.poll()
+
+    # 60 giây tính từ lần sửa cuối, không phải lần đầu
+    assert daemon.run_pending(clock.now + 59) == []
+    assert daemon.pending["small"]["version"] == 2
+    processed = daemon.run_pending(clock.now + 60)
+
+    assert [(item["file_id"], item["result"]) for item in processed] == [("small", "indexed")]
+    assert daemon.pending == {}
+    assert indexed_files() == ["small"]
+
+
+def test_continuous_edits_are_indexed_after_max_debounce(index_dir, client):
+    clock = FakeClock()
+    daemon = make_daemon(client, clock, initial_sync=False)
+    daemon.poll()
+    first_seen = clock.now
+
+    for second in range(0, 300, 50):
+        clock.now = first_seen + second
+        client.touch_spreadsheet("small", f"2024-02-01T00:{second // 60:02d}:{second % 60:02d}.000Z")
+        daemon.poll()
+        assert daemon.run_pending() == []
+
+    assert [item["file_id"] for item in daemon.run_pending(first_seen + 300)] == ["small"]
+
+
+def test_changes_after_scheduling_are_debounced_again(index_dir, client):
+    clock = FakeClock()
+    daemon = make_daemon(client, clock, initial_sync=False)
+    daemon.poll()
+    client.touch_spreadsheet("small", "2024-02-01T00:00:00.000Z")
+    daemon.poll()
+
+    clock.now += 60
+    assert daemon.schedule() == 1
+    client.touch_spreadsheet("small", "2024-02-01T00:01:00.000Z")
+    daemon.poll()
+
+    # Entry đã xếp hàng có version cũ nên bị bỏ qua
+    assert daemon.process_next() is None
+    assert "small" in daemon.pending
+
+
+def test_removed_recent_and_small_files_go_first(index_dir, client):
+    clock = FakeClock()
+    daemon = make_daemon(client, clock, initial_sync=False)
+    daemon.poll()
+    # Index cả folder trước để manifest có số chunk của từng file
+    assert index_folder(FOLDER_ID, None, client=client, reads_per_minute=1e9)["success"]
+    assert indexed_files() == ["big", "gone", "older", "small"]
+
+    client.touch_spreadsheet("older", "2024-02-01T00:00:00.000Z")
+    client.touch_spreadsheet("big", "2024-02-01T01:00:00.000Z")
+    client.touch_spreadsheet("small", "2024-02-01T01:00:00.000Z")
+    client.remove_spreadsheet("gone")
+    daemon.poll()
+
+    processed = daemon.run_pending(clock.now + 60)
+
+    assert [(item["file_id"], item["result"]) for item in processed] == [
+        ("gone", "removed"), ("small", "indexed"), ("big", "indexed"), ("older", "indexed")]
+    assert indexed_files() == ["big", "older", "small"]
+
+
+def test_restart_resumes_from_the_saved_cursor(index_dir, client, monkeypatch):
+    clock = FakeClock()
+    daemon = make_daemon(client, clock)
+    # Lần chạy đầu (chưa có cursor) index tăng dần cả folder
+    daemon.poll()
+    assert indexed_files() == ["big", "gone", "older", "small"]
+    client.touch_spreadsheet("small", "2024-02-01T00:00:00.000Z")
+    daemon.poll()
+    cursor = daemon.cursor
+
+    # Khởi động lại: không quét lại cả folder, đọc tiếp từ cursor đã lưu
+    def full_crawl(*args, **kwargs):
+        raise AssertionError("index_folder không được gọi khi đã có cursor")
+
+    monkeypatch.setattr(indexer_daemon, "index_folder", full_crawl)
+    restarted = make_daemon(client, clock)
+    assert restarted.cursor == cursor
+    assert list(restarted.pending) == ["small"]
+    assert restarted.pending["small"]["scheduled"] is False
+
+    client.touch_spreadsheet("big", "2024-02-01T00:00:00.000Z")
+    assert restarted.poll() == 1
+    processed = restarted.run_pending(clock.now + 60)
+
+    assert sorted(item["file_id"] for item in processed) == ["big", "small"]
+    assert make_daemon(client, clock).pending == {}
+
+
+def test_state_of_another_folder_is_rejected(index_dir, client):
+    make_daemon(client, FakeClock(), initial_sync=False).poll()
+
+    with pytest.raises(ValueError):
+        IndexerDaemon(DriveChangeSource("other", client=client), "other", client=client)
+
+
+def test_change_source_must_implement_the_feed():
+    class CursorOnly(ChangeSource):
+        def start_cursor(self):
+            return "0"
+
+    with pytest.raises(TypeError, match="changes"):
+        CursorOnly()
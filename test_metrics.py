@@ -0,0 +1,45 @@
+"""Registry chỉ số: counter/histogram, định dạng Prometheus và thời gian theo stage của indexer"""
+import pytest
+
+from metrics import Histogram, MetricsRegistry, StageTimings
+
+
+def test_histogram_quantile_is_bucket_upper_bound():
+    histogram = Histogram(buckets=(0.01, 0.1, 1.0))
+    for value in (0.005, 0.05, 0.05, 0.5):
+        histogram.observe(value)
+
+    assert histogram.quantile(0.5) == 0.1
+    assert histogram.quantile(0.99) == 1.0
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_prometheus_text_has_cumulative_buckets_and_escaped_labels():
+    registry = MetricsRegistry()
+    registry.describe("search_seconds", "Thời gian tìm kiếm")
+    registry.inc("search_queries_total", path="bm25")
+    registry.inc("search_queries_total", 2, path="bm25")
+    registry.observe("search_seconds", 0.003, part='to"tal')
+
+    text = registry.to_prometheus()
+
+    assert 'search_queries_total{path="bm25"} 3' in text
+    assert "# HELP search_seconds Thời gian tìm kiếm" in text
+    assert 'search_seconds_bucket{part="to\\"tal",le="0.0025"} 0' in text
+    assert 'search_seconds_bucket{part="to\\"tal",le="+Inf"} 1' in text
+    assert registry.snapshot()["histograms"]["search_seconds"][0]["count"] == 1
+
+
+def test_stage_timings_feed_the_registry():
+    registry = MetricsRegistry()
+    timings = StageTimings(registry)
+    timings.add("embed", 0.2, count=3)
+    with timings.time("fetch"):
+        pass
+
+    summary = timings.summary()
+
+    assert summary["stages"]["embed"] == {"seconds": pytest.approx(0.2), "count": 3}
+    assert summary["stages"]["fetch"]["count"] == 1
+    series = registry.snapshot()["histograms"]["indexer_stage_seconds"]
+    assert sorted(item["labels"]["stage"] for item in series) == ["embed", "fetch"]
@@ -0,0 +1,85 @@
+"""Cache kết quả truy vấn: LRU + TTL và mất hiệu lực theo thế hệ của index"""
+from indexer import ChromaBatchWriter
+from query_cache import QueryCache, bump_generation, make_key, read_generation
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class NullCollection:
+    def upsert(self, **kwargs):
+        pass
+
+    def delete(self, ids):
+        pass
+
+
+def test_key_normalizes_query_and_freezes_filters():
+    assert make_key("  Màn   HÌNH ", {"b": [1, 2], "a": 1}, n_results=5) == \
+        make_key("màn hình", {"a": 1, "b": (1, 2)}, n_results=5)
+    assert make_key("màn hình", n_results=5) != make_key("màn hình", n_results=10)
+
+
+def test_entries_expire_and_evict_least_recently_used(tmp_path):
+    clock = FakeClock()
+    cache = QueryCache(max_entries=2, ttl=10, generation_path=str(tmp_path / "generation"), clock=clock)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+
+    cache.put("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    clock.now = 11
+    assert cache.get("a") is None
+    assert cache.stats()["hits"] == 3
+
+
+def test_generation_bump_clears_cache(tmp_path):
+    path = str(tmp_path / "generation")
+    cache = QueryCache(generation_path=path)
+    calls = []
+    compute = lambda: calls.append(1) or len(calls)
+
+    assert cache.get_or_compute("q", compute) == 1
+    assert cache.get_or_compute("q", compute) == 1
+    bump_generation(path)
+
+    assert cache.get_or_compute("q", compute) == 2
+
+
+def test_writer_bumps_generation_only_when_something_changed(tmp_path):
+    path = str(tmp_path / "generation")
+    writer = ChromaBatchWriter(NullCollection(), on_flush=lambda: bump_generation(path))
+
+    writer.flush()
+    assert read_generation(path) == 0
+
+    writer.add("a", {}, "a")
+    writer.flush()
+    writer.delete(["a"])
+    writer.flush()
+    assert read_generation(path) == 2
+
+
+def test_result_computed_across_a_generation_bump_is_not_cached(tmp_path):
+    path = str(tmp_path / "generation")
+    cache = QueryCache(generation_path=path)
+
+    def compute_during_reindex():
+        # Indexer ghi xong trong lúc truy vấn đang chạy: kết quả có thể thiếu dữ liệu mới
+        bump_generation(path)
+        return "cũ"
+
+    assert cache.get_or_compute("q", compute_during_reindex) == "cũ"
+    assert cache.get("q") is None
+    assert cache.stats()["entries"] == 0
+
+    assert cache.get_or_compute("q", lambda: "mới") == "mới"
+    assert cache.get("q") == "mới"
@@ -0,0 +1,176 @@
+"""RRF, đường tắt cho truy vấn dạng mã định danh, phạm vi lọc và phân trang của hybrid_search"""
+import pytest
+
+from search import (RRF_K, cursor_key, decode_cursor, hybrid_search, hybrid_search_batch, looks_like_identifier,
+                    paginate, reciprocal_rank_fusion)
+
+
+def hit(doc_id, document=""):
+    return {"id": doc_id, "document": document or doc_id, "metadata": {"file_id": "f1"}, "score": None}
+
+
+class StubLexicalIndex:
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def search(self, query, n_results=10, filters=None):
+        self.queries.append(query)
+        return [dict(item) for item in self.results.get(query, [])][:n_results]
+
+
+class StubCollection:
+    """Collection trả về cùng một danh sách cho mọi truy vấn, đếm số lần được truy vấn"""
+
+    def __init__(self, ids):
+        self.ids = ids
+        self.query_texts = []
+
+    def count(self):
+        return len(self.ids)
+
+    def query(self, query_texts, n_results, **kwargs):
+        self.query_texts.append(list(query_texts))
+        ids = self.ids[:n_results]
+        return {
+            "ids": [ids for _ in query_texts],
+            "documents": [ids for _ in query_texts],
+            "metadatas": [[{"file_id": "f1"} for _ in ids] for _ in query_texts],
+            "distances": [[float(rank) for rank in range(len(ids))] for _ in query_texts],
+        }
+
+
+@pytest.mark.parametrize("query,expected", [
+    ("SCR-001", True),
+    ("user_id", True),
+    ("btnSubmit", True),
+    ("FR1.2", True),
+    ("đăng nhập", False),
+    ("login", False),
+    ("", False),
+])
+def test_looks_like_identifier(query, expected):
+    assert looks_like_identifier(query) is expected
+
+
+def test_rrf_rewards_documents_found_by_both_sources():
+    fused = reciprocal_rank_fusion({
+        "bm25": [hit("a"), hit("b"), hit("c")],
+        "vector": [hit("c"), hit("d")],
+    }, n_results=3)
+
+    # b và d cùng hạng 2 nên bằng điểm, b đứng trước vì bm25 được trộn trước
+    assert [item["id"] for item in fused] == ["c", "a", "b"]
+    assert fused[0]["sources"] == ["bm25", "vector"]
+    assert fused[0]["score"] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 1))
+    assert fused[1]["score"] == pytest.approx(1 / (RRF_K + 1))
+
+
+def test_rrf_ties_keep_source_order():
+    fused = reciprocal_rank_fusion({"bm25": [hit("a")], "vector": [hit("b")]}, n_results=10)
+
+    assert [item["id"] for item in fused] == ["a", "b"]
+
+
+def test_identifier_query_skips_the_vector_search():
+    lexical = StubLexicalIndex({"SCR-001": [hit("f1_0_A2", "SCR-001")]})
+    collection = StubCollection(["x", "y"])
+
+    results = hybrid_search("SCR-001", collection, lexical)
+
+    assert [item["id"] for item in results] == ["f1_0_A2"]
+    assert results[0]["sources"] == ["bm25"]
+    assert collection.query_texts == []
+
+
+def test_identifier_without_lexical_hits_falls_back_to_hybrid():
+    lexical = StubLexicalIndex({})
+    collection = StubCollection(["x", "y"])
+
+    results = hybrid_search("SCR-404", collection, lexical)
+
+    assert [item["id"] for item in results] == ["x", "y"]
+    assert all(item["sources"] == ["vector"] for item in results)
+    assert collection.query_texts == [["SCR-404"]]
+
+
+def test_batch_embeds_pending_queries_once_and_keeps_order():
+    lexical = StubLexicalIndex({"SCR-001": [hit("id-hit")], "đăng nhập": [hit("y")]})
+    collection = StubCollection(["x", "y"])
+
+    results = hybrid_search_batch(["đăng nhập", "SCR-001", "báo cáo"], collection, lexical, n_results=2)
+
+    # Chỉ một lần collection.query cho hai truy vấn không phải mã định danh
+    assert collection.query_texts == [["đăng nhập", "báo cáo"]]
+    assert [item["id"] for item in results[0]] == ["y", "x"]
+    assert [item["id"] for item in results[1]] == ["id-hit"]
+    assert [item["id"] for item in results[2]] == ["x", "y"]
+
+
+@pytest.fixture
+def scoped_index(index_dir):
+    from fake_gspread import FakeClient
+    from indexer import index_folder
+
+    client = FakeClient()
+    header = ["Mã", "Tên màn hình", "Ghi chú"]
+    client.add_spreadsheet("f1", "Spec A", {
+        "Screens": [header] + [[f"SCR-{i:03d}", f"Màn hình đăng nhập {i}", "" if i % 2 else "bắt buộc"]
+                               for i in range(1, 7)],
+        "Reports": [header, ["RPT-001", "Báo cáo đăng nhập", "hằng ngày"]],
+    }, folder_id="folder")
+    client.add_spreadsheet("f2", "Spec B", {"Screens": [header, ["SCR-100", "Màn hình đăng nhập khác", ""]]},
+                           folder_id="folder")
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="row")["success"]
+
+
+def scoped_search(query, filters, n_results=20):
+    from resources import get_collection, get_embedding_function, get_facet_index, get_lexical_index
+
+    return hybrid_search(query, get_collection(), get_lexical_index(), n_results=n_results, filters=filters,
+                         facet_index=get_facet_index(), embedding_function=get_embedding_function())
+
+
+def test_facet_counts_follow_the_selected_scope(scoped_index):
+    from resources import get_facet_index
+
+    facets = get_facet_index().facets({"file_id": "f1"})
+
+    # Mỗi hàng có dữ liệu là một document, kể cả hàng tiêu đề
+    assert [(item["label"], item["count"]) for item in facets["files"]] == [("Spec A", 9), ("Spec B", 2)]
+    assert [(item["label"], item["count"]) for item in facets["sheets"]] == [("Screens", 7), ("Reports", 2)]
+    assert {item["value"]: item["count"] for item in facets["columns"]} == {"A": 9, "B": 9, "C": 6}
+    assert get_facet_index().scope_size({"file_id": "f1", "sheet_id": "0", "col": "C"}) == 4
+
+
+@pytest.mark.parametrize("filters", [{"file_id": "f2"}, {"file_id": "f1", "sheet_id": "1"}, {"col": "C"}])
+def test_filters_restrict_both_sources(scoped_index, filters):
+    hits = scoped_search("màn hình đăng nhập", filters)
+
+    assert hits
+    for item in hits:
+        metadata = item["metadata"]
+        assert metadata["file_id"] == filters.get("file_id", metadata["file_id"])
+        assert metadata["sheet_id"] == filters.get("sheet_id", metadata["sheet_id"])
+        if "col" in filters:
+            assert filters["col"] in metadata["cols"].split(",")
+
+
+def test_identifier_fast_path_respects_filters(scoped_index):
+    assert scoped_search("SCR-100", {"file_id": "f1"})[0]["metadata"]["file_id"] == "f1"
+    assert scoped_search("SCR-100", {"file_id": "f2"})[0]["sources"] == ["bm25"]
+
+
+def test_cursor_pages_are_consistent_slices():
+    hits = [hit(str(index)) for index in range(25)]
+    key = cursor_key("đăng nhập", {"file_id": "f1"})
+
+    first = paginate(hits, key, page_size=10)
+    second = paginate(hits, key, page_size=10, cursor=first["next_cursor"])
+    last = paginate(hits, key, page_size=10, cursor=second["next_cursor"])
+
+    assert [item["id"] for item in first["hits"] + second["hits"] + last["hits"]] == [str(i) for i in range(25)]
+    assert last["next_cursor"] is None and last["total"] == 25
+    # Cursor của truy vấn khác hoặc cursor hỏng bắt đầu lại từ đầu
+    assert paginate(hits, cursor_key("báo cáo"), cursor=second["next_cursor"])["offset"] == 0
+    assert decode_cursor("không-phải-cursor", key) == 0
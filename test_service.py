@@ -0,0 +1,72 @@
+"""Dịch vụ HTTP: tìm kiếm theo lô qua query cache, phạm vi/phân trang, facet và trạng thái job"""
+import pytest
+from fastapi.testclient import TestClient
+
+from fake_gspread import FakeClient
+from indexer import index_folder
+
+
+@pytest.fixture
+def service(index_dir):
+    import service
+
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [["Mã", "Tên màn hình"], ["SCR-001", "Màn hình đăng nhập"],
+                                                         ["SCR-002", "Màn hình báo cáo"]]}, folder_id="folder")
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="cell")["success"]
+    return TestClient(service.app)
+
+
+def test_search_batch_is_served_from_cache_the_second_time(service):
+    from resources import get_query_cache
+
+    response = service.post("/search", json={"queries": ["SCR-001", "đăng nhập"], "n_results": 3})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [item["query"] for item in results] == ["SCR-001", "đăng nhập"]
+    assert results[0]["hits"][0]["document"] == "SCR-001"
+
+    again = service.post("/search", json={"queries": ["đăng  nhập"], "n_results": 3}).json()["results"]
+
+    assert again[0]["hits"] == results[1]["hits"]
+    assert get_query_cache().stats()["hits"] == 1
+
+
+def test_paged_scoped_search_and_facets(service):
+    request = {"queries": ["màn hình"], "n_results": 5, "page_size": 1, "filters": {"file_id": "f1", "col": "B"}}
+
+    first = service.post("/search", json=request).json()["results"][0]
+    second = service.post("/search", json={**request, "cursors": [first["next_cursor"]]}).json()["results"][0]
+
+    assert first["offset"] == 0 and second["offset"] == 1
+    assert first["hits"][0]["id"] != second["hits"][0]["id"]
+    assert all(page["hits"][0]["metadata"]["col"] == "B" for page in (first, second))
+    facets = service.get("/facets", params={"file_id": "f1"}).json()
+    assert facets["files"] == [{"value": "f1", "label": "Spec A", "count": 6}]
+    assert [item["value"] for item in facets["columns"]] == ["A", "B"]
+
+
+def test_search_racing_a_reindex_is_not_cached(service, monkeypatch):
+    import service as service_module
+    from query_cache import bump_generation
+    from resources import get_query_cache
+
+    search_batch = service_module.hybrid_search_batch
+
+    def search_during_reindex(*args, **kwargs):
+        bump_generation()
+        return search_batch(*args, **kwargs)
+
+    monkeypatch.setattr(service_module, "hybrid_search_batch", search_during_reindex)
+    assert service.post("/search", json={"queries": ["SCR-001"]}).status_code == 200
+
+    assert get_query_cache().stats()["entries"] == 0
+
+
+def test_search_rejects_empty_batch(service):
+    assert service.post("/search", json={"queries": []}).status_code == 422
+
+
+def test_unknown_job_is_404(service):
+    assert service.get("/jobs/missing").status_code == 404
@@ -0,0 +1,249 @@
+"""RangeCache và GoogleSheetsToolkit trên FakeClient: đọc từ cache luôn khớp với các lệnh ghi"""
+import pytest
+from gspread.exceptions import WorksheetNotFound
+
+from fake_gspread import FakeClient
+from sheet_creator_tool import GoogleSheetsToolkit, RangeCache, a1_bounds
+
+VALUES = [
+    ["Mã", "Tên", "Giá"],
+    ["SCR-001", "Đăng nhập", "100"],
+    ["SCR-002", "Báo cáo", "200"],
+    ["SCR-003", "Cài đặt", "300"],
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_range_cache_serves_sub_ranges():
+    cache = RangeCache(ttl=60)
+    cache.put("Sheet1", a1_bounds("A1:C4"), VALUES)
+
+    assert cache.get("Sheet1", a1_bounds("B2:C3")) == [["Đăng nhập", "100"], ["Báo cáo", "200"]]
+    assert cache.get("Sheet1", a1_bounds("C4")) == [["300"]]
+    assert cache.get("Sheet1", a1_bounds("A1:D4")) is None
+    assert cache.get("Sheet2", a1_bounds("A1")) is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 2
+
+
+def test_range_cache_expires_and_evicts():
+    clock = FakeClock()
+    cache = RangeCache(ttl=10, max_entries=2, clock=clock)
+    cache.put("Sheet1", a1_bounds("A1:C2"), VALUES[:2])
+    cache.put("Sheet1", a1_bounds("A3:C3"), [VALUES[2]])
+    cache.put("Sheet1", a1_bounds("A4:C4"), [VALUES[3]])
+
+    # Vùng dùng lâu nhất bị bỏ khi vượt max_entries
+    assert cache.get("Sheet1", a1_bounds("A1")) is None
+    assert cache.get("Sheet1", a1_bounds("A4")) == [["SCR-003"]]
+    clock.now = 11
+    assert cache.get("Sheet1", a1_bounds("A4")) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_range_cache_applies_writes_in_place():
+    cache = RangeCache(ttl=60)
+    cache.put("Sheet1", a1_bounds("A1:C4"), VALUES)
+
+    cache.apply_write("Sheet1", a1_bounds("B3"), [["Báo cáo tháng"]])
+    # Lệnh ghi vượt ra ngoài vùng đã cache chỉ cập nhật phần nằm trong vùng
+    cache.apply_write("Sheet1", a1_bounds("C4"), [["350", "ngoài vùng"]])
+
+    assert cache.get("Sheet1", a1_bounds("B3:C4")) == [["Báo cáo tháng", "200"], ["Cài đặt", "350"]]
+
+    cache.apply_write("Sheet1", a1_bounds("C2"), [["=SUM(C3:C4)"]])
+    assert cache.get("Sheet1", a1_bounds("A1")) is None
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.add_spreadsheet("s1", "Spec", {"Sheet1": [list(row) for row in VALUES]})
+    return client
+
+
+@pytest.fixture
+def toolkit(client):
+    toolkit = GoogleSheetsToolkit(client=client)
+    toolkit.connect("s1")
+    return toolkit
+
+
+def sheet_values(client):
+    return client.spreadsheets["s1"]._worksheets[0].values
+
+
+def test_worksheet_handles_are_cached(client, toolkit):
+    toolkit.read_cell("Sheet1", "A2")
+    requests = client.requests
+
+    # Lần đọc sau chỉ tốn đúng một request đọc, không lấy lại danh sách sheet
+    assert toolkit.read_cell("Sheet1", "B2") == "Đăng nhập"
+    assert client.requests == requests + 1
+
+
+def test_writes_are_sent_in_one_batch_on_flush(client, toolkit):
+    toolkit.write_values("Sheet1", "B2", [["Đăng nhập SSO"]])
+    toolkit.write_values("Sheet1", "C3:C4", [["250"], ["350"]])
+    requests = client.requests
+
+    assert toolkit.pending_writes == 2
+    assert sheet_values(client)[1][1] == "Đăng nhập"
+
+    assert toolkit.flush() == 2
+    assert client.requests == requests + 1
+    assert sheet_values(client)[1][1] == "Đăng nhập SSO"
+    assert [row[2] for row in sheet_values(client)[2:]] == ["250", "350"]
+    assert toolkit.pending_writes == 0
+    assert toolkit.flush() == 0
+
+
+def test_rewriting_a_range_keeps_the_last_value(client, toolkit):
+    toolkit.write_cell("Sheet1", "C2", "110")
+    toolkit.write_cell("Sheet1", "C2", "120")
+
+    assert toolkit.pending_writes == 1
+    toolkit.flush()
+    assert sheet_values(client)[1][2] == "120"
+
+
+def test_unknown_sheet_fails_before_queueing(toolkit):
+    with pytest.raises(WorksheetNotFound):
+        toolkit.write_cell("Không có", "A1", "x")
+    assert toolkit.pending_writes == 0
+
+
+def test_repeated_reads_hit_the_cache(client, toolkit):
+    assert toolkit.read_values("Sheet1", "A1:C4") == VALUES
+    requests = client.requests
+
+    assert toolkit.read_values("Sheet1", "A2:B3") == [["SCR-001", "Đăng nhập"], ["SCR-002", "Báo cáo"]]
+    assert toolkit.read_cell("Sheet1", "C3") == "200"
+    assert client.requests == requests
+
+
+def test_reads_see_queued_writes(client, toolkit):
+    toolkit.read_values("Sheet1", "A1:C4")
+    toolkit.write_cell("Sheet1", "B2", "Đăng nhập SSO")
+    toolkit.write_values("Sheet1", "C3:C4", [["250"], ["350"]])
+    requests = client.requests
+
+    # Chưa gửi gì lên sheet nhưng đọc lại đã thấy giá trị mới
+    assert toolkit.pending_writes == 2
+    assert sheet_values(client)[1][1] == "Đăng nhập"
+    assert toolkit.read_values("Sheet1", "B2:C4") == [["Đăng nhập SSO", "100"], ["Báo cáo", "250"], ["Cài đặt", "350"]]
+    assert client.requests == requests
+
+    assert toolkit.flush() == 2
+    assert sheet_values(client)[1][1] == "Đăng nhập SSO"
+    assert [row[2] for row in sheet_values(client)[2:]] == ["250", "350"]
+
+
+def test_uncached_read_flushes_overlapping_writes(client, toolkit):
+    toolkit.write_values("Sheet1", "A5:C5", [["SCR-004", "Trợ giúp", "400"]])
+
+    assert toolkit.read_values("Sheet1", "A4:C5") == [VALUES[3], ["SCR-004", "Trợ giúp", "400"]]
+    assert toolkit.pending_writes == 0
+
+
+def test_formula_write_is_read_back_from_the_sheet(client, toolkit):
+    toolkit.read_values("Sheet1", "A1:C4")
+    toolkit.write_cell("Sheet1", "C2", "=C3+C4")
+    requests = client.requests
+
+    # Công thức làm mất vùng đã cache: lần đọc sau gửi lệnh ghi rồi đọc lại từ sheet
+    assert toolkit.read_cell("Sheet1", "C2") == "=C3+C4"
+    assert client.requests > requests
+    assert toolkit.pending_writes == 0
+
+
+def test_refresh_cache_rereads_external_changes(client, toolkit):
+    toolkit.read_values("Sheet1", "A1:C4")
+    sheet_values(client)[1][1] = "Sửa từ bên ngoài"
+
+    assert toolkit.read_cell("Sheet1", "B2") == "Đăng nhập"
+    toolkit.refresh_cache("Sheet1")
+    assert toolkit.read_cell("Sheet1", "B2") == "Sửa từ bên ngoài"
+
+
+@pytest.mark.parametrize("data, expected", [
+    ("42", "Số nguyên"),
+    ("3.5", "Số thực"),
+    ("inf", "Số thực"),
+    ("nan", "Số thực"),
+    ("1,000", "Chuỗi"),
+    ("Có", "Boolean"),
+    ("15/03/2024", "Ngày tháng"),
+    ("2024-03-15T10:00:00", "Ngày tháng"),
+    ("1/2/2024 hoặc sau đó", "Ngày tháng"),
+    ("SCR-001", "Chuỗi"),
+])
+def test_suggest_data_type_keeps_its_classification(data, expected):
+    # Gợi ý cho agent giữ cách phân loại riêng, không theo value index của indexer
+    assert GoogleSheetsToolkit(client=FakeClient()).suggest_data_type(data) == expected
+
+
+def test_agent_session_streams_tool_calls_and_tokens(client, toolkit):
+    pytest.importorskip("langgraph")
+    from fake_chat_model import FakeChatModel
+    from sheet_creator_tool import AgentSession
+
+    model = FakeChatModel(responses=[
+        {"name": "write_cell", "args": {"sheet_name": "Sheet1", "cell": "B2", "value": "Đăng nhập SSO"}},
+        "Đã ghi ô B2",
+    ], state={})
+    session = AgentSession(toolkit, model=model)
+
+    events = list(session.stream("Sửa ô B2"))
+
+    assert [event["type"] for event in events][:2] == ["tool_call", "tool_result"]
+    assert events[0]["name"] == "write_cell"
+    assert "".join(event["content"] for event in events if event["type"] == "token") == "Đã ghi ô B2"
+    # Cuối lượt các ô agent đã ghi được gửi lên sheet
+    assert toolkit.pending_writes == 0
+    assert sheet_values(client)[1][1] == "Đăng nhập SSO"
+
+    # Lượt sau dùng lại graph và thấy lịch sử của lượt trước
+    def history_length():
+        return len(session.graph.get_state({"configurable": {"thread_id": session.thread_id}}).values["messages"])
+
+    list(session.stream("Còn gì nữa?"))
+    assert history_length() == 6
+    session.reset()
+    list(session.stream("Xin chào"))
+    assert history_length() == 2
+
+
+def test_agent_session_reports_a_failed_flush(client, toolkit, monkeypatch):
+    pytest.importorskip("langgraph")
+    from fake_chat_model import FakeChatModel
+    from sheet_creator_tool import AgentSession
+
+    model = FakeChatModel(responses=[
+        {"name": "write_cell", "args": {"sheet_name": "Sheet1", "cell": "B2", "value": "Đăng nhập SSO"}},
+        "Đã ghi ô B2",
+    ], state={})
+    session = AgentSession(toolkit, model=model)
+
+    def unavailable(body):
+        raise RuntimeError("mất kết nối")
+
+    monkeypatch.setattr(client.spreadsheets["s1"], "values_batch_update", unavailable)
+    events = list(session.stream("Sửa ô B2"))
+
+    assert events[-1]["type"] == "error" and "mất kết nối" in events[-1]["content"]
+    assert toolkit.pending_writes == 1
+
+    # Lượt sau model thấy lỗi trong hội thoại, lệnh ghi còn giữ được gửi ở cuối lượt
+    monkeypatch.undo()
+    events = list(session.stream("Còn gì nữa?"))
+    messages = session.graph.get_state({"configurable": {"thread_id": session.thread_id}}).values["messages"]
+    assert any(message.type == "system" and "mất kết nối" in message.content for message in messages)
+    assert all(event["type"] != "error" for event in events)
+    assert sheet_values(client)[1][1] == "Đăng nhập SSO"
@@ -0,0 +1,112 @@
+"""Tra cứu `col:` trên value index và việc dọn giá trị khi vùng ô hoặc file bị xóa"""
+import pytest
+
+from fake_gspread import FakeClient
+from indexer import handle_removed_file, index_folder
+from search import hybrid_search, restrict_to_rows
+from value_index import BOOLEAN, DATE, NUMBER, ValueIndex, classify_value, parse_value_query
+
+HEADER = ["Mã", "Tên màn hình", "Giá", "Ngày tạo", "Bắt buộc"]
+ROWS = [
+    ["SCR-001", "Màn hình đăng nhập", "25,000", "05/03/2024", "Có"],
+    ["SCR-002", "Báo cáo doanh thu", "1250000", "2024-03-06", "Không"],
+    ["SCR-003", "Màn hình đăng ký", "900000", "06/03/2024 14:30", "Có"],
+]
+
+
+def lookup(index, query, filters=None):
+    return [(match["file_id"], match["range"]) for match in index.lookup(parse_value_query(query)[0], filters)]
+
+
+def test_classify_value():
+    assert classify_value("1,250,000") == (NUMBER, 1250000.0)
+    assert classify_value("-3.5e2") == (NUMBER, -350.0)
+    assert classify_value("Có") == (BOOLEAN, 1.0)
+    assert classify_value("05/03/2024")[0] == DATE
+    assert classify_value("05/03/2024") == classify_value("2024-03-05")
+    assert classify_value("e5") is None
+    assert classify_value("SCR-001") is None
+    assert classify_value("  ") is None
+
+
+def test_parse_value_query():
+    conditions, text = parse_value_query('đăng nhập col:Giá >= 500000 col:"Ngày tạo" = 06/03/2024')
+
+    assert text == "đăng nhập"
+    assert [(condition["column"], condition["op"]) for condition in conditions] == [("Giá", ">="), ("Ngày tạo", "=")]
+    assert conditions[0]["low"] == 500000 and conditions[0]["high"] is None
+    # So sánh bằng một ngày khớp cả ngày đó
+    assert conditions[1]["high"] == conditions[1]["low"] + 1 and not conditions[1]["include_high"]
+    with pytest.raises(ValueError):
+        parse_value_query("col:Giá > nhiều")
+
+
+def make_units(file_id, rows, file_name="Spec A", sheet_id="0", tab_name="Screens"):
+    """Vùng ô theo từng ô (như granularity "cell") cho ValueIndex.replace"""
+    units = []
+    for row_index, row in enumerate(rows, start=2):
+        for col_index, value in enumerate(row):
+            classified = classify_value(value)
+            col = "ABCDE"[col_index]
+            values = [(col, row_index, HEADER[col_index], *classified, value)] if classified else []
+            units.append((file_id, file_name, sheet_id, tab_name, f"{col}{row_index}", values))
+    return units
+
+
+def test_lookup_by_header_letter_and_row(tmp_path):
+    index = ValueIndex(str(tmp_path / "values.sqlite3"))
+    index.replace(make_units("f1", ROWS))
+
+    assert lookup(index, "col:Giá > 100000") == [("f1", "C3"), ("f1", "C4")]
+    assert lookup(index, "col:giá <= 25000") == [("f1", "C2")]
+    assert lookup(index, "col:C = 900000") == [("f1", "C4")]
+    # Ngày kèm giờ vẫn khớp với so sánh bằng theo ngày
+    assert lookup(index, 'col:"Ngày tạo" = 06/03/2024') == [("f1", "D3"), ("f1", "D4")]
+    # Các điều kiện phải thỏa trên cùng một hàng
+    assert lookup(index, 'col:Giá > 100000 col:"Bắt buộc" = có') == [("f1", "C4")]
+    assert index.matching_rows(parse_value_query("col:Giá > 100000")[0]) == {("f1", "0", 3), ("f1", "0", 4)}
+    assert lookup(index, "col:Giá > 0", {"file_id": "f2"}) == []
+    index.close()
+
+
+def test_replace_and_remove_clean_up(tmp_path):
+    index = ValueIndex(str(tmp_path / "values.sqlite3"))
+    index.replace(make_units("f1", ROWS))
+    index.replace(make_units("f2", ROWS[:1], file_name="Spec B"))
+
+    # Ô được sửa thành văn bản: vùng ô được ghi lại với values rỗng
+    index.replace([("f1", "Spec A", "0", "Screens", "C3", [])])
+    assert lookup(index, "col:Giá > 100000") == [("f1", "C4")]
+
+    # Xóa hết giá trị của một tab thì tên tab cũng bị bỏ
+    index.replace([unit[:5] + ([],) for unit in make_units("f2", ROWS[:1], file_name="Spec B")])
+    assert [row[0] for row in index.dump()["tabs"]] == ["f1"]
+
+    index.remove_file("f1")
+    assert index.count() == 0
+    assert index.dump() == {"values": [], "tabs": []}
+    index.close()
+
+
+def test_col_query_restricts_hybrid_search(index_dir):
+    from resources import get_collection, get_embedding_function, get_lexical_index, get_value_index
+
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [HEADER] + ROWS}, folder_id="folder")
+    client.add_spreadsheet("f2", "Spec B", {"Other": [["Tên", "Giá"], ["Màn hình đăng nhập", "5"]]},
+                           folder_id="folder")
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="row")["success"]
+    values = get_value_index()
+
+    conditions, text = parse_value_query("màn hình col:Giá > 100000")
+    hits = hybrid_search(text, get_collection(), get_lexical_index(), n_results=20,
+                         embedding_function=get_embedding_function())
+    kept = restrict_to_rows(hits, values.matching_rows(conditions))
+
+    assert {hit["metadata"]["file_id"] for hit in hits} == {"f1", "f2"}
+    assert sorted((hit["metadata"]["file_id"], hit["metadata"]["range"]) for hit in kept) == [
+        ("f1", "A3:E3"), ("f1", "A4:E4")]
+
+    assert handle_removed_file("f1")["success"]
+    assert lookup(values, "col:Giá >= 0") == [("f2", "B2")]
+    assert [row[0] for row in values.dump()["tabs"]] == ["f2"]
@@ -0,0 +1,327 @@
+"""Backend vector lượng tử hóa: kết quả như tìm kiếm brute force, lưu bền qua các lần mở"""
+import numpy as np
+import pytest
+
+from vector_store import CompactVectorStore, VectorStore
+
+
+def random_vectors(count, dim=32, seed=0):
+    return np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+
+
+def brute_force(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return list(np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:k])
+
+
+@pytest.fixture(params=["int8", "float16"])
+def store(tmp_path, request):
+    store = CompactVectorStore(str(tmp_path / "store"), dtype=request.param)
+    yield store
+    store.close()
+
+
+def add(store, vectors, prefix="v"):
+    ids = [f"{prefix}{i}" for i in range(len(vectors))]
+    store.upsert(ids, [f"doc {doc_id}" for doc_id in ids], [{"n": i} for i in range(len(vectors))],
+                 embeddings=vectors.tolist())
+    return ids
+
+
+def test_query_matches_brute_force(store):
+    vectors = random_vectors(300)
+    ids = add(store, vectors)
+    query = random_vectors(1, seed=1)[0]
+
+    result = store.query(query_embeddings=[query.tolist()], n_results=5)
+
+    expected = [ids[i] for i in brute_force(vectors, query, 5)]
+    # Lượng tử hóa có thể đổi chỗ các điểm rất sát nhau, top đầu phải trùng
+    assert result["ids"][0][0] == expected[0]
+    assert len(set(result["ids"][0]) & set(expected)) >= 4
+    assert result["documents"][0][0] == f"doc {expected[0]}"
+    assert result["distances"][0] == sorted(result["distances"][0])
+
+
+def test_exact_match_has_zero_distance_and_upsert_overwrites(store):
+    vectors = random_vectors(10)
+    add(store, vectors)
+    store.upsert(["v3"], ["sửa"], [{"n": 30}], embeddings=[vectors[7].tolist()])
+
+    result = store.query(query_embeddings=[vectors[7].tolist()], n_results=2)
+
+    assert set(result["ids"][0]) == {"v3", "v7"}
+    assert result["distances"][0][0] == pytest.approx(0.0, abs=0.02)
+    assert store.get(ids=["v3"]) == {"ids": ["v3"], "documents": ["sửa"], "metadatas": [{"n": 30}]}
+    assert store.count() == 10
+
+
+def test_deleted_slots_are_reused_and_never_returned(store):
+    vectors = random_vectors(20)
+    add(store, vectors)
+    store.delete(["v0", "v1", "missing"])
+
+    assert store.count() == 18
+    assert "v0" not in store.query(query_embeddings=[vectors[0].tolist()], n_results=18)["ids"][0]
+
+    add(store, random_vectors(2, seed=5), prefix="new")
+    assert store.stats()["count"] == 20
+    assert store._next_slot == 20
+
+
+def test_where_scores_only_matching_vectors(store):
+    vectors = random_vectors(40)
+    ids = [f"v{i}" for i in range(40)]
+    store.upsert(ids, ids, [{"file_id": f"f{i % 3}", "has_col_B": 1 if i % 2 else 0} for i in range(40)],
+                 embeddings=vectors.tolist())
+    store.upsert(["v4"], ["v4"], [{"file_id": "f2", "has_col_B": 1}], embeddings=[vectors[4].tolist()])
+
+    result = store.query(query_embeddings=[vectors[4].tolist()], n_results=40,
+                         where={"$and": [{"file_id": "f1"}, {"has_col_B": {"$eq": 1}}]})
+
+    expected = {f"v{i}" for i in range(40) if i % 3 == 1 and i % 2}
+    assert set(result["ids"][0]) == expected
+    # Metadata mới của v4 thay thế metadata cũ trong index của where
+    assert store.query(query_embeddings=[vectors[4].tolist()], n_results=1, where={"file_id": "f2"})["ids"] == [["v4"]]
+    with pytest.raises(ValueError):
+        store.query(query_embeddings=[vectors[0].tolist()], where={"file_id": {"$ne": "f1"}})
+
+
+def test_backend_must_implement_the_whole_interface():
+    class PartialStore(VectorStore):
+        def upsert(self, ids, documents, metadatas, embeddings=None):
+            pass
+
+        def count(self):
+            return 0
+
+    with pytest.raises(TypeError, match="delete"):
+        PartialStore()
+    with pytest.raises(TypeError):
+        VectorStore()
+
+
+def test_store_reopens_with_its_own_config(tmp_path):
+    path = str(tmp_path / "store")
+    store = CompactVectorStore(path, dtype="float16", rerank=True)
+    vectors = random_vectors(50)
+    add(store, vectors)
+    store.close()
+
+    reopened = CompactVectorStore(path, dtype="int8")
+    try:
+        assert (reopened.dtype, reopened.rerank, reopened.count()) == ("float16", True, 50)
+        result = reopened.query(query_embeddings=[vectors[10].tolist()], n_results=3)
+        assert result["ids"][0][0] == "v10"
+        assert reopened.get(limit=2, offset=48)["ids"] == ["v48", "v49"]
+        with pytest.raises(ValueError):
+            reopened.upsert(["x"], ["x"], embeddings=[[1.0, 0.0]])
+    finally:
+        reopened.close()
+
+
+def test_indexer_runs_on_compact_backend(index_dir, monkeypatch):
+    import resources
+    from fake_gspread import FakeClient
+    from indexer import index_folder
+    from search import hybrid_search
+
+    monkeypatch.setattr(resources, "VECTOR_STORE", "compact")
+    client = FakeClient()
+    client.add_spreadsheet("f1", "Spec A", {"Screens": [["Mã", "Tên"], ["SCR-001", "Đăng nhập"],
+                                                         ["SCR-002", "Báo cáo"]]}, folder_id="folder")
+
+    result = index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="cell")
+
+    assert result["success"], result["message"]
+    collection = resources.get_collection()
+    assert isinstance(collection, CompactVectorStore)
+    assert collection.count() == resources.get_lexical_index().count() == 6
+    assert hybrid_search("SCR-002", collection, resources.get_lexical_index())[0]["document"] == "SCR-002"
+
+
+@pytest.fixture
+def sharded(index_dir):
+    import resources
+    from vector_store import ShardedVectorStore
+
+    store = ShardedVectorStore(resources.get_chroma_client())
+    yield store
+    store.close()
+
+
+def add_files(store, vectors, files=3):
+    ids = [f"v{i}" for i in range(len(vectors))]
+    store.upsert(ids, ids, [{"file_id": f"f{i % files}"} for i in range(len(vectors))], embeddings=vectors.tolist())
+    return ids
+
+
+def shards_queried():
+    from metrics import REGISTRY
+
+    return sum(series["value"] for series in REGISTRY.snapshot()["counters"].get("vector_shards_queried_total", []))
+
+
+def test_sharded_query_merges_shards(sharded):
+    vectors = random_vectors(60)
+    add_files(sharded, vectors)
+
+    result = sharded.query(query_embeddings=[vectors[7].tolist()], n_results=5)
+
+    expected = np.argsort(((vectors - vectors[7]) ** 2).sum(axis=1))[:5]
+    assert result["ids"][0] == [f"v{i}" for i in expected]
+    assert result["distances"][0] == sorted(result["distances"][0])
+    assert sharded.count() == 60 and sharded.shard_count() == 3
+    assert sharded.get(ids=["v4", "v3"])["metadatas"] == [{"file_id": "f1"}, {"file_id": "f0"}]
+
+
+def test_file_filter_queries_one_shard(sharded):
+    vectors = random_vectors(30)
+    add_files(sharded, vectors)
+    before = shards_queried()
+
+    result = sharded.query(query_embeddings=[vectors[0].tolist()], n_results=30, where={"file_id": "f2"})
+
+    assert set(result["ids"][0]) == {f"v{i}" for i in range(2, 30, 3)}
+    assert shards_queried() == before + 1
+
+
+def test_deleting_a_whole_file_drops_its_collection(sharded):
+    import resources
+
+    add_files(sharded, random_vectors(30))
+    collections = len(resources.get_chroma_client().list_collections())
+
+    sharded.delete([f"v{i}" for i in range(0, 30, 3)])
+
+    assert sharded.shard_count() == 2 and sharded.count() == 20
+    assert len(resources.get_chroma_client().list_collections()) == collections - 1
+
+
+def test_rebuild_swaps_in_the_new_collection(sharded):
+    vectors = random_vectors(30)
+    add_files(sharded, vectors)
+
+    assert sharded.begin_rebuild("f1")
+    sharded.upsert(["w1"], ["w1"], [{"file_id": "f1"}], embeddings=[vectors[1].tolist()])
+    sharded.delete([f"v{i}" for i in range(1, 30, 3)])
+    # Tới khi commit, truy vấn vẫn thấy bản cũ của f1
+    where = {"file_id": "f1"}
+    assert sharded.query(query_embeddings=[vectors[1].tolist()], n_results=1, where=where)["ids"] == [["v1"]]
+
+    sharded.commit_rebuild("f1")
+    assert sharded.query(query_embeddings=[vectors[1].tolist()], n_results=5, where=where)["ids"] == [["w1"]]
+    assert sharded.count() == 21
+
+
+def test_aborted_rebuild_leaves_nothing_behind(sharded):
+    import resources
+
+    vectors = random_vectors(30)
+    add_files(sharded, vectors)
+    collections = len(resources.get_chroma_client().list_collections())
+
+    assert sharded.begin_rebuild("f1")
+    sharded.upsert(["w1"], ["w1"], [{"file_id": "f1"}], embeddings=[vectors[1].tolist()])
+    sharded.delete(["v1", "v4"])
+    # Bản đang dựng không được tính vào count và không đọc được
+    assert sharded.count() == 30 and sharded.get(ids=["w1"])["ids"] == []
+
+    sharded.abort_rebuild("f1")
+
+    assert sharded.count() == 30
+    assert sharded.get(ids=["v1", "w1"])["ids"] == ["v1"]
+    assert sharded._conn.execute("SELECT COUNT(*) FROM staging_docs").fetchone()[0] == 0
+    assert len(resources.get_chroma_client().list_collections()) == collections
+    where = {"file_id": "f1"}
+    assert sharded.query(query_embeddings=[vectors[1].tolist()], n_results=1, where=where)["ids"] == [["v1"]]
+
+
+def test_new_file_is_hidden_until_its_rebuild_commits(sharded):
+    vectors = random_vectors(4)
+
+    assert sharded.begin_rebuild("f9")
+    sharded.upsert(["a", "b"], ["a", "b"], [{"file_id": "f9"}] * 2, embeddings=vectors[:2].tolist())
+    assert sharded.count() == 0
+    assert sharded.query(query_embeddings=[vectors[0].tolist()], n_results=2)["ids"] == [[]]
+
+    sharded.commit_rebuild("f9")
+    assert sharded.query(query_embeddings=[vectors[0].tolist()], n_results=2)["ids"] == [["a", "b"]]
+
+    # Bản dựng lại rỗng bỏ luôn shard
+    assert sharded.begin_rebuild("f9")
+    sharded.delete(["a", "b"])
+    sharded.commit_rebuild("f9")
+    assert sharded.count() == 0 and sharded.shard_count() == 0
+
+
+def test_bucketed_shards_do_not_rebuild(index_dir):
+    import resources
+    from vector_store import ShardedVectorStore
+
+    store = ShardedVectorStore(resources.get_chroma_client(), buckets=2)
+    try:
+        add_files(store, random_vectors(30), files=5)
+        assert store.shard_count() <= 2 and store.count() == 30
+        assert not store.begin_rebuild("f1")
+    finally:
+        store.close()
+
+
+def test_indexer_runs_on_sharded_backend(index_dir, monkeypatch):
+    import resources
+    from fake_gspread import FakeClient
+    from indexer import index_folder
+    from vector_store import ShardedVectorStore
+
+    monkeypatch.setattr(resources, "VECTOR_STORE", "sharded")
+    client = FakeClient()
+    for file_id in ("f1", "f2"):
+        client.add_spreadsheet(file_id, f"Spec {file_id}", {"Screens": [["Mã", "Tên"], [f"{file_id}-001", "Đăng nhập"]]},
+                               folder_id="folder")
+
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="cell")["success"]
+    collection = resources.get_collection()
+    assert isinstance(collection, ShardedVectorStore)
+    assert collection.count() == 8 and collection.shard_count() == 2
+
+    # Đổi granularity: mỗi file được dựng lại trong collection mới rồi đổi định tuyến
+    assert index_folder("folder", None, client=client, reads_per_minute=1e9, granularity="row")["success"]
+    assert collection.count() == resources.get_lexical_index().count() == 4
+    assert len(resources.get_chroma_client().list_collections()) == 2
+
+
+def test_full_file_reindex_goes_through_rebuild(index_dir, monkeypatch):
+    import indexer
+    import resources
+    from fake_gspread import FakeClient
+
+    monkeypatch.setattr(resources, "VECTOR_STORE", "sharded")
+    client = FakeClient()
+    values = [["Mã", "Tên"], ["f1-001", "Đăng nhập"], ["f1-002", "Báo cáo"]]
+    client.add_spreadsheet("f1", "Spec f1", {"Screens": values}, folder_id="folder")
+    assert indexer.index_folder("folder", None, client=client, reads_per_minute=1e9)["success"]
+    collection = resources.get_collection()
+    collections = len(resources.get_chroma_client().list_collections())
+
+    # Lỗi giữa lúc dựng lại (đổi granularity): bản cũ còn nguyên, không sót collection hay định tuyến nào
+    plan = indexer.iter_spreadsheet_ops
+
+    def failing_plan(*args, **kwargs):
+        for op in plan(*args, **kwargs):
+            yield op
+            if op[0] == "sheet_end":
+                raise RuntimeError("mất kết nối")
+
+    monkeypatch.setattr(indexer, "iter_spreadsheet_ops", failing_plan)
+    assert not indexer.handle_new_file(client.files["f1"], None, client=client, granularity="row")["success"]
+    assert collection.count() == 6
+    assert len(resources.get_chroma_client().list_collections()) == collections
+    assert collection._conn.execute("SELECT COUNT(*) FROM staging_docs").fetchone()[0] == 0
+
+    # Index không dùng manifest ghi lại cả file: id của hàng đã xóa trên sheet không còn sót lại
+    monkeypatch.setattr(indexer, "iter_spreadsheet_ops", plan)
+    values.pop()
+    assert indexer.index_folder("folder", None, client=client, reads_per_minute=1e9, incremental=False)["success"]
+    assert collection.count() == 4
+    assert all("f1-002" not in document for document in collection.get()["documents"])
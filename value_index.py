@@ -0,0 +1,285 @@
+"""Index có cấu trúc cho các ô số, ngày tháng và boolean
+
+Indexer không đưa các ô này vào Chroma (embed một con số không giúp gì cho tìm kiếm ngữ
+nghĩa) mà ghi chúng vào bảng sqlite theo (file, tab, cột, hàng) cùng giá trị dạng số, để
+tra cứu chính xác hoặc theo khoảng bằng cú pháp trong ô tìm kiếm:
+
+    col:Giá > 100000
+    col:"Ngày tạo" >= 01/03/2024 col:"Ngày tạo" < 2024-04-01
+    col:C = 42 màn hình đăng nhập
+
+Tên sau `col:` là tiêu đề cột (không phân biệt hoa thường) hoặc tên cột (A, B, ..., AA).
+Nhiều điều kiện được kết hợp bằng AND trên cùng một hàng.
+"""
+import math
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Value index nằm cạnh thư mục ./chroma_db
+VALUE_INDEX_PATH = "./value_index.sqlite3"
+
+# Các loại giá trị được tách khỏi văn bản
+NUMBER = "number"
+DATE = "date"
+BOOLEAN = "boolean"
+
+# Số kết quả tối đa của một lần tra cứu
+DEFAULT_LOOKUP_LIMIT = 500
+
+BOOLEAN_VALUES = {"true": 1.0, "false": 0.0, "đúng": 1.0, "sai": 0.0, "có": 1.0, "không": 0.0}
+
+_NUMBER_RE = re.compile(r"^[+-]?(?:(?:\d+|\d{1,3}(?:,\d{3})+)(?:\.\d+)?|\.\d+)(?:[eE][+-]?\d+)?$")
+_DATE_RES = (
+    # dd/mm/yyyy (hoặc mm/dd/yyyy nếu không hợp lệ theo ngày trước), kèm giờ tùy chọn
+    (re.compile(r"^(\d{1,2})/(\d{1,2})/(\d{2,4})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$"), "dmy"),
+    (re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})(?:[ T](\d{1,2}):(\d{2})(?::(\d{2}))?)?$"), "ymd"),
+)
+
+# col:<tiêu đề hoặc "tiêu đề có dấu cách"> <toán tử> <giá trị>
+_CONDITION_RE = re.compile(
+    r'(?<!\S)col:(?:"([^"]+)"|([^\s<>=!"]+))\s*(>=|<=|==|=|>|<)\s*("[^"]*"|[^\s"]+)')
+_COLUMN_LETTERS_RE = re.compile(r"^[A-Z]{1,3}$")
+
+
+def _parse_date(text: str) -> Optional[float]:
+    """Số ngày (kèm phần lẻ của giờ) từ 01/01/0001 của một ngày tháng, None nếu không phải ngày"""
+    for pattern, order in _DATE_RES:
+        match = pattern.match(text)
+        if not match:
+            continue
+        first, second, third = (int(part) for part in match.groups()[:3])
+        hour, minute, second_of_minute = (int(part or 0) for part in match.groups()[3:])
+        if order == "ymd":
+            candidates = [(first, second, third)]
+        else:
+            year = third + 2000 if third < 100 else third
+            candidates = [(year, second, first), (year, first, second)]
+        for year, month, day in candidates:
+            try:
+                moment = datetime(year, month, day, hour, minute, second_of_minute)
+            except ValueError:
+                continue
+            return moment.toordinal() + (hour * 3600 + minute * 60 + second_of_minute) / 86400
+    return None
+
+
+def classify_value(value: str) -> Optional[Tuple[str, float]]:
+    """(loại, giá trị dạng số) của một ô số, ngày tháng hoặc boolean; None nếu là văn bản
+
+    Số có thể có dấu phẩy ngăn cách hàng nghìn (1,250,000); ngày tháng theo dd/mm/yyyy
+    hoặc yyyy-mm-dd và được đổi thành số ngày để so sánh theo khoảng.
+    """
+    text = value.strip()
+    if not text:
+        return None
+    flag = BOOLEAN_VALUES.get(text.lower())
+    if flag is not None:
+        return BOOLEAN, flag
+    if _NUMBER_RE.match(text):
+        number = float(text.replace(",", ""))
+        return (NUMBER, number) if math.isfinite(number) else None
+    ordinal = _parse_date(text)
+    if ordinal is not None:
+        return DATE, ordinal
+    return None
+
+
+def normalize_header(header: str) -> str:
+    """Tiêu đề cột dùng để so khớp với `col:` (bỏ khoảng trắng thừa, không phân biệt hoa thường)"""
+    return " ".join(header.split()).casefold()
+
+
+def parse_value_query(query: str) -> Tuple[List[Dict], str]:
+    """Tách các điều kiện `col:<cột> <toán tử> <giá trị>` khỏi truy vấn
+
+    Trả về (điều kiện, phần văn bản còn lại). Mỗi điều kiện là dict {column, op, kind,
+    low, high, include_low, include_high}. Giá trị phải là số, ngày tháng hoặc boolean.
+    """
+    conditions = []
+    for match in _CONDITION_RE.finditer(query):
+        column = (match.group(1) or match.group(2)).strip()
+        op, raw = match.group(3), match.group(4).strip('"')
+        classified = classify_value(raw)
+        if classified is None:
+            raise ValueError(f"col:{column} {op} {raw}: giá trị phải là số, ngày tháng hoặc boolean")
+        kind, number = classified
+        low, high, include_low, include_high = None, None, True, True
+        if op in ("=", "=="):
+            low = high = number
+            # So sánh bằng một ngày (không kèm giờ) khớp cả ngày đó
+            if kind == DATE and number == int(number):
+                high, include_high = number + 1, False
+        elif op in (">", ">="):
+            low, include_low = number, op == ">="
+        else:
+            high, include_high = number, op == "<="
+        conditions.append({"column": column, "op": op, "kind": kind, "low": low, "high": high,
+                           "include_low": include_low, "include_high": include_high})
+    text = " ".join(_CONDITION_RE.sub(" ", query).split())
+    return conditions, text
+
+
+def _condition_sql(condition: Dict, alias: str) -> Tuple[str, List]:
+    column = condition["column"]
+    if _COLUMN_LETTERS_RE.match(column):
+        clauses, params = [f"({alias}.header = ? OR {alias}.col = ?)"], [normalize_header(column), column]
+    else:
+        clauses, params = [f"{alias}.header = ?"], [normalize_header(column)]
+    clauses.append(f"{alias}.kind = ?")
+    params.append(condition["kind"])
+    if condition["low"] is not None:
+        clauses.append(f"{alias}.num {'>=' if condition['include_low'] else '>'} ?")
+        params.append(condition["low"])
+    if condition["high"] is not None:
+        clauses.append(f"{alias}.num {'<=' if condition['include_high'] else '<'} ?")
+        params.append(condition["high"])
+    return " AND ".join(clauses), params
+
+
+class ValueIndex:
+    """Các ô số, ngày tháng và boolean theo (file, tab, cột, hàng), đồng bộ với manifest
+
+    Được ChromaBatchWriter cập nhật theo từng vùng ô (cùng khóa với manifest): mỗi lần
+    một vùng ô được index lại, các giá trị cũ của nó được thay bằng giá trị mới.
+    """
+
+    def __init__(self, path: str = VALUE_INDEX_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS cell_values (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                col TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                unit TEXT NOT NULL,
+                header TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                num REAL NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (file_id, sheet_id, col, row)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS tabs (
+                file_id TEXT NOT NULL,
+                sheet_id TEXT NOT NULL,
+                file_name TEXT,
+                tab_name TEXT,
+                PRIMARY KEY (file_id, sheet_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cell_values_unit ON cell_values (file_id, sheet_id, unit);
+            CREATE INDEX IF NOT EXISTS cell_values_header ON cell_values (header, kind, num);
+            CREATE INDEX IF NOT EXISTS cell_values_col ON cell_values (col, kind, num);
+        """)
+        self._conn.commit()
+
+    def replace(self, units: Iterable[Tuple]) -> None:
+        """Thay giá trị của các vùng ô
+
+        Mỗi phần tử là (file_id, file_name, sheet_id, tab_name, vùng ô, values) với values là
+        list (cột, hàng, tiêu đề, loại, giá trị dạng số, giá trị gốc); values rỗng là xóa.
+        """
+        units = list(units)
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "DELETE FROM cell_values WHERE file_id = ? AND sheet_id = ? AND unit = ?",
+                [(file_id, sheet_id, unit) for file_id, _, sheet_id, _, unit, _ in units])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cell_values (file_id, sheet_id, col, row, unit, header, kind, num, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(file_id, sheet_id, col, row, unit, normalize_header(header), kind, number, value)
+                 for file_id, _, sheet_id, _, unit, values in units
+                 for col, row, header, kind, number, value in values])
+            self._conn.executemany(
+                "INSERT INTO tabs (file_id, sheet_id, file_name, tab_name) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(file_id, sheet_id) DO UPDATE SET "
+                "file_name = COALESCE(excluded.file_name, tabs.file_name), "
+                "tab_name = COALESCE(excluded.tab_name, tabs.tab_name)",
+                {(file_id, sheet_id, file_name, tab_name)
+                 for file_id, file_name, sheet_id, tab_name, _, values in units if values})
+            # Tab không còn giá trị nào (các vùng ô của nó vừa bị xóa hết)
+            self._conn.executemany(
+                "DELETE FROM tabs WHERE file_id = ? AND sheet_id = ? AND NOT EXISTS "
+                "(SELECT 1 FROM cell_values v WHERE v.file_id = tabs.file_id AND v.sheet_id = tabs.sheet_id)",
+                {(file_id, sheet_id) for file_id, _, sheet_id, _, _, values in units if not values})
+
+    def remove_file(self, file_id: str) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM cell_values WHERE file_id = ?", (file_id,))
+            self._conn.execute("DELETE FROM tabs WHERE file_id = ?", (file_id,))
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM cell_values").fetchone()[0]
+
+    def _select(self, columns: str, conditions: List[Dict], filters: Optional[Dict],
+                join: str = "") -> Tuple[str, List]:
+        if not conditions:
+            raise ValueError("Cần ít nhất một điều kiện col:")
+        where, params = _condition_sql(conditions[0], "v")
+        # Các điều kiện sau phải thỏa trên cùng hàng với ô của điều kiện đầu
+        for condition in conditions[1:]:
+            clause, clause_params = _condition_sql(condition, "w")
+            where += (" AND EXISTS (SELECT 1 FROM cell_values w WHERE w.file_id = v.file_id "
+                      f"AND w.sheet_id = v.sheet_id AND w.row = v.row AND {clause})")
+            params += clause_params
+        for key in ("file_id", "sheet_id"):
+            if (filters or {}).get(key):
+                where += f" AND v.{key} = ?"
+                params.append(str(filters[key]))
+        return f"SELECT {columns} FROM cell_values v {join} WHERE {where}", params
+
+    def lookup(self, conditions: List[Dict], filters: Optional[Dict] = None,
+               limit: int = DEFAULT_LOOKUP_LIMIT) -> List[Dict]:
+        """Các ô thỏa điều kiện đầu (trên các hàng thỏa mọi điều kiện), theo file, tab và hàng
+
+        `filters` ({file_id, sheet_id}) giới hạn phạm vi giống bộ lọc của tìm kiếm.
+        """
+        query, params = self._select(
+            "v.file_id, t.file_name, v.sheet_id, t.tab_name, v.col, v.row, v.kind, v.num, v.value",
+            conditions, filters, join="LEFT JOIN tabs t ON t.file_id = v.file_id AND t.sheet_id = v.sheet_id")
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY v.file_id, v.sheet_id, v.row LIMIT ?",
+                                      params + [limit]).fetchall()
+        return [
+            {"file_id": file_id, "file_name": file_name or file_id, "sheet_id": sheet_id,
+             "tab_name": tab_name or sheet_id, "col": col, "row": row, "range": f"{col}{row}",
+             "kind": kind, "num": number, "value": value}
+            for file_id, file_name, sheet_id, tab_name, col, row, kind, number, value in rows
+        ]
+
+    def matching_rows(self, conditions: List[Dict], filters: Optional[Dict] = None) -> Set[Tuple[str, str, int]]:
+        """(file_id, sheet_id, hàng) của các hàng thỏa mọi điều kiện"""
+        query, params = self._select("DISTINCT v.file_id, v.sheet_id, v.row", conditions, filters)
+        with self._lock:
+            return set(self._conn.execute(query, params))
+
+    def dump(self) -> Dict[str, List[list]]:
+        """Toàn bộ index (các ô và tên file/tab), dùng cho index_snapshot"""
+        with self._lock:
+            return {
+                "values": [list(row) for row in self._conn.execute(
+                    "SELECT file_id, sheet_id, col, row, unit, header, kind, num, value FROM cell_values")],
+                "tabs": [list(row) for row in self._conn.execute(
+                    "SELECT file_id, sheet_id, file_name, tab_name FROM tabs")],
+            }
+
+    def restore(self, dump: Dict[str, List[list]]) -> None:
+        """Ghi kết quả của dump() vào index, thay các file có trong `dump`"""
+        file_ids = {(row[0],) for row in dump["values"]} | {(row[0],) for row in dump["tabs"]}
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM cell_values WHERE file_id = ?", file_ids)
+            self._conn.executemany("DELETE FROM tabs WHERE file_id = ?", file_ids)
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cell_values (file_id, sheet_id, col, row, unit, header, kind, num, value) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", dump["values"])
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO tabs (file_id, sheet_id, file_name, tab_name) VALUES (?, ?, ?, ?)",
+                dump["tabs"])
+
+    def close(self) -> None:
+        self._conn.close()
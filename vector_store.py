@@ -0,0 +1,801 @@
+"""Vector store dùng cho spec_collection
+
+Indexer và tìm kiếm chỉ dùng một phần nhỏ API collection của Chroma (upsert, delete,
+query, get, count). VectorStore mô tả phần đó; collection của Chroma đã thỏa mãn nó,
+còn CompactVectorStore là backend gọn hơn: vector được lượng tử hóa float16/int8 trong
+file memory-mapped và được chấm điểm bằng NumPy, có thể re-rank chính xác trên float32.
+ShardedVectorStore chia dữ liệu thành nhiều collection Chroma (theo file hoặc theo hash)
+và trộn kết quả truy vấn của các shard.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import uuid
+import zlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from metrics import REGISTRY
+
+# Thư mục của backend compact, nằm cạnh ./chroma_db
+COMPACT_STORE_PATH = "./compact_store"
+
+DTYPES = ("float16", "int8")
+DEFAULT_DTYPE = "int8"
+
+# Số ứng viên lấy ra trước khi re-rank = n_results * RERANK_FACTOR
+RERANK_FACTOR = 4
+
+# Số hàng được chấm điểm mỗi lần, giữ bộ nhớ tạm của một truy vấn không đổi theo kích thước index
+SCORE_BLOCK_ROWS = 4096
+
+# Dung lượng tối thiểu (số vector) khi cấp phát file
+MIN_CAPACITY = 1024
+
+
+class VectorStore(ABC):
+    """Phần API collection mà indexer, BM25 sync và tìm kiếm sử dụng
+
+    Kết quả của `query` và `get` có cùng dạng với Chroma: query trả về
+    {"ids": [[...]], "documents": [[...]], "metadatas": [[...]], "distances": [[...]]}
+    (mỗi truy vấn một danh sách), get trả về {"ids": [...], "documents": [...], "metadatas": [...]}.
+    `where` của query dùng cú pháp Chroma, tối thiểu {key: value} và {"$and": [...]}.
+    Backend mới phải cài đặt đủ các method dưới đây thì mới tạo được đối tượng.
+    """
+
+    @abstractmethod
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        ...
+
+    @abstractmethod
+    def query(self, query_texts: Optional[List[str]] = None, n_results: int = 10,
+              query_embeddings: Optional[List[List[float]]] = None, where: Optional[Dict] = None,
+              include: Optional[List[str]] = None) -> Dict:
+        ...
+
+    @abstractmethod
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict:
+        ...
+
+    @abstractmethod
+    def count(self) -> int:
+        ...
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class CompactVectorStore(VectorStore):
+    """Vector store lượng tử hóa trong file memory-mapped, chấm điểm cosine bằng NumPy
+
+    Mỗi vector được chuẩn hóa rồi lưu dạng float16 (2 byte/chiều) hoặc int8 với một hệ số
+    scale cho mỗi vector (1 byte/chiều), so với 4 byte/chiều cộng đồ thị HNSW của Chroma.
+    Mở store chỉ map các file chứ không đọc vào bộ nhớ. Với `rerank=True`, vector float32
+    được lưu thêm trong file riêng và chỉ các ứng viên tốt nhất được chấm lại chính xác.
+    Document và metadata nằm trong sqlite; slot của vector bị xóa được dùng lại. Mỗi giá
+    trị metadata được index theo (key, value) để truy vấn có `where` chỉ chấm điểm các
+    vector thỏa điều kiện.
+    `distances` trả về là khoảng cách cosine (1 - cosine similarity).
+    """
+
+    # where được tra qua index (key, value), không cần đường chấm điểm riêng cho phạm vi nhỏ
+    indexed_where = True
+
+    def __init__(self, path: str = COMPACT_STORE_PATH, embedding_function: Optional[Callable] = None,
+                 dtype: str = DEFAULT_DTYPE, rerank: bool = False):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype phải là một trong {DTYPES}")
+        self.path = path
+        self.embedding_function = embedding_function
+        self._lock = threading.RLock()
+        os.makedirs(path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(path, "store.sqlite3"), check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        has_terms = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'terms'").fetchone() is not None
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rows (
+                slot INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                document TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            -- Giá trị metadata (dạng JSON) của từng slot, dùng cho where
+            CREATE TABLE IF NOT EXISTS terms (
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                slot INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS terms_lookup ON terms (key, value);
+            CREATE INDEX IF NOT EXISTS terms_slot ON terms (slot);
+        """)
+        if not has_terms:
+            # Store tạo trước khi có where: index metadata đã lưu
+            for slot, metadata in self._conn.execute("SELECT slot, metadata FROM rows").fetchall():
+                self._conn.executemany("INSERT INTO terms (key, value, slot) VALUES (?, ?, ?)",
+                                       self._terms(slot, json.loads(metadata)))
+        self._conn.commit()
+        meta = dict(self._conn.execute("SELECT key, value FROM meta").fetchall())
+        # Cấu hình của store đã tồn tại được giữ nguyên
+        self.dtype = meta.get("dtype", dtype)
+        self.rerank = meta.get("rerank", "1" if rerank else "0") == "1"
+        self.dim = int(meta["dim"]) if "dim" in meta else None
+        self.capacity = int(meta.get("capacity", 0))
+        self._free: List[int] = []
+        self._next_slot = 0
+        self._vectors = self._scales = self._exact = self._live = None
+        if self.dim:
+            self._open_files()
+            slots = [row[0] for row in self._conn.execute("SELECT slot FROM rows")]
+            self._next_slot = max(slots) + 1 if slots else 0
+            used = set(slots)
+            self._free = [slot for slot in range(self._next_slot) if slot not in used]
+
+    # --- Lưu trữ ---
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _map(self, name: str, dtype, shape) -> np.memmap:
+        filename = self._file(name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        # Tạo/mở rộng file trước khi map; phần mới được điền 0
+        with open(filename, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(filename, dtype=dtype, mode="r+", shape=shape)
+
+    def _open_files(self) -> None:
+        self._vectors = self._map(f"vectors.{self.dtype}", self.dtype, (self.capacity, self.dim))
+        self._live = self._map("live.u8", np.uint8, (self.capacity,))
+        self._scales = self._map("scales.f32", np.float32, (self.capacity,)) if self.dtype == "int8" else None
+        self._exact = self._map("exact.f32", np.float32, (self.capacity, self.dim)) if self.rerank else None
+
+    def _save_meta(self) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                [("dtype", self.dtype), ("rerank", "1" if self.rerank else "0"),
+                 ("dim", str(self.dim)), ("capacity", str(self.capacity))]
+            )
+
+    def _ensure_capacity(self, needed: int) -> None:
+        if needed <= self.capacity:
+            return
+        self.capacity = max(MIN_CAPACITY, needed, self.capacity * 2)
+        for array in (self._vectors, self._scales, self._exact, self._live):
+            if array is not None:
+                array.flush()
+        self._open_files()
+        self._save_meta()
+
+    def _allocate(self, count: int) -> List[int]:
+        slots = []
+        while self._free and len(slots) < count:
+            slots.append(self._free.pop())
+        while len(slots) < count:
+            slots.append(self._next_slot)
+            self._next_slot += 1
+        return slots
+
+    def _encode(self, vectors: np.ndarray):
+        """Lượng tử hóa các vector đã chuẩn hóa, trả về (giá trị lưu, scale hoặc None)"""
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), None
+        scales = np.abs(vectors).max(axis=1)
+        scales[scales == 0] = 1.0
+        quantized = np.clip(np.rint(vectors / scales[:, None] * 127), -127, 127).astype(np.int8)
+        return quantized, (scales / 127).astype(np.float32)
+
+    @staticmethod
+    def _terms(slot: int, metadata: Dict) -> List[tuple]:
+        return [(key, json.dumps(value), slot) for key, value in (metadata or {}).items()
+                if isinstance(value, (str, int, float, bool))]
+
+    def _where_slots(self, where: Dict) -> np.ndarray:
+        """Các slot (đã sắp xếp) có metadata thỏa `where`"""
+        conditions = []
+
+        def collect(clause: Dict) -> None:
+            for key, value in clause.items():
+                if key == "$and":
+                    for item in value:
+                        collect(item)
+                elif key.startswith("$"):
+                    raise ValueError(f"Toán tử where chưa được hỗ trợ: {key}")
+                elif isinstance(value, dict):
+                    if set(value) != {"$eq"}:
+                        raise ValueError(f"Toán tử where chưa được hỗ trợ: {list(value)}")
+                    conditions.append((key, json.dumps(value["$eq"])))
+                else:
+                    conditions.append((key, json.dumps(value)))
+
+        collect(where)
+        if not conditions:
+            return np.arange(self._next_slot, dtype=np.int64)
+        query = " INTERSECT ".join(["SELECT slot FROM terms WHERE key = ? AND value = ?"] * len(conditions))
+        params = [item for condition in conditions for item in condition]
+        slots = [row[0] for row in self._conn.execute(query, params)]
+        return np.array(sorted(slots), dtype=np.int64)
+
+    # --- API giống collection ---
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: Optional[List[Dict]] = None,
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        if not ids:
+            return
+        if metadatas is None:
+            metadatas = [{} for _ in ids]
+        if embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("Cần embeddings hoặc embedding_function")
+            embeddings = self.embedding_function(list(documents))
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._ensure_capacity(MIN_CAPACITY)
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding có {vectors.shape[1]} chiều, store dùng {self.dim} chiều")
+
+            # id đã tồn tại được ghi đè tại slot cũ
+            existing = self._slots_of(ids)
+            new_ids = [doc_id for doc_id in dict.fromkeys(ids) if doc_id not in existing]
+            slots_by_id = dict(existing)
+            slots_by_id.update(zip(new_ids, self._allocate(len(new_ids))))
+            slots = np.array([slots_by_id[doc_id] for doc_id in ids], dtype=np.int64)
+            self._ensure_capacity(int(slots.max()) + 1)
+
+            encoded, scales = self._encode(vectors)
+            self._vectors[slots] = encoded
+            if scales is not None:
+                self._scales[slots] = scales
+            if self._exact is not None:
+                self._exact[slots] = vectors
+            self._live[slots] = 1
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO rows (slot, id, document, metadata) VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT(id) DO UPDATE SET document = excluded.document, metadata = excluded.metadata",
+                    [(int(slot), doc_id, document, json.dumps(metadata or {}, ensure_ascii=False))
+                     for slot, doc_id, document, metadata in zip(slots, ids, documents, metadatas)]
+                )
+                self._conn.executemany("DELETE FROM terms WHERE slot = ?", [(int(slot),) for slot in set(slots)])
+                latest = dict(zip((int(slot) for slot in slots), metadatas))
+                self._conn.executemany("INSERT INTO terms (key, value, slot) VALUES (?, ?, ?)",
+                                       [term for slot, metadata in latest.items()
+                                        for term in self._terms(slot, metadata)])
+            self._flush()
+
+    def _slots_of(self, ids: List[str]) -> Dict[str, int]:
+        found = {}
+        unique_ids = list(dict.fromkeys(ids))
+        for start in range(0, len(unique_ids), 500):
+            batch = unique_ids[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self._conn.execute(
+                f"SELECT id, slot FROM rows WHERE id IN ({placeholders})", batch).fetchall())
+        return found
+
+    def _flush(self) -> None:
+        for array in (self._vectors, self._scales, self._exact, self._live):
+            if array is not None:
+                array.flush()
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids or self.dim is None:
+            return
+        with self._lock:
+            slots = self._slots_of(ids)
+            if not slots:
+                return
+            self._live[list(slots.values())] = 0
+            with self._conn:
+                self._conn.executemany("DELETE FROM rows WHERE slot = ?", [(slot,) for slot in slots.values()])
+                self._conn.executemany("DELETE FROM terms WHERE slot = ?", [(slot,) for slot in slots.values()])
+            self._free.extend(slots.values())
+            self._flush()
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows").fetchone()[0]
+
+    def _rows(self, slots: List[int]) -> Dict[int, tuple]:
+        rows = {}
+        for start in range(0, len(slots), 500):
+            batch = slots[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            for slot, doc_id, document, metadata in self._conn.execute(
+                    f"SELECT slot, id, document, metadata FROM rows WHERE slot IN ({placeholders})", batch):
+                rows[slot] = (doc_id, document, json.loads(metadata))
+        return rows
+
+    def _score(self, queries: np.ndarray, limit: int, allowed: Optional[np.ndarray] = None) -> List[tuple]:
+        """Chấm điểm theo từng khối, trả về (slots, scores) top `limit` cho mỗi truy vấn
+
+        Nếu có `allowed` (slot đã sắp xếp) thì chỉ đọc và chấm điểm các vector đó.
+        """
+        used = self._next_slot
+        best_slots = [np.empty(0, dtype=np.int64) for _ in queries]
+        best_scores = [np.empty(0, dtype=np.float32) for _ in queries]
+        total = used if allowed is None else len(allowed)
+        for start in range(0, total, SCORE_BLOCK_ROWS):
+            end = min(start + SCORE_BLOCK_ROWS, total)
+            if allowed is None:
+                slots = np.arange(start, end)
+                rows = slice(start, end)
+            else:
+                slots = rows = allowed[start:end]
+            block = np.asarray(self._vectors[rows], dtype=np.float32)
+            scores = queries @ block.T
+            if self._scales is not None:
+                scores *= self._scales[rows]
+            scores[:, self._live[rows] == 0] = -np.inf
+            for index in range(len(queries)):
+                row = scores[index]
+                k = min(limit, len(row))
+                top = np.argpartition(-row, k - 1)[:k]
+                best_slots[index] = np.concatenate([best_slots[index], slots[top]])
+                best_scores[index] = np.concatenate([best_scores[index], row[top]])
+        results = []
+        for slots, scores in zip(best_slots, best_scores):
+            keep = np.isfinite(scores)
+            slots, scores = slots[keep], scores[keep]
+            order = np.argsort(-scores, kind="stable")[:limit]
+            results.append((slots[order], scores[order]))
+        return results
+
+    def query(self, query_texts: Optional[List[str]] = None, n_results: int = 10,
+              query_embeddings: Optional[List[List[float]]] = None, where: Optional[Dict] = None,
+              include: Optional[List[str]] = None, rerank: Optional[bool] = None) -> Dict:
+        if query_embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("Cần query_embeddings hoặc embedding_function")
+            query_embeddings = self.embedding_function(list(query_texts))
+        queries = _normalize(np.asarray(query_embeddings, dtype=np.float32))
+        empty = {"ids": [[] for _ in queries], "documents": [[] for _ in queries],
+                 "metadatas": [[] for _ in queries], "distances": [[] for _ in queries]}
+        with self._lock:
+            if self.dim is None or not self.count():
+                return empty
+            allowed = self._where_slots(where) if where else None
+            if allowed is not None and not len(allowed):
+                return empty
+            rerank = self.rerank if rerank is None else rerank and self._exact is not None
+            candidates = self._score(queries, n_results * RERANK_FACTOR if rerank else n_results, allowed)
+            if rerank:
+                reranked = []
+                for query, (slots, _) in zip(queries, candidates):
+                    # Chỉ đọc vector float32 của các ứng viên từ file
+                    exact = np.asarray(self._exact[np.sort(slots)], dtype=np.float32) @ query
+                    order = np.argsort(-exact, kind="stable")[:n_results]
+                    reranked.append((np.sort(slots)[order], exact[order]))
+                candidates = reranked
+            rows = self._rows(sorted({int(slot) for slots, _ in candidates for slot in slots}))
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for slots, scores in candidates:
+            hits = [(rows[int(slot)], float(score)) for slot, score in zip(slots, scores) if int(slot) in rows]
+            result["ids"].append([row[0] for row, _ in hits])
+            result["documents"].append([row[1] for row, _ in hits])
+            result["metadatas"].append([row[2] for row, _ in hits])
+            result["distances"].append([1.0 - score for _, score in hits])
+        return result
+
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict:
+        with self._lock:
+            if ids is not None:
+                found: Dict[str, tuple] = {}
+                for start in range(0, len(ids), 500):
+                    batch = ids[start:start + 500]
+                    placeholders = ",".join("?" * len(batch))
+                    for slot, doc_id, document, metadata in self._conn.execute(
+                            f"SELECT slot, id, document, metadata FROM rows WHERE id IN ({placeholders})", batch):
+                        found[doc_id] = (slot, document, json.loads(metadata))
+                ordered = [(found[doc_id][0], doc_id, *found[doc_id][1:]) for doc_id in ids if doc_id in found]
+            else:
+                rows = self._conn.execute(
+                    "SELECT slot, id, document, metadata FROM rows ORDER BY slot LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset or 0)
+                ).fetchall()
+                ordered = [(slot, doc_id, document, json.loads(metadata)) for slot, doc_id, document, metadata in rows]
+            result = {
+                "ids": [row[1] for row in ordered],
+                "documents": [row[2] for row in ordered],
+                "metadatas": [row[3] for row in ordered],
+            }
+            if include and "embeddings" in include:
+                result["embeddings"] = self._decode([row[0] for row in ordered]).tolist()
+        return result
+
+    def _decode(self, slots: List[int]) -> np.ndarray:
+        """Vector (đã chuẩn hóa) của các slot: bản float32 nếu có, ngược lại giải lượng tử hóa"""
+        if not slots:
+            return np.empty((0, self.dim or 0), dtype=np.float32)
+        if self._exact is not None:
+            return np.asarray(self._exact[slots], dtype=np.float32)
+        vectors = np.asarray(self._vectors[slots], dtype=np.float32)
+        if self._scales is not None:
+            vectors *= self._scales[slots][:, None]
+        return vectors
+
+    def stats(self) -> Dict:
+        """Số vector, dung lượng trên đĩa của phần vector và cấu hình"""
+        with self._lock:
+            files = [f"vectors.{self.dtype}", "live.u8", "scales.f32", "exact.f32"]
+            sizes = {name: os.path.getsize(self._file(name)) for name in files if os.path.exists(self._file(name))}
+            return {"count": self.count(), "dtype": self.dtype, "dim": self.dim, "rerank": self.rerank,
+                    "capacity": self.capacity, "bytes": sizes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            self._vectors = self._scales = self._exact = self._live = None
+            self._conn.close()
+
+
+# Bảng định tuyến của ShardedVectorStore, nằm cạnh ./chroma_db
+SHARD_ROUTER_PATH = "./shard_router.sqlite3"
+
+# Tiền tố tên các collection shard trong Chroma
+SHARD_PREFIX = "spec_shard"
+
+# Số shard được truy vấn song song
+DEFAULT_SHARD_WORKERS = 8
+
+
+class ShardedVectorStore(VectorStore):
+    """Chia spec_collection thành nhiều collection Chroma: mỗi spreadsheet một shard, hoặc
+    `buckets` shard theo hash của file_id
+
+    Bảng định tuyến (sqlite) lưu collection đang dùng của mỗi shard và shard của mỗi id.
+    Xóa hết document của một shard là xóa cả collection. Với shard theo file, index lại
+    toàn bộ một file (begin_rebuild/commit_rebuild) ghi vào collection mới, định tuyến của
+    các id mới nằm riêng trong bảng staging_docs, rồi đổi định tuyến trong một transaction:
+    truy vấn luôn thấy bản cũ hoặc bản mới trọn vẹn, còn abort_rebuild không để lại gì.
+    Truy vấn được embed một lần, gửi song song tới các shard rồi trộn top-k bằng heap;
+    filter file_id chỉ truy vấn đúng shard đó, các filter khác được tỉa qua `facet_index`
+    (bỏ các shard không có document nào thỏa filter).
+    """
+
+    def __init__(self, client, embedding_function: Optional[Callable] = None, path: str = SHARD_ROUTER_PATH,
+                 buckets: int = 0, facet_index=None, workers: int = DEFAULT_SHARD_WORKERS):
+        self.client = client
+        self.embedding_function = embedding_function
+        self.buckets = buckets
+        self.facet_index = facet_index
+        self.workers = max(1, workers)
+        self._lock = threading.RLock()
+        self._collections: Dict[str, object] = {}
+        self._executor = None
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            -- Collection đang phục vụ truy vấn và collection đang được dựng lại của mỗi shard
+            CREATE TABLE IF NOT EXISTS shards (
+                shard TEXT PRIMARY KEY,
+                collection TEXT NOT NULL,
+                staging TEXT,
+                docs INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS docs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                shard TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS docs_shard ON docs (shard);
+            -- Id được ghi vào collection đang dựng lại, chuyển sang docs khi commit
+            CREATE TABLE IF NOT EXISTS staging_docs (
+                id TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                shard TEXT NOT NULL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS staging_docs_shard ON staging_docs (shard);
+        """)
+        self._conn.commit()
+
+    def shard_of(self, file_id: str) -> str:
+        if not self.buckets:
+            return file_id
+        return f"bucket_{zlib.crc32(file_id.encode('utf-8')) % self.buckets}"
+
+    def _new_collection_name(self, shard: str) -> str:
+        # Tên collection của Chroma chỉ gồm chữ, số, "_" và "-", tối đa 63 ký tự
+        return f"{SHARD_PREFIX}_{hashlib.sha1(shard.encode('utf-8')).hexdigest()[:16]}_{uuid.uuid4().hex[:8]}"
+
+    def _collection(self, name: str):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = self.client.get_or_create_collection(
+                    name=name, embedding_function=self.embedding_function)
+            return self._collections[name]
+
+    def _drop_collection(self, name: str) -> None:
+        with self._lock:
+            self._collections.pop(name, None)
+        try:
+            self.client.delete_collection(name)
+        except ValueError:
+            # Collection đã bị xóa (ví dụ bởi process khác)
+            pass
+
+    def _routes(self, shards: Optional[List[str]] = None) -> Dict[str, tuple]:
+        """shard -> (collection, staging, docs)"""
+        with self._lock:
+            if shards is None:
+                rows = self._conn.execute("SELECT shard, collection, staging, docs FROM shards").fetchall()
+            else:
+                rows = []
+                for start in range(0, len(shards), 500):
+                    batch = shards[start:start + 500]
+                    rows += self._conn.execute(
+                        f"SELECT shard, collection, staging, docs FROM shards WHERE shard IN ({','.join('?' * len(batch))})",
+                        batch).fetchall()
+        return {row[0]: row[1:] for row in rows}
+
+    def _shards_of_ids(self, ids: List[str], table: str = "docs") -> Dict[str, List[str]]:
+        grouped: Dict[str, List[str]] = {}
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                batch = ids[start:start + 500]
+                for doc_id, shard in self._conn.execute(
+                        f"SELECT id, shard FROM {table} WHERE id IN ({','.join('?' * len(batch))})", batch):
+                    grouped.setdefault(shard, []).append(doc_id)
+        return grouped
+
+    def _update_counts(self, shards: List[str]) -> None:
+        self._conn.executemany(
+            "UPDATE shards SET docs = (SELECT COUNT(*) FROM docs WHERE docs.shard = shards.shard) WHERE shard = ?",
+            [(shard,) for shard in shards])
+
+    # --- API giống collection ---
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict],
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        grouped: Dict[str, List[int]] = {}
+        shard_by_id: Dict[str, str] = {}
+        for index, metadata in enumerate(metadatas):
+            shard = shard_by_id[ids[index]] = self.shard_of(str(metadata["file_id"]))
+            grouped.setdefault(shard, []).append(index)
+        with self._lock:
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO shards (shard, collection) VALUES (?, ?)",
+                    [(shard, self._new_collection_name(shard)) for shard in grouped])
+            previous = self._shards_of_ids(list(ids))
+            routes = self._routes(sorted(set(grouped) | set(previous)))
+            # Id đã nằm ở shard khác (ví dụ sau khi đổi số bucket) bị xóa khỏi shard cũ
+            for shard, moved in previous.items():
+                moved = [doc_id for doc_id in moved if shard_by_id[doc_id] != shard]
+                if moved and shard in routes:
+                    self._collection(routes[shard][0]).delete(ids=moved)
+            for shard, indexes in grouped.items():
+                collection, staging, _ = routes[shard]
+                self._collection(staging or collection).upsert(
+                    ids=[ids[i] for i in indexes],
+                    documents=[documents[i] for i in indexes],
+                    metadatas=[metadatas[i] for i in indexes],
+                    embeddings=None if embeddings is None else [embeddings[i] for i in indexes])
+            with self._conn:
+                for table, staged in (("docs", False), ("staging_docs", True)):
+                    self._conn.executemany(
+                        f"INSERT OR REPLACE INTO {table} (id, file_id, shard) VALUES (?, ?, ?)",
+                        [(ids[i], str(metadatas[i]["file_id"]), shard) for shard, indexes in grouped.items()
+                         if bool(routes[shard][1]) == staged for i in indexes])
+                self._update_counts(list(routes))
+
+    def delete(self, ids: List[str]) -> None:
+        if not ids:
+            return
+        with self._lock:
+            grouped = self._shards_of_ids(list(ids))
+            staged = self._shards_of_ids(list(ids), table="staging_docs")
+            routes = self._routes(sorted(set(grouped) | set(staged)))
+            emptied, served = [], []
+            for shard, shard_ids in grouped.items():
+                collection, staging, docs = routes[shard]
+                if staging:
+                    # Khi đang dựng lại, bản cũ vẫn phục vụ truy vấn tới lúc commit thay cả shard
+                    continue
+                served += shard_ids
+                if len(shard_ids) >= docs:
+                    # Xóa hết document của shard: bỏ luôn collection thay vì xóa từng id
+                    self._drop_collection(collection)
+                    emptied.append(shard)
+                    continue
+                self._collection(collection).delete(ids=shard_ids)
+            for shard, shard_ids in staged.items():
+                self._collection(routes[shard][1]).delete(ids=shard_ids)
+            staged_ids = [doc_id for shard_ids in staged.values() for doc_id in shard_ids]
+            with self._conn:
+                for table, table_ids in (("docs", served), ("staging_docs", staged_ids)):
+                    for start in range(0, len(table_ids), 500):
+                        batch = table_ids[start:start + 500]
+                        self._conn.execute(f"DELETE FROM {table} WHERE id IN ({','.join('?' * len(batch))})", batch)
+                self._conn.executemany("DELETE FROM shards WHERE shard = ?", [(shard,) for shard in emptied])
+                self._update_counts([shard for shard in grouped if shard not in emptied])
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def shard_count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM shards").fetchone()[0]
+
+    def _target_shards(self, where: Optional[Dict]) -> Dict[str, tuple]:
+        """Các shard cần truy vấn với `where`"""
+        from facet_index import filters_from_where
+
+        filters = filters_from_where(where)
+        if filters.get("file_id"):
+            return self._routes([self.shard_of(filters["file_id"])])
+        if filters and self.facet_index is not None:
+            return self._routes(sorted({self.shard_of(file_id) for file_id in self.facet_index.scope_files(filters)}))
+        return self._routes()
+
+    def _query_shard(self, shard: str, route: tuple, query_embeddings: List[List[float]], n_results: int,
+                     where: Optional[Dict]) -> Dict:
+        collection, _, docs = route
+        kwargs = {"where": where} if where else {}
+        try:
+            return self._collection(collection).query(query_embeddings=query_embeddings,
+                                                      n_results=min(n_results, docs), **kwargs)
+        except Exception:
+            # Shard vừa được đổi sang collection mới hoặc bị xóa trong lúc truy vấn: đọc lại định tuyến
+            fresh = self._routes([shard]).get(shard)
+            if fresh is None:
+                return {}
+            if fresh[0] == collection:
+                raise
+            with self._lock:
+                self._collections.pop(collection, None)
+            return self._collection(fresh[0]).query(query_embeddings=query_embeddings,
+                                                    n_results=min(n_results, fresh[2]), **kwargs)
+
+    def query(self, query_texts: Optional[List[str]] = None, n_results: int = 10,
+              query_embeddings: Optional[List[List[float]]] = None, where: Optional[Dict] = None,
+              include: Optional[List[str]] = None) -> Dict:
+        if query_embeddings is None:
+            if self.embedding_function is None:
+                raise ValueError("Cần query_embeddings hoặc embedding_function")
+            query_embeddings = self.embedding_function(list(query_texts))
+        query_embeddings = [list(map(float, vector)) for vector in query_embeddings]
+        routes = {shard: route for shard, route in self._target_shards(where).items() if route[2] > 0}
+        REGISTRY.inc("vector_shards_queried_total", len(routes))
+        if len(routes) > 1:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="vector-shard")
+            futures = [self._executor.submit(self._query_shard, shard, route, query_embeddings, n_results, where)
+                       for shard, route in routes.items()]
+            partials = [future.result() for future in futures]
+        else:
+            partials = [self._query_shard(shard, route, query_embeddings, n_results, where)
+                        for shard, route in routes.items()]
+
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        for position in range(len(query_embeddings)):
+            # Kết quả của mỗi shard đã xếp theo khoảng cách: trộn k phần tử đầu bằng heap
+            ranked = [
+                [(partial["distances"][position][index], shard_index, index) for index in range(
+                    len(partial["ids"][position]))]
+                for shard_index, partial in enumerate(partials) if partial
+            ]
+            top = list(itertools.islice(heapq.merge(*ranked), n_results))
+            for key in result:
+                result[key].append([partials[shard_index][key][position][index]
+                                    for _, shard_index, index in top])
+        return result
+
+    def get(self, ids: Optional[List[str]] = None, limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Optional[List[str]] = None) -> Dict:
+        include = include or ["documents", "metadatas"]
+        if ids is None:
+            with self._lock:
+                ids = [row[0] for row in self._conn.execute(
+                    "SELECT id FROM docs ORDER BY id LIMIT ? OFFSET ?", (-1 if limit is None else limit, offset or 0))]
+        found: Dict[str, tuple] = {}
+        routes = self._routes()
+        for shard, shard_ids in self._shards_of_ids(list(ids)).items():
+            if shard not in routes:
+                continue
+            page = self._collection(routes[shard][0]).get(ids=shard_ids, include=include)
+            for index, doc_id in enumerate(page["ids"]):
+                found[doc_id] = tuple((page.get(key) or [None] * len(page["ids"]))[index]
+                                      for key in ("documents", "metadatas", "embeddings"))
+        ordered = [doc_id for doc_id in ids if doc_id in found]
+        result = {
+            "ids": ordered,
+            "documents": [found[doc_id][0] for doc_id in ordered],
+            "metadatas": [found[doc_id][1] for doc_id in ordered],
+        }
+        if "embeddings" in include:
+            result["embeddings"] = [found[doc_id][2] for doc_id in ordered]
+        return result
+
+    # --- Dựng lại một file ---
+
+    def begin_rebuild(self, file_id: str) -> bool:
+        """Các lần ghi tiếp theo của file đi vào một collection mới; False nếu shard không theo file"""
+        if self.buckets:
+            return False
+        # Lần dựng lại trước bị dừng giữa chừng
+        self.abort_rebuild(file_id)
+        with self._lock, self._conn:
+            name = self._new_collection_name(file_id)
+            self._conn.execute(
+                "INSERT INTO shards (shard, collection, staging) VALUES (?, ?, ?) "
+                "ON CONFLICT(shard) DO UPDATE SET staging = excluded.staging", (file_id, name, name))
+        return True
+
+    def commit_rebuild(self, file_id: str) -> None:
+        """Đổi định tuyến của file sang collection vừa dựng và xóa collection cũ"""
+        with self._lock:
+            route = self._routes([file_id]).get(file_id)
+            if route is None or not route[1]:
+                return
+            collection, staging, _ = route
+            staged = self._conn.execute("SELECT COUNT(*) FROM staging_docs WHERE shard = ?", (file_id,)).fetchone()[0]
+            with self._conn:
+                self._conn.execute("DELETE FROM docs WHERE shard = ?", (file_id,))
+                self._conn.execute("INSERT OR REPLACE INTO docs (id, file_id, shard) "
+                                   "SELECT id, file_id, shard FROM staging_docs WHERE shard = ?", (file_id,))
+                self._conn.execute("DELETE FROM staging_docs WHERE shard = ?", (file_id,))
+                if staged:
+                    self._conn.execute("UPDATE shards SET collection = staging, staging = NULL WHERE shard = ?",
+                                       (file_id,))
+                    self._update_counts([file_id])
+                else:
+                    # Bản mới của file không còn document nào: bỏ cả shard
+                    self._conn.execute("DELETE FROM shards WHERE shard = ?", (file_id,))
+            if collection != staging:
+                self._drop_collection(collection)
+            if not staged:
+                self._drop_collection(staging)
+
+    def abort_rebuild(self, file_id: str) -> None:
+        """Bỏ collection đang dựng, truy vấn tiếp tục dùng collection cũ"""
+        with self._lock:
+            route = self._routes([file_id]).get(file_id)
+            if route is None or not route[1]:
+                return
+            collection, staging, _ = route
+            with self._conn:
+                self._conn.execute("DELETE FROM staging_docs WHERE shard = ?", (file_id,))
+                if collection == staging:
+                    # Shard mới tạo trong lần dựng lại, chưa có bản cũ
+                    self._conn.execute("DELETE FROM shards WHERE shard = ?", (file_id,))
+                else:
+                    self._conn.execute("UPDATE shards SET staging = NULL WHERE shard = ?", (file_id,))
+            self._drop_collection(staging)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            self._conn.close()